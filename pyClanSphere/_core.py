@@ -11,7 +11,9 @@
 """
 
 import os
+from itertools import count
 from thread import allocate_lock
+from threading import Thread
 from time import time, sleep
 
 _setup_lock = allocate_lock()
@@ -133,11 +135,21 @@ def setup(instance_folder):
     return _create_pyClanSphere(instance_folder, in_reloader=False)
 
 
-def get_wsgi_app(instance_folder):
+def get_wsgi_app(instance_folder, reload_interval=None, drain_timeout=30):
     """This function returns a proxy WSGI application that dispatches to
     pyClanSphere or the web setup.  It is however not possible to use this function
     to set up multiple instances of pyClanSphere in the same python interpreter.
 
+    By default every request acquires a dispatcher lock and checks if the
+    configuration changed on the file system.  If `reload_interval` is given
+    (or the ``PYCLANSPHERE_RELOAD_INTERVAL`` environment variable is set, see
+    :func:`override_environ_config`) a lock-free dispatcher is returned
+    instead.  That one leaves the change detection to a watcher thread that
+    polls the configuration every `reload_interval` seconds.  Reloads are
+    done by draining: new requests wait until the requests that are already
+    running on the old application finished (or `drain_timeout` seconds
+    passed) before the application is swapped.
+
     This function MUST NOT BE CALLED for environments where anything but
     the WSGI server or pyClanSphere itself work with the pyClanSphere API.  The reloading
     process depends that only pyClanSphere controls stuff outside of the internal
@@ -147,6 +159,13 @@ def get_wsgi_app(instance_folder):
     # properly loaded before we create our proxy application.
     import pyClanSphere.application
 
+    if reload_interval is None:
+        reload_interval = os.environ.get('PYCLANSPHERE_RELOAD_INTERVAL')
+    if reload_interval:
+        return _make_lockfree_dispatcher(instance_folder,
+                                         float(reload_interval),
+                                         drain_timeout)
+
     _dispatch_lock = allocate_lock()
     def application(environ, start_response):
         _dispatch_lock.acquire()
@@ -168,8 +187,105 @@ def get_wsgi_app(instance_folder):
     return application
 
 
+def _make_lockfree_dispatcher(instance_folder, reload_interval, drain_timeout):
+    """Create the lock-free dispatcher described in :func:`get_wsgi_app`.
+
+    The steady-state path only registers the request in a dict (which is
+    atomic thanks to the GIL), reads the current application reference and
+    checks the reload flag.  The lock is only taken if the application has
+    to be created or swapped.
+    """
+    from werkzeug import ClosingIterator
+
+    swap_lock = allocate_lock()
+    watcher_lock = allocate_lock()
+    active_requests = {}
+    tickets = count()
+    # reload_pending is a list so that the closures below can modify it
+    reload_pending = [False]
+    watcher_started = [False]
+
+    def watch_config():
+        while 1:
+            sleep(reload_interval)
+            if reload_pending[0]:
+                continue
+            app = _application
+            try:
+                if app is not None and app.wants_reload:
+                    reload_pending[0] = True
+            except Exception:
+                # the application was unloaded while we checked it, the
+                # dispatcher takes care of it anyway.
+                pass
+
+    def start_watcher():
+        # threads do not survive a fork, so start the watcher lazily with
+        # the first request in every process
+        watcher_lock.acquire()
+        try:
+            if not watcher_started[0]:
+                thread = Thread(target=watch_config,
+                                name='pyClanSphere reload watcher')
+                thread.setDaemon(True)
+                thread.start()
+                watcher_started[0] = True
+        finally:
+            watcher_lock.release()
+
+    def swap_application():
+        swap_lock.acquire()
+        try:
+            app = _application
+            if app is not None and not reload_pending[0]:
+                return app
+            if reload_pending[0]:
+                # wait until requests running on the old application are
+                # done before we pull the modules away under them.
+                started = time()
+                while active_requests and time() < started + drain_timeout:
+                    sleep(0.01)
+                _unload_pyClanSphere()
+                app = None
+            try:
+                app = _create_pyClanSphere(instance_folder)
+            except InstanceNotInitialized:
+                from pyClanSphere.websetup import WebSetup
+                app = WebSetup(instance_folder)
+            reload_pending[0] = False
+            return app
+        finally:
+            swap_lock.release()
+
+    def application(environ, start_response):
+        if not watcher_started[0]:
+            start_watcher()
+        ticket = tickets.next()
+        while 1:
+            # register before looking at the flag, the swapping thread sets
+            # the flag before it waits for the running requests to drain.
+            active_requests[ticket] = True
+            app = _application
+            if app is not None and not reload_pending[0]:
+                break
+            active_requests.pop(ticket, None)
+            app = swap_application()
+            if app is not _application:
+                # the web setup is never registered as application and
+                # there is nothing to drain for it
+                break
+        try:
+            rv = app(environ, start_response)
+        except:
+            active_requests.pop(ticket, None)
+            raise
+        return ClosingIterator(rv, lambda: active_requests.pop(ticket, None))
+    return application
+
+
 def override_environ_config(pool_size=None, pool_recycle=None,
-                            pool_timeout=None, behind_proxy=None):
+                            pool_timeout=None, behind_proxy=None,
+                            reload_interval=None):
     """Some configuration parameters are not stored in the pyClanSphere.ini but
     in the os environment.  These are process wide configuration settings
     used for different deployments.
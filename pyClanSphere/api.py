@@ -13,8 +13,8 @@
 
 from pyClanSphere.application import (
     # Request/Response
-    Response, get_request, url_for, shared_url, add_link, add_meta,
-    add_script, add_header_snippet,
+    Response, get_request, url_for, shared_url, asset_urls, add_link,
+    add_meta, add_script, add_header_snippet,
 
     # Template helpers
     render_template, render_response,
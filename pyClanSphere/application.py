@@ -19,7 +19,6 @@ from inspect import getdoc
 from traceback import format_exception
 from pprint import pprint
 from StringIO import StringIO
-from datetime import datetime, timedelta
 
 from babel import Locale
 
@@ -28,7 +27,7 @@ from jinja2 import Environment, BaseLoader, TemplateNotFound, Markup
 from sqlalchemy.exceptions import SQLAlchemyError
 
 from werkzeug import Request as RequestBase, Response as ResponseBase, \
-     SharedDataMiddleware, url_quote, routing, redirect as _redirect, \
+     url_quote, routing, redirect as _redirect, \
      escape, cached_property, url_encode
 from werkzeug.exceptions import HTTPException, Forbidden, \
      NotFound
@@ -38,7 +37,8 @@ from pyClanSphere import _core, signals
 from pyClanSphere.environment import SHARED_DATA, BUILTIN_TEMPLATE_PATH, \
      BUILTIN_PLUGIN_FOLDER
 from pyClanSphere.database import db, cleanup_session
-from pyClanSphere.cache import get_cache, result as cached_result, get_jinja_cache
+from pyClanSphere.cache import get_cache, result as cached_result, get_jinja_cache, \
+     on_tags_invalidated, FragmentCacheExtension
 from pyClanSphere.utils import ClosingIterator, local, local_manager, dump_json, \
      htmlhelpers
 from pyClanSphere.utils.datastructures import ReadOnlyMultiMapping
@@ -46,6 +46,10 @@ from pyClanSphere.utils.exceptions import UserException
 
 from pyClanSphere._ext.postmarkup import create as postmarkup_create
 from pyClanSphere._ext.smiley import lib as smileys_lib
+from pyClanSphere.utils.markup import Renderer
+from pyClanSphere.utils.perf import RequestStats, PerfMonitor, \
+     StartupTimer, timed
+from pyClanSphere.utils.visits import VisitRecorder
 
 #: the default theme settings
 DEFAULT_THEME_SETTINGS = {
@@ -135,10 +139,28 @@ def url_for(endpoint, **args):
     return rv
 
 def shared_url(spec):
-    """Returns a URL to a shared resource."""
+    """Returns a URL to a shared resource.  If the static assets were built
+    the URL points to the fingerprinted copy of the file.
+    """
+    assets = get_application().assets
+    if assets is not None:
+        filename = assets.files.get(spec)
+        if filename is not None:
+            return url_for('core/assets', filename=filename)
     endpoint, filename = spec.split('::', 1)
     return url_for(endpoint + '/shared', filename=filename)
 
+def asset_urls(bundle):
+    """Returns the URLs to load an asset bundle, the URL of the built
+    bundle or the URLs of its files if the assets were not built.
+    """
+    app = get_application()
+    if app.assets is not None:
+        filename = app.assets.bundles.get(bundle)
+        if filename is not None:
+            return [url_for('core/assets', filename=filename)]
+    return [shared_url(spec) for spec in app.asset_bundles[bundle]]
+
 def add_link(rel, href, type, title=None, charset=None, media=None):
     """Add a new link to the metadata of the current page being processed."""
     local.page_metadata.append(('link', {
@@ -199,7 +221,7 @@ def render_template(template_name, _stream=False, **context):
 
     if _stream:
         return tmpl.stream(context)
-    return tmpl.render(context)
+    return timed('render', tmpl.render, context)
 
 def render_response(template_name, **context):
     """Like render_template but returns a response. If `_stream` is ``True``
@@ -447,34 +469,22 @@ class Request(RequestBase):
 
     def __init__(self, environ, app=None):
         RequestBase.__init__(self, environ)
+        # the application creates the stats earlier to time this method
+        if getattr(self, 'stats', None) is None:
+            self.stats = RequestStats()
         self.queries = []
         if app is None:
             app = get_application()
         self.app = app
 
-        engine = self.app.database_engine
-
-        # get the session and try to get the user object for this request.
-        from pyClanSphere.models import User
-        user = None
+        # get the session.  The user is loaded on first access.
         cookie_name = app.cfg['session_cookie_name']
         session = SecureCookie.load_cookie(self, cookie_name,
                                            app.secret_key)
         user_id = session.get('uid')
         if user_id:
-            user = User.query.options(db.eagerload('groups'),
-                                      db.eagerload('groups', '_privileges')) \
-                             .get(user_id)
-            now = datetime.utcnow()
-            # mark user online, though only once a minute to not mess with
-            # the database too much
-            if not user.last_visited or \
-                   ((now - user.last_visited) > timedelta(minutes=1)):
-               user.last_visited = now
-               db.commit()
-        if user is None:
-            user = User.query.get_nobody()
-        self.user = user
+            # mark user online, the visits are written in batches
+            app.visit_recorder.record(user_id)
         self.session = session
         self.per_page = None
         if 'per_page' in self.values:
@@ -483,6 +493,32 @@ class Request(RequestBase):
             except:
                 pass
 
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        """Uploaded files are streamed into an :class:`UploadStream`
+        that sniffs their type and enforces the limit of the type.
+        """
+        return UploadStream(self.app.upload_types,
+                            get_upload_folder(self.app),
+                            self.app.cfg['upload_max_size'] * 1024)
+
+    @cached_property
+    def user(self):
+        """The user of the current request, loaded on first access.  If
+        no one is logged in this is the anonymous user.
+        """
+        return timed('user', self._load_user)
+
+    def _load_user(self):
+        from pyClanSphere.models import User
+        user = None
+        user_id = self.session.get('uid')
+        if user_id:
+            user = User.query.get(user_id)
+        if user is None:
+            user = User.query.get_nobody()
+        return user
+
     @property
     def is_behind_proxy(self):
         """Are we behind a proxy?"""
@@ -549,6 +585,7 @@ class pyClanSphere(object):
             raise TypeError('cannot create %r instances. use the '
                             'pyClanSphere._core.setup() factory function.' %
                             self.__class__.__name__)
+        self.startup = StartupTimer()
         self.instance_folder = path.abspath(instance_folder)
         self.upgrade_lockfile = path.join(instance_folder,
                                           '.upgrade_in_progress')
@@ -562,7 +599,13 @@ class pyClanSphere(object):
 
         # and hook in the logger
         self.log = log.Logger(path.join(instance_folder, self.cfg['log_file']),
-                              self.cfg['log_level'])
+                              self.cfg['log_level'], self.cfg['log_format'],
+                              self.cfg['log_rotate_size'] * 1024,
+                              self.cfg['log_rotate_interval'] or None,
+                              self.cfg['log_rotate_keep'],
+                              self.cfg['log_queue_size'],
+                              self.cfg['log_queue_full'])
+        self.startup.lap('config')
 
         # the iid of the application
         self.iid = self.cfg['iid'].encode('utf-8')
@@ -574,8 +617,20 @@ class pyClanSphere(object):
                                                 self.instance_folder,
                                                 self.cfg['database_debug'])
 
+        # visits of users are written in batches
+        self.visit_recorder = VisitRecorder(self.database_engine)
+
+        # performance numbers of all requests
+        self.perf_monitor = PerfMonitor()
+
+        # outgoing mails that don't have to be sent during the request
+        from pyClanSphere.utils.mailqueue import MailQueue
+        self.mail_queue = MailQueue(self)
+
         # now setup the cache system
         self.cache = get_cache(self)
+        signals.cache_tags_invalidated.connect(on_tags_invalidated)
+        self.startup.lap('database and cache')
 
         # setup core package urls and shared stuff
         import pyClanSphere
@@ -589,6 +644,9 @@ class pyClanSphere(object):
         self._absolute_url_handlers = absolute_url_handlers[:]
         self._services = all_services.copy()
         self._shared_exports = {}
+        self._file_roots = {}
+        self.upload_types = []
+        self.asset_bundles = {}
         self._template_globals = {}
         self._template_filters = {}
         self._template_tests = {}
@@ -628,6 +686,11 @@ class pyClanSphere(object):
         from pyClanSphere.widgets import all_widgets
         self.widgets = dict((x.name, x) for x in all_widgets)
 
+        # uploaded user pictures
+        picture_size = lambda: self.cfg['avatar_max_size'] * 1024
+        for imgtype in PICTURE_TYPES:
+            self.add_upload_type(imgtype, image_sniffer(imgtype), picture_size)
+
         # add searchpath for plugins
         from pyClanSphere.pluginsystem import find_plugins, set_plugin_searchpath
         self.plugin_folder = path.join(instance_folder, 'plugins')
@@ -639,13 +702,17 @@ class pyClanSphere(object):
                     path.join(self.instance_folder, folder))
         self.plugin_searchpath.append(BUILTIN_PLUGIN_FOLDER)
         set_plugin_searchpath(self.plugin_searchpath)
+        self.startup.lap('core')
 
         # load the plugins
         self.plugins = {}
-        for plugin in find_plugins(self):
+        plugins = list(find_plugins(self))
+        self.startup.lap('plugin discovery')
+        for plugin in plugins:
             if plugin.active:
                 plugin.setup()
                 self.translations.merge(plugin.translations)
+                self.startup.lap('plugin ' + plugin.name)
             self.plugins[plugin.name] = plugin
 
         # set the active theme based on the config.
@@ -666,7 +733,8 @@ class pyClanSphere(object):
             return ''
 
         env = Environment(loader=ThemeLoader(self), bytecode_cache=get_jinja_cache(self),
-                          extensions=['jinja2.ext.i18n'], autoescape=True, trim_blocks=True)
+                          extensions=['jinja2.ext.i18n', FragmentCacheExtension],
+                          autoescape=True, trim_blocks=True)
         env.globals.update(
             cfg=self.cfg,
             theme=self.theme,
@@ -674,6 +742,7 @@ class pyClanSphere(object):
             url_for=url_for,
             signals=signals,
             shared_url=shared_url,
+            asset_urls=asset_urls,
             request=local('request'),
             sendsignal=sendsignal,
             render_widgets=lambda x=[]: Markup(render_template('_widgets.html', widgetoptions=x)),
@@ -708,7 +777,32 @@ class pyClanSphere(object):
         # now add the middleware for static file serving
         self.add_shared_exports('core', SHARED_DATA)
         self.add_shared_exports('userpics', path.join(self.instance_folder, 'userpics'))
-        self.add_middleware(SharedDataMiddleware, self._shared_exports)
+        self.add_file_root('assets', get_asset_folder(self))
+        self.add_file_root('avatars', get_variant_folder(self))
+        self.file_sender = FileSender(self.cfg['file_serving'],
+                                      self._file_roots,
+                                      self.cfg['file_serving_prefix'])
+        self.add_middleware(SharedFilesMiddleware, self._shared_exports,
+                            self.file_sender)
+        self.add_asset_bundle('core.js', ['core::js/jQuery.js',
+                                          'core::js/tiny_mce/jquery.tinymce.js',
+                                          'core::js/pyClanSphere.js'])
+        self.add_asset_bundle('admin.js', ['core::js/jquery.autocomplete.js',
+                                           'core::js/jquery.textarearesizer.js',
+                                           'core::js/Admin.js'])
+        self.add_asset_bundle('admin.css', ['core::admin/preview.css',
+                                            'core::admin/style.css'])
+
+        # the fingerprinted copies of the shared files, if they were built
+        self.assets = load_asset_manifest(self)
+        self.add_url_rule('/_assets/<path:filename>', endpoint='core/assets',
+                          build_only=True)
+        self.add_middleware(AssetMiddleware, get_asset_folder(self),
+                            '/_assets/', self.file_sender)
+        # the scaled user pictures, missing ones are created by the view
+        self.add_middleware(AssetMiddleware, get_variant_folder(self),
+                            '/_avatars/', self.file_sender)
+        self.startup.lap('templates')
 
         # set up the urls
         self.url_map = routing.Map(self._url_rules)
@@ -718,6 +812,7 @@ class pyClanSphere(object):
         scheme, netloc, script_name = urlparse(self.cfg['site_url'])[:3]
         self.url_adapter = self.url_map.bind(netloc, script_name,
                                              url_scheme=scheme)
+        self.startup.lap('urls')
 
         # mark the app as finished and override the setup functions
         def _error(*args, **kwargs):
@@ -733,21 +828,20 @@ class pyClanSphere(object):
 
         signals.after_bbcode_initialized.send(bbcode_parser=bbcode_parser)
 
+        # the renderer for user supplied texts.  Models that store their
+        # rendered text (see `utils.markup.RenderedText`) don't need the
+        # filters below on page views.
+        self.markup = Renderer(smiley_parser, bbcode_parser)
+
         @cached_result('bbcode_')
         def format_bbcode(text):
             """Pass text through bbcode parser"""
-            if text is None:
-                return Markup(u'')
-            text = bbcode_parser(text)
-            return Markup(text)
+            return self.markup.bbcode(text)
 
         @cached_result('smileyfied_')
         def format_smileys(text):
             """Pass text through smiley parser"""
-            if text is None:
-                return Markup(u'')
-            text = smiley_parser.makehappy(text)
-            return Markup(text)
+            return self.markup.smiley(text)
 
         @cached_result('prettified_')
         def prettify(text):
@@ -759,12 +853,7 @@ class pyClanSphere(object):
                   cache if we have any.
                   The key for the cache is prettified_ and a hash of the text we want to prettify
             """
-
-            if text is None:
-                return Markup(u'')
-            text = bbcode_parser(text)
-            text = smiley_parser.makehappy(text)
-            return Markup(text)
+            return self.markup.prettify(text)
 
         def do_enumerate(value, start=0):
             return enumerate(value, start)
@@ -779,6 +868,7 @@ class pyClanSphere(object):
         env.globals.update(
             smileylist = lambda x: smiley_parser.get_panel(x, True)
         )
+        self.startup.lap('markup')
 
         # register core upgrade repository
         from pyClanSphere.upgrades import REPOSITORY_PATH
@@ -786,16 +876,21 @@ class pyClanSphere(object):
 
         # allow plugins to register their upgrade repositories
         signals.register_upgrade_repository.send()
+        self.startup.lap('upgrade repositories')
 
         #! called after the application and all plugins are initialized
         signals.application_setup_done.send()
+        self.startup.lap('setup done')
 
-    def register_upgrade_repository(self, repo_id, repo_path):
+    def register_upgrade_repository(self, repo_id, repo_path,
+                                    up_to_date=False):
         """This function is responsible for adding upgrade repositories to the
         database.
 
         repo_id can be either a string or a Plugin instance, in which case the
-        plugin name is used as the repository ID.
+        plugin name is used as the repository ID.  A repository that is not
+        registered yet starts with version 0, or with its latest version if
+        `up_to_date` is true (the tables were just created).
         """
         from pyClanSphere.models import SchemaVersion
         from pyClanSphere.pluginsystem import Plugin
@@ -803,11 +898,12 @@ class pyClanSphere(object):
         if isinstance(repo_id, Plugin):
             repo_id = repo_id.metadata.get('name')
         repo_path = path.abspath(repo_path)
+        repository = Repository(repo_path, repo_id)
+        version = up_to_date and int(repository.latest) or 0
         try:
             sv = SchemaVersion.query.filter_by(repository_id=repo_id).first()
             if not sv:
-                # this always starts with version 0
-                db.session.add(SchemaVersion(Repository(repo_path, repo_id)))
+                db.session.add(SchemaVersion(repository, version))
                 db.session.commit()
         except (SQLAlchemyError, AttributeError):
             # the schema_versions table does not yet exist, let's create it
@@ -817,7 +913,7 @@ class pyClanSphere(object):
             metadata.bind = self.database_engine
             if not schema_versions.exists():
                 schema_versions.create(self.database_engine)
-            db.session.add(SchemaVersion(Repository(repo_path, repo_id)))
+            db.session.add(SchemaVersion(repository, version))
             db.session.commit()
 
     def check_if_upgrade_required(self):
@@ -971,6 +1067,39 @@ class pyClanSphere(object):
         self._shared_exports['/_shared/' + name] = path
         self.add_url_rule('/_shared/%s/<string:filename>' % name,
                           endpoint=name + '/shared', build_only=True)
+        self._file_roots['shared/' + name] = path
+
+    @setuponly
+    def add_upload_type(self, name, sniff, max_size=None):
+        """Register a type of uploaded files.  `sniff` is called with
+        the first bytes of an upload and returns `True` if the file is of
+        this type, `max_size` is the limit of the type in bytes (or a
+        callable returning it).  Larger files are rejected while they are
+        uploaded, see :mod:`pyClanSphere.utils.uploads`.
+        """
+        self.upload_types.append(UploadType(name, sniff, max_size))
+
+    @setuponly
+    def add_file_root(self, name, path):
+        """Register a folder of files sent with the file sender of the
+        application (:func:`~pyClanSphere.utils.sendfile.send_file`).  With
+        the ``accel`` file serving mode nginx sends them from the internal
+        location `<file_serving_prefix>/<name>`, the create-nginx-config
+        script emits one for each root.  Shared exports are registered as
+        ``shared/<name>``.
+        """
+        self._file_roots[name] = path
+
+    @setuponly
+    def add_asset_bundle(self, name, specs):
+        """Add a bundle of shared files of the same type (``.js`` or
+        ``.css``).  The build-assets script concatenates and minifies the
+        files of a bundle into one file, templates load the bundle with
+        ``asset_urls(name)``.  `specs` are the specs of the files as used
+        for :func:`shared_url`, stylesheets should only use relative URLs
+        to files of their export.
+        """
+        self.asset_bundles[name] = list(specs)
 
     @setuponly
     def add_middleware(self, middleware_factory, *args, **kwargs):
@@ -1117,11 +1246,9 @@ class pyClanSphere(object):
             htmlhelpers.meta(name='generator', content='pyClanSphere'),
             htmlhelpers.link('EditURI', url_for('core/service_rsd'),
                              type='application/rsd+xml', title='RSD'),
-            htmlhelpers.script(url_for('core/shared', filename='js/jQuery.js')),
-            htmlhelpers.script(url_for('core/shared', filename='js/tiny_mce/jquery.tinymce.js')),
-            htmlhelpers.script(url_for('core/shared', filename='js/pyClanSphere.js')),
-            htmlhelpers.script(url_for('core/serve_translations'))
         ]
+        result.extend(htmlhelpers.script(url) for url in asset_urls('core.js'))
+        result.append(htmlhelpers.script(url_for('core/serve_translations')))
 
         # the url information.  Only expose the admin url for admin users
         # or calls to this method without a request.
@@ -1206,8 +1333,11 @@ class pyClanSphere(object):
         # normal request dispatching
         try:
             try:
-                endpoint, args = self.url_adapter.match(request.path)
-                response = self.views[endpoint](request, **args)
+                endpoint, args = timed('match', self.url_adapter.match,
+                                       request.path)
+                request.stats.endpoint = endpoint
+                response = timed('view', self.views[endpoint], request,
+                                 **args)
             except NotFound, e:
                 response = self.handle_not_found(request, e)
             except Forbidden, e:
@@ -1248,11 +1378,12 @@ class pyClanSphere(object):
         # it afterwards.  We do this so that the request object can query
         # the database in the initialization method.
         request = object.__new__(Request)
+        request.stats = RequestStats(self.perf_monitor.statements)
         local.request = request
         local.page_metadata = []
         local.request_locals = {}
         try:
-            request.__init__(environ, self)
+            timed('setup', request.__init__, environ, self)
         except Exception, e:
             if self.cfg['passthrough_errors']:
                 raise
@@ -1333,8 +1464,14 @@ class pyClanSphere(object):
                 expires = time() + max_age
             else:
                 max_age = expires = None
-            request.session.save_cookie(response, cookie_name, max_age=max_age,
-                                        expires=expires, session_expires=expires)
+            timed('session', request.session.save_cookie, response,
+                  cookie_name, max_age=max_age, expires=expires,
+                  session_expires=expires)
+
+        request.stats.finish()
+        self.perf_monitor.record(request.stats)
+        if self.cfg['perf_headers']:
+            response.headers['Server-Timing'] = request.stats.server_timing
 
         return response(environ, start_response)
 
@@ -1399,4 +1536,10 @@ class pyClanSphere(object):
 # import here because of circular dependencies
 from pyClanSphere import i18n
 from pyClanSphere.utils import log
+from pyClanSphere.utils.assets import AssetMiddleware, get_asset_folder, \
+     load_asset_manifest
+from pyClanSphere.utils.avatars import PICTURE_TYPES, get_variant_folder
+from pyClanSphere.utils.sendfile import FileSender, SharedFilesMiddleware
+from pyClanSphere.utils.uploads import UploadStream, UploadType, \
+     get_upload_folder, image_sniffer
 from pyClanSphere.utils.http import make_external_url
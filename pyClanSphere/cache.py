@@ -11,7 +11,10 @@
     :license: BSD, see LICENSE for more details.
 """
 import os
+from time import time
 
+from jinja2 import Markup, nodes
+from jinja2.ext import Extension
 from werkzeug.contrib.cache import NullCache, SimpleCache, FileSystemCache, \
      MemcachedCache
 
@@ -28,7 +31,12 @@ def get_cache(app):
     application setup by the application itself.  No need to call that
     afterwards.
     """
-    return systems[app.cfg['cache_system']](app)
+    cache = systems[app.cfg['cache_system']](app)
+    if isinstance(cache, NullCache):
+        return cache
+    # count hits and misses per request
+    from pyClanSphere.utils.perf import CacheStatsProxy
+    return CacheStatsProxy(cache)
 
 
 def get_jinja_cache(app):
@@ -47,6 +55,35 @@ def get_jinja_cache(app):
     return None
 
 
+def precompile_templates(app):
+    """Compile the templates of all themes into the bytecode cache of the
+    template environment so that the first requests of new processes don't
+    have to.  Yields ``(theme, template, error)`` tuples for all templates,
+    `error` is `None` if the template was compiled.
+    """
+    from jinja2 import TemplateError
+    env = app.template_env
+    active_theme = app.theme
+    try:
+        for theme in app.themes.itervalues():
+            # the loader of the environment looks templates up in the
+            # active theme, templates of other themes are different ones
+            app.theme = theme
+            if env.cache is not None:
+                env.cache.clear()
+            for name in theme.list_templates():
+                try:
+                    env.get_template(name)
+                except TemplateError, e:
+                    yield theme, name, e
+                else:
+                    yield theme, name, None
+    finally:
+        app.theme = active_theme
+        if env.cache is not None:
+            env.cache.clear()
+
+
 def get_cache_context(vary, eager_caching=False, request=None):
     """Returns a tuple in the form ``(request, status)`` where request is a
     request object and status a bool that is `True` if caching should be
@@ -131,6 +168,10 @@ def response(vary=(), timeout=None, cache_key=None, admix_arguments=True):
     if `admix_arguments` is set to `True` the arguments passed to the function
     will be hashed and added to the cache key.
     This method doesn't do anything if eager caching is disabled (by default).
+
+    The cached responses are not invalidated if the data changes, views
+    with changing contents should rather cache template fragments with the
+    ``{% cache %}`` tag which are invalidated by tags.
     """
     from pyClanSphere.application import Response
     if not 'method' in vary:
@@ -176,6 +217,112 @@ def response(vary=(), timeout=None, cache_key=None, admix_arguments=True):
     return decorator
 
 
+#: generations of tags are kept this long (in seconds).  If one expires
+#: the tag gets a fresh generation which invalidates it as well.
+GENERATION_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def _generation_key(tag):
+    return 'tag_generation__%s' % md5(tag.encode('utf-8')).hexdigest()
+
+
+def get_generations(cache, tags):
+    """Return the current generations of the given tags.  Tags without a
+    generation get a new one.
+    """
+    keys = map(_generation_key, tags)
+    generations = cache.get_many(*keys)
+    for idx, generation in enumerate(generations):
+        if generation is None:
+            generation = generations[idx] = int(time() * 1000)
+            cache.set(keys[idx], generation, GENERATION_TIMEOUT)
+    return generations
+
+
+def invalidate(cache, tags):
+    """Invalidate all fragments cached for any of the given tags by moving
+    the tags to their next generation.
+    """
+    now = int(time() * 1000)
+    for tag in tags:
+        key = _generation_key(tag)
+        generation = cache.get(key)
+        if generation is None or generation < now:
+            generation = now
+        else:
+            generation += 1
+        cache.set(key, generation, GENERATION_TIMEOUT)
+
+
+def on_tags_invalidated(sender, tags, **kwds):
+    """Listener for the `cache_tags_invalidated` signal."""
+    from pyClanSphere.application import get_application
+    app = get_application()
+    if app is not None and not isinstance(app.cache, NullCache):
+        invalidate(app.cache, tags)
+
+
+def tagged(name, tags, create, timeout=None):
+    """Return the cached result of `create` for `name`.  The value is
+    created again once any of the `tags` was invalidated (see
+    :func:`invalidate`).  The name has to contain everything the value
+    depends on, the tags are the things whose changes invalidate it.
+    """
+    from pyClanSphere.application import get_application
+    app = get_application()
+    if app is None or isinstance(app.cache, NullCache):
+        return create()
+    tags = sorted(set(tags))
+    md5calc = md5(name.encode('utf-8'))
+    for tag, generation in zip(tags, get_generations(app.cache, tags)):
+        md5calc.update('|%s=%d' % (tag.encode('utf-8'), generation))
+    key = 'tagged__%s' % md5calc.hexdigest()
+    rv = app.cache.get(key)
+    if rv is None:
+        rv = create()
+        app.cache.set(key, rv, timeout)
+    return rv
+
+
+def fragment(name, tags, render, timeout=None):
+    """Return the cached output of `render` for the template fragment
+    `name`, see :func:`tagged`.
+    """
+    from pyClanSphere.application import get_application
+    language = get_application().cfg['language']
+    return tagged(u'fragment:%s:%s' % (language, name), tags, render, timeout)
+
+
+class FragmentCacheExtension(Extension):
+    """Adds a ``{% cache %}`` tag to templates that caches its body with
+    :func:`fragment`.  The first argument is the name of the fragment, all
+    others are tags::
+
+        {% cache 'board_post:%d' % post.id, 'post:%d' % post.id %}
+          {{ post.text|prettify }}
+        {% endcache %}
+
+    Everything that differs between users (privileges, read markers) must
+    stay out of the block or be part of the name.
+    """
+    tags = set(['cache'])
+
+    def parse(self, parser):
+        lineno = parser.stream.next().lineno
+        name = parser.parse_expression()
+        tags = []
+        while parser.stream.skip_if('comma'):
+            tags.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('_render_fragment',
+                                [name, nodes.List(tags, lineno=lineno)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render_fragment(self, name, tags, caller):
+        return Markup(fragment(unicode(name), map(unicode, tags),
+                               lambda: unicode(caller())))
+
+
 #: the cache system factories.
 systems = {
     'null':         lambda app: NullCache(),
@@ -82,10 +82,39 @@ DEFAULT_VARS = {
                                                 in sorted(log.LEVELS.items(),
                                                           key=lambda x: x[1])],
                                             default=u'warning'),
+    'log_format':               ChoiceField(choices=[
+        (u'text', l_(u'Text')),
+        (u'json', l_(u'JSON lines'))
+    ], default=u'text'),
+    'log_rotate_size':          IntegerField(default=0, min_value=0,
+                                             help_text=l_(
+        u'Rotate the logfile when it grows beyond this size in kilobytes.  '
+        u'0 disables rotation by size.')),
+    'log_rotate_interval':      ChoiceField(choices=[
+        (u'', l_(u'Never')),
+        (u'daily', l_(u'Daily')),
+        (u'weekly', l_(u'Weekly'))
+    ], default=u''),
+    'log_rotate_keep':          IntegerField(default=5, min_value=1,
+                                             help_text=l_(
+        u'Number of rotated logfiles to keep.')),
+    'log_queue_size':           IntegerField(default=1000, min_value=1,
+                                             help_text=l_(
+        u'Log records are written by a background thread.  This is the '
+        u'number of records that may wait for it.')),
+    'log_queue_full':           ChoiceField(choices=[
+        (u'block', l_(u'Wait until there is room')),
+        (u'drop', l_(u'Drop the record'))
+    ], default=u'block', help_text=l_(
+        u'What to do when the log queue is full.')),
     'log_email_only':           BooleanField(default=_dev_mode,
         help_text=l_(u'During development activating this is helpful to '
         u'log emails into a mail.log file in your instance folder instead '
         u'of delivering them to your MTA.')),
+    'perf_headers':             BooleanField(default=_dev_mode,
+        help_text=l_(u'Send the time spent in the phases of a request, the '
+        u'number of database queries and cache hits in a Server-Timing '
+        u'header.')),
     'passthrough_errors':       BooleanField(default=_dev_mode,
         help_text=l_(u'If this is set to true, errors in pyClanSphere '
         u'are not caught so that debuggers can catch it instead.  This is '
@@ -117,6 +146,13 @@ DEFAULT_VARS = {
     'smtp_user':                TextField(default=u''),
     'smtp_password':            TextField(default=u''),
     'smtp_use_tls':             BooleanField(default=False),
+    'email_queue':              BooleanField(default=False, help_text=l_(
+        u'Notification mails are put into a queue in the instance folder '
+        u'instead of being sent during the request.')),
+    'email_queue_workers':      IntegerField(default=1, min_value=0,
+                                             help_text=l_(
+        u'Number of threads that deliver queued mails.  Set this to 0 if '
+        u'the send-mails script delivers them.')),
 
     # network settings
     'default_network_timeout':  IntegerField(default=5, help_text=l_(
@@ -125,6 +161,20 @@ DEFAULT_VARS = {
         u'very bad network connection during development you should increase '
         u'it.')),
 
+    # file serving settings
+    'file_serving':             ChoiceField(choices=[
+        ('python', l_(u'Stream files from pyClanSphere')),
+        ('sendfile', l_(u'X-Sendfile (Apache mod_xsendfile, lighttpd)')),
+        ('accel', l_(u'X-Accel-Redirect (nginx)'))
+    ], default=u'python', help_text=l_(
+        u'Who sends shared files, avatars and downloads.  With X-Sendfile '
+        u'and X-Accel-Redirect pyClanSphere only sends the headers and the '
+        u'web server transfers the file, the configuration scripts emit '
+        u'the matching settings.')),
+    'file_serving_prefix':      TextField(default=u'/_internal', help_text=l_(
+        u'Prefix of the internal nginx locations files are sent from with '
+        u'X-Accel-Redirect.  It has to be unique per instance.')),
+
     # plugin settings
     'plugin_guard':             BooleanField(default=not _dev_mode),
     'plugins':                  CommaSeparated(TextField(), default=list),
@@ -149,6 +199,12 @@ DEFAULT_VARS = {
 
     # Avatar Settings
     'avatar_default':           TextField(default=u'', help_text=l_(u'URL to an external default avatar')),
+    'avatar_max_size':          IntegerField(default=1024, min_value=1,
+                                             help_text=l_(
+        u'Maximum size of uploaded user pictures in KB.')),
+    'upload_max_size':          IntegerField(default=2048, min_value=1,
+                                             help_text=l_(
+        u'Maximum size of other uploaded files (like plugin packages) in KB.')),
 }
 
 HIDDEN_KEYS = set(('iid', 'secret_key', 'pyclansphere_auth_token',
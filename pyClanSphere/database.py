@@ -18,6 +18,11 @@ import time
 from os import path
 from types import ModuleType
 from datetime import datetime
+from urllib import quote, unquote
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
 
 import sqlalchemy
 from sqlalchemy import orm, sql
@@ -33,7 +38,7 @@ from sqlalchemy.util import to_list
 from werkzeug import url_decode
 from werkzeug.exceptions import NotFound
 
-from pyClanSphere.utils import local_manager
+from pyClanSphere.utils import local, local_manager
 
 
 if sys.platform == 'win32':
@@ -107,9 +112,12 @@ def create_engine(uri, relative_to=None, debug=False):
         if value is not None:
             options[key] = int(value)
 
-    # if debugging is enabled, hook the ConnectionDebugProxy in
+    # count the queries of requests, if debugging is enabled the
+    # ConnectionDebugProxy remembers them too
     if debug:
         options['proxy'] = ConnectionDebugProxy()
+    else:
+        options['proxy'] = ConnectionStatsProxy()
 
     return sqlalchemy.create_engine(info, **options)
 
@@ -121,8 +129,8 @@ def secure_database_uri(uri):
     return unicode(obj).replace(u':%2A%2A%2A@', u':***@', 1)
 
 
-class ConnectionDebugProxy(ConnectionProxy):
-    """Helps debugging the database."""
+class ConnectionStatsProxy(ConnectionProxy):
+    """Counts the queries of requests and the time they took."""
 
     def cursor_execute(self, execute, cursor, statement, parameters,
                        context, executemany):
@@ -130,12 +138,25 @@ class ConnectionDebugProxy(ConnectionProxy):
         try:
             return execute(cursor, statement, parameters, context)
         finally:
-            from pyClanSphere.application import get_request
-            from pyClanSphere.utils.debug import find_calling_context
-            request = get_request()
+            request = getattr(local, 'request', None)
             if request is not None:
-                request.queries.append((statement, parameters, start,
-                                        _timer(), find_calling_context()))
+                self.record(request, statement, parameters, start, _timer())
+
+    def record(self, request, statement, parameters, start, end):
+        stats = getattr(request, 'stats', None)
+        if stats is not None:
+            stats.add_query(end - start, statement, parameters)
+
+
+class ConnectionDebugProxy(ConnectionStatsProxy):
+    """Helps debugging the database."""
+
+    def record(self, request, statement, parameters, start, end):
+        from pyClanSphere.utils.debug import find_calling_context
+        ConnectionStatsProxy.record(self, request, statement, parameters,
+                                    start, end)
+        request.queries.append((statement, parameters, start, end,
+                                find_calling_context(3)))
 
 
 class LookLively(object):
@@ -179,6 +200,153 @@ class Query(orm.Query):
             raise NotFound()
         return rv
 
+    def get_page(self, endpoint, page=1, per_page=20, url_args=None,
+                 paginator=None, sort_key=None, descending=False,
+                 after=None, before=None, total=None, with_total=True,
+                 total_timeout=None):
+        """Return a ``(items, pagination)`` tuple for one page of the query.
+
+        Without a `sort_key` the page is fetched with OFFSET/LIMIT.  The
+        `sort_key` is a list of mapped attributes that is unique for each
+        row, usually an indexed column followed by the primary key.  The
+        query is then ordered by it and the pagination links to the
+        adjacent pages with a cursor (`after` and `before`) instead of an
+        offset, so the database can seek to the page through the index.
+
+        The total is counted unless it is passed as `total` or
+        `with_total` is `False`, in which case the pagination only knows
+        whether there is a next page.  If `total_timeout` is given the
+        count is cached for that many seconds.
+        """
+        if paginator is None:
+            from pyClanSphere.utils.pagination import Pagination
+            paginator = Pagination
+
+        query = self
+        cursor = before or after
+        if sort_key is not None:
+            sort_key = to_list(sort_key)
+            columns = [attr.__clause_element__() for attr in sort_key]
+            backwards = before is not None
+            order = descending != backwards and sql.desc or sql.asc
+            query = query.order_by(*map(order, columns))
+            if cursor is not None:
+                values = decode_cursor(cursor, columns)
+                query = query.filter(_seek_clause(columns, values,
+                                                  descending != backwards))
+        else:
+            cursor = None
+        if cursor is None:
+            query = query.offset(per_page * (page - 1))
+
+        # fetch one more row to find out if there is a next page
+        items = query.limit(per_page + 1).all()
+        more = len(items) > per_page
+        del items[per_page:]
+        if before is not None and cursor is not None:
+            items.reverse()
+            has_prev, has_next = more, True
+        else:
+            has_prev, has_next = page > 1, more
+
+        prev_cursor = next_cursor = None
+        if sort_key is not None and items:
+            key = lambda item: [getattr(item, attr.key) for attr in sort_key]
+            if has_prev:
+                prev_cursor = encode_cursor(key(items[0]))
+            if has_next:
+                next_cursor = encode_cursor(key(items[-1]))
+
+        if total is None and with_total:
+            total = self.count_cached(total_timeout)
+
+        return items, paginator(endpoint, page, per_page, total, url_args,
+                                prev_cursor=prev_cursor,
+                                next_cursor=next_cursor,
+                                has_next=has_next)
+
+    def count_cached(self, timeout=None):
+        """Like `count` but keeps the result in the cache for `timeout`
+        seconds.  Without a timeout this is the same as `count`.
+        """
+        if timeout is None:
+            return self.count()
+        from pyClanSphere.application import get_application
+        cache = get_application().cache
+        statement = self.statement.compile()
+        key = 'count__%s' % md5(unicode(statement).encode('utf-8') +
+                                repr(sorted(statement.params.items()))) \
+                                .hexdigest()
+        rv = cache.get(key)
+        if rv is None:
+            rv = self.count()
+            cache.set(key, rv, timeout)
+        return rv
+
+
+def _seek_clause(columns, values, descending):
+    """Return a clause that matches the rows following `values` in the
+    ordering given by `columns`.
+    """
+    clause = None
+    for column, value in reversed(zip(columns, values)):
+        if descending:
+            match = column < value
+        else:
+            match = column > value
+        if clause is not None:
+            match = sql.or_(match, sql.and_(column == value, clause))
+        clause = match
+    return clause
+
+
+def encode_cursor(values):
+    """Encode the sort key values of a row for use in an URL.  Returns
+    `None` if the values can't be used as a cursor.
+
+    >>> encode_cursor([datetime(2010, 8, 9, 20, 15), 42])
+    u'2010-08-09T20:15:00,42'
+    """
+    result = []
+    for value in values:
+        if value is None:
+            return None
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        result.append(quote(unicode(value).encode('utf-8'), safe=':'))
+    return u','.join(result)
+
+
+def decode_cursor(cursor, columns):
+    """Decode a cursor created by :func:`encode_cursor` into values of the
+    types of the given columns.  Invalid cursors raise `NotFound`.
+
+    >>> decode_cursor(u'2010-08-09T20:15:00,42', [
+    ...     sqlalchemy.Column('date', sqlalchemy.DateTime),
+    ...     sqlalchemy.Column('id', sqlalchemy.Integer)])
+    [datetime.datetime(2010, 8, 9, 20, 15), 42]
+    """
+    parts = cursor.split(',')
+    if len(parts) != len(columns):
+        raise NotFound()
+    values = []
+    try:
+        for part, column in zip(parts, columns):
+            value = unquote(part.encode('utf-8')).decode('utf-8')
+            if isinstance(column.type, sqlalchemy.DateTime):
+                if '.' in value:
+                    value = datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f')
+                else:
+                    value = datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+            elif isinstance(column.type, sqlalchemy.Date):
+                value = datetime.strptime(value, '%Y-%m-%d').date()
+            elif isinstance(column.type, sqlalchemy.Integer):
+                value = int(value)
+            values.append(value)
+    except (ValueError, UnicodeError):
+        raise NotFound()
+    return values
+
 
 class AutoAddExt(orm.MapperExtension):
     def init_instance(self, mapper, class_, oldinit, instance, args, kwargs):
@@ -189,9 +357,51 @@ class AutoAddExt(orm.MapperExtension):
         return orm.EXT_CONTINUE
 
 
+def invalidate_on_commit(tags):
+    """Invalidate the cache `tags` once the current transaction is
+    committed.  Nothing is invalidated if it's rolled back.
+    """
+    pending = getattr(local, 'pending_cache_tags', None)
+    if pending is None:
+        pending = local.pending_cache_tags = set()
+    pending.update(tags)
+
+
+class CacheTagsExt(orm.MapperExtension):
+    """Remembers the `cache_tags` of flushed objects so that they can be
+    invalidated once the transaction is committed.
+    """
+
+    def _remember(self, instance):
+        tags = getattr(instance, 'cache_tags', None)
+        if tags:
+            invalidate_on_commit(tags)
+        return orm.EXT_CONTINUE
+
+    def after_insert(self, mapper, connection, instance):
+        return self._remember(instance)
+
+    after_update = after_delete = after_insert
+
+
+class CacheTagsSessionExt(orm.SessionExtension):
+    """Sends the `cache_tags_invalidated` signal after a commit."""
+
+    def after_commit(self, session):
+        tags = getattr(local, 'pending_cache_tags', None)
+        if tags:
+            from pyClanSphere import signals
+            local.pending_cache_tags = None
+            signals.cache_tags_invalidated.send(tags=tags)
+
+    def after_rollback(self, session):
+        local.pending_cache_tags = None
+
+
 #: get a new session
 session = orm.scoped_session(lambda: orm.create_session(get_engine(),
-                             autoflush=True, autocommit=False),
+                             autoflush=True, autocommit=False,
+                             extension=CacheTagsSessionExt()),
                              local_manager.get_ident)
 
 def mapper(cls, *arg, **options):
@@ -199,6 +409,7 @@ def mapper(cls, *arg, **options):
 
     extensions = to_list(options.pop('extension', None), [])
     extensions.append(AutoAddExt())
+    extensions.append(CacheTagsExt())
     options['extension'] = extensions
 
     if not hasattr(cls, 'query'):
@@ -238,6 +449,7 @@ Model = declarative_base(name='Model', metadata=metadata, cls=ModelBase, mapper=
 db.Model = Model
 db.Query = Query
 db.get_engine = get_engine
+db.invalidate_on_commit = invalidate_on_commit
 db.create_engine = create_engine
 db.mapper = mapper
 db.session = session
@@ -248,6 +460,34 @@ db.attribute_mapped_collection = attribute_mapped_collection
 #: called at the end of a request
 cleanup_session = session.remove
 
+def _resolve_type(column):
+    """Give a column that is only declared by its foreign key the type of
+    the column it references.  SQLAlchemy does that when the key is first
+    looked up, which is too early for keys to such a column again and does
+    not happen at all if only some tables of the metadata are created.
+    """
+    for key in column.foreign_keys:
+        target = key.column
+        _resolve_type(target)
+        if isinstance(column.type, sqlalchemy.types.NullType):
+            column.type = target.type
+
+
+def create_tables(engine, tables):
+    """Create the `tables` of a plugin that don't exist yet.  Returns `True`
+    if none of them existed, the plugin was just installed and its tables
+    are in their latest version.  Pass that on to
+    :meth:`~pyClanSphere.application.pyClanSphere.register_upgrade_repository`.
+    """
+    missing = [table for table in tables if not table.exists(bind=engine)]
+    if missing:
+        for table in missing:
+            for column in table.c:
+                _resolve_type(column)
+        metadata.create_all(engine, tables=missing)
+    return len(missing) == len(tables)
+
+
 def init_database(engine):
     """This is called from the websetup which explains why it takes an engine
     and not a pyClanSphere application.
@@ -257,3 +497,18 @@ def init_database(engine):
     #   cx.execute('set storage_engine=innodb')
     #   metadata.create_all(cx)
     metadata.create_all(engine)
+
+    # the tables are created in their latest version, so the core upgrade
+    # repository is up to date
+    from pyClanSphere.schema import schema_versions
+    from pyClanSphere.upgrades import REPOSITORY_PATH
+    from pyClanSphere.upgrades.customisation import Repository
+    repo_path = path.abspath(REPOSITORY_PATH)
+    if engine.execute(db.select([schema_versions.c.version],
+            schema_versions.c.repository_id == u'pyClanSphere')).scalar() \
+       is None:
+        engine.execute(schema_versions.insert(),
+            repository_id=u'pyClanSphere',
+            repository_path=repo_path,
+            version=int(Repository(repo_path, 'pyClanSphere').latest)
+        )
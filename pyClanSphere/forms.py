@@ -518,6 +518,17 @@ class LogOptionsForm(_ConfigForm):
     """A form for the logfiles."""
     log_file = config_field('log_file', lazy_gettext(u'Filename'))
     log_level = config_field('log_level', lazy_gettext(u'Log Level'))
+    log_format = config_field('log_format', lazy_gettext(u'Format'))
+    log_rotate_size = config_field('log_rotate_size',
+                                   lazy_gettext(u'Rotate at size (KB)'))
+    log_rotate_interval = config_field('log_rotate_interval',
+                                       lazy_gettext(u'Rotate every'))
+    log_rotate_keep = config_field('log_rotate_keep',
+                                   lazy_gettext(u'Rotated files to keep'))
+    log_queue_size = config_field('log_queue_size',
+                                  lazy_gettext(u'Queue size'))
+    log_queue_full = config_field('log_queue_full',
+                                  lazy_gettext(u'When the queue is full'))
 
 
 class BasicOptionsForm(_ConfigForm):
@@ -605,6 +616,10 @@ class MaintenanceModeForm(forms.Form):
     """yet a dummy form, but could be extended later."""
 
 
+class ResetPerformanceStatsForm(forms.Form):
+    """The form to reset the collected performance numbers."""
+
+
 class DeleteImportForm(forms.Form):
     """This form is used to delete a imported file."""
 
@@ -27,8 +27,13 @@ from pyClanSphere.schema import users, groups, group_users, \
 from pyClanSphere.i18n import parse_datetime, lazy_gettext
 from pyClanSphere.utils.pagination import Pagination
 from pyClanSphere.utils.crypto import gen_pwhash, check_pwhash
+from pyClanSphere.utils.avatars import PICTURE_TYPES, get_variant, \
+     create_variants, remove_variants, remember_digest
+from pyClanSphere.utils.uploads import get_upload
+from pyClanSphere import cache
 from pyClanSphere.privileges import _Privilege, privilege_attribute, \
-     add_admin_privilege, ENTER_ADMIN_PANEL, CLAN_ADMIN, ENTER_ACCOUNT_PANEL
+     add_admin_privilege, PrivilegeCache, PrivilegeChangeExt, \
+     ENTER_ADMIN_PANEL, CLAN_ADMIN, ENTER_ACCOUNT_PANEL
 
 _ = lazy_gettext
 
@@ -41,6 +46,38 @@ class UserQuery(db.Query):
     def namesort(self):
         return self.order_by(db.func.lower(User.username))
 
+    def name_prefix(self, prefix):
+        """Filter the users whose user or display name starts with
+        `prefix`, ignoring the case.  The prefix is matched as a range of
+        the lower case names (kept up to date by :class:`UserNameExt`),
+        the indexes on them answer that, ``LIKE`` or ``lower()`` would
+        scan the table.
+        """
+        prefix = prefix.lower()
+        upper = prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+        return self.filter(db.or_(
+            (User.username_lower >= prefix) & (User.username_lower < upper),
+            (User.display_name_lower >= prefix) &
+            (User.display_name_lower < upper)
+        ))
+
+
+class UserNameExt(db.MapperExtension):
+    """Stores the user and display name of users in lower case for
+    :meth:`UserQuery.name_prefix`.
+    """
+
+    def _update(self, instance):
+        instance.username_lower = (instance.username or u'').lower()
+        instance.display_name_lower = instance.display_name.lower()[:180]
+        return db.EXT_CONTINUE
+
+    def before_insert(self, mapper, connection, instance):
+        return self._update(instance)
+
+    def before_update(self, mapper, connection, instance):
+        return self._update(instance)
+
 class User(object):
     """Represents an user.
 
@@ -128,20 +165,44 @@ class User(object):
                 years -= 1
         return years
 
-    @property
-    def privileges(self):
-        """A read-only set with all privileges."""
+    def _load_privileges(self):
         result = set(self.own_privileges)
         for group in self.groups:
             result.update(group.privileges)
         return frozenset(result)
 
+    @property
+    def privilege_cache(self):
+        """The privileges of the user, loaded once per request and kept in
+        the cache between requests.
+        """
+        rv = self.__dict__.get('_privilege_cache')
+        if rv is None or not rv.valid:
+            if self.id is None:
+                privileges = self._load_privileges()
+            else:
+                from pyClanSphere.application import get_application
+                names = cache.tagged('privileges:%d' % self.id,
+                                     ['user:%d' % self.id, 'privileges'],
+                    lambda: frozenset(p.name for p in self._load_privileges()
+                                      if p is not None))
+                registered = get_application().privileges
+                privileges = frozenset(registered[name] for name in names
+                                       if name in registered)
+            rv = self.__dict__['_privilege_cache'] = PrivilegeCache(privileges)
+        return rv
+
+    @property
+    def privileges(self):
+        """A read-only set with all privileges."""
+        return self.privilege_cache.privileges
+
     def has_privilege(self, privilege):
         """Check if the user has a given privilege.  If the user has the
         CLAN_ADMIN privilege he automatically has all the other privileges
         as well.
         """
-        return add_admin_privilege(privilege)(self.privileges)
+        return self.privilege_cache.check(privilege)
 
     def set_password(self, password):
         self.pw_hash = gen_pwhash(password)
@@ -166,6 +227,11 @@ class User(object):
     def pic_url(self):
         return UserPicture(self).url()
 
+    @property
+    def cache_tags(self):
+        """Fragment cache tags to invalidate if the user changes."""
+        return ['user:%d' % self.id]
+
     def __repr__(self):
         return '<%s %r>' % (
             self.__class__.__name__,
@@ -210,42 +276,69 @@ class UserPicture(object):
            a link to the uploaded picture, if any
         """
 
-        from pyClanSphere.api import get_application, url_for
+        from pyClanSphere.api import get_application, url_for, shared_url
         app = get_application()
         size = app.theme.settings['avatar.size']
         pictype = self.user.userpictype
         if not pictype or pictype == u'None':
             return app.cfg['avatar_default'] if app.cfg['avatar_default'] \
-                else url_for('core/shared', filename='nopicture.jpg')
+                else shared_url('core::nopicture.jpg')
         if self.user.userpictype == u'Gravatar':
             gravatar_url = "http://www.gravatar.com/avatar/"
             gravatar_url += md5(self.user.email).hexdigest() + "?"
             gravatar_url += urlencode({'size':str(size)})
             return gravatar_url
         else:
+            variant = get_variant(app, self.filename, size)
+            if variant is not None:
+                return url_for('core/avatar', filename=variant)
             return url_for('userpics/shared', filename=self.filename)
 
     def place_file(self, newfile):
-        """Move picture file to instance subfolder and generate appropriate filename"""
+        """Move picture file to instance subfolder and generate appropriate
+        filename.  Returns an error message if the picture was rejected.
+        """
 
-        if isinstance(newfile, FileStorage):
+        from pyClanSphere.api import get_application
+        if not isinstance(newfile, FileStorage):
+            raise NotImplemented('Dunno how to handle that kind of file object')
+        upload = get_upload(newfile)
+        if upload is not None:
+            # type and size were checked while it was uploaded
+            if upload.rejected:
+                return _(u'The picture is larger than %d KB.') % \
+                       (upload.max_size // 1024)
+            imgtype = upload.type
+        else:
             temp_path = pjoin(self.picture_folder, self._pic_hash())
             newfile.save(temp_path)
             imgtype = imghdr.what(temp_path)
-            if imgtype not in ['png', 'gif', 'jpeg']:
+        if imgtype not in PICTURE_TYPES:
+            if upload is None:
                 os.remove(temp_path)
-                return
-            self.user.userpictype = imgtype
-            os.rename(temp_path, pjoin(self.picture_folder, self.filename))
+            return _(u'Only PNG, GIF and JPEG pictures can be used.')
+
+        app = get_application()
+        self.remove()
+        self.user.userpictype = imgtype
+        path = pjoin(self.picture_folder, self.filename)
+        if upload is not None:
+            upload.save(path)
+            remember_digest(path, upload.digest)
         else:
-            raise NotImplemented('Dunno how to handle that kind of file object')
+            os.rename(temp_path, path)
+        create_variants(app, self.filename)
 
     def remove(self, set_default=False):
-        """Remove a picture"""
+        """Remove a picture and its variants"""
 
+        from pyClanSphere.api import get_application
         filename = self.filename
-        if filename and os.path.isfile(filename):
-            os.remove(filename)
+        if filename:
+            remove_variants(get_application(), filename)
+            path = pjoin(self.picture_folder, filename)
+            if os.path.isfile(path):
+                os.remove(path)
         if set_default:
             self.user.userpictype = u'None'
 
@@ -258,6 +351,11 @@ class Group(object):
 
     privileges = privilege_attribute('_privileges')
 
+    @property
+    def cache_tags(self):
+        """Fragment cache tags to invalidate if the group changes."""
+        return ['privileges']
+
     def has_privilege(self, privilege):
         return add_admin_privilege(privilege)(self.privileges)
 
@@ -278,6 +376,7 @@ class AnonymousUser(User):
     display_name = 'Nobody'
     real_name = description = username = ''
     own_privileges = privileges = property(lambda x: frozenset())
+    privilege_cache = property(lambda x: PrivilegeCache(frozenset()))
 
     def __init__(self):
         pass
@@ -317,26 +416,24 @@ class IMAccountQuery(db.Query):
 
     def get_list(self, endpoint=None, page=1, per_page=None,
                  url_args=None, raise_if_empty=True, paginator=Pagination,
-                 user=None):
+                 user=None, after=None, before=None, with_total=True):
         """Return a dict with pagination and datalist."""
 
         if per_page is None:
             per_page = 20
 
         # send the query
-        offset = per_page * (page - 1)
+        query = self
         if user is not None:
-            mylist = self.filter_by(user=user).offset(offset).limit(per_page).all()
-        else:
-            mylist = self.offset(offset).limit(per_page).all()
+            query = query.filter_by(user=user)
+        mylist, pagination = query.get_page(endpoint, page, per_page,
+            url_args, paginator, sort_key=[IMAccount.id], after=after,
+            before=before, with_total=with_total)
 
         # if raising exceptions is wanted, raise it
         if raise_if_empty and (page != 1 and not mylist):
             raise NotFound()
 
-        pagination = paginator(endpoint, page, per_page,
-                                self.count(), url_args)
-
         return {
             'imaccounts':         mylist,
             'pagination':       pagination
@@ -408,26 +505,29 @@ class SchemaVersion(object):
 
 
 # connect the tables.
-db.mapper(User, users, properties={
+db.mapper(User, users, extension=UserNameExt(), properties={
     'id':               users.c.user_id,
     'display_name':     db.synonym('_display_name', map_column=True),
     '_own_privileges':  db.relation(_Privilege, lazy=True,
                                     secondary=user_privileges,
                                     collection_class=set,
-                                    cascade='all, delete'),
+                                    cascade='all, delete',
+                                    extension=PrivilegeChangeExt()),
     'imaccounts':       db.relation(IMAccount, lazy=True,
                                     cascade='all, delete',
                                     backref=db.backref('user', uselist=False, lazy=False))
 })
 db.mapper(Group, groups, properties={
     'id':               groups.c.group_id,
-    'users':            db.dynamic_loader(User, backref=db.backref('groups', lazy=True),
+    'users':            db.dynamic_loader(User, backref=db.backref('groups', lazy=True,
+                                          extension=PrivilegeChangeExt()),
                                           query_class=UserQuery,
                                           secondary=group_users),
     '_privileges':      db.relation(_Privilege, lazy=True,
                                     secondary=group_privileges,
                                     collection_class=set,
-                                    cascade='all, delete')
+                                    cascade='all, delete',
+                                    extension=PrivilegeChangeExt())
 })
 db.mapper(_Privilege, privileges, properties={
     'id':               privileges.c.privilege_id,
@@ -177,6 +177,13 @@ class NotificationSystem(object):
     def send(self, user, notification):
         raise NotImplementedError()
 
+    def send_many(self, users, notification):
+        """Send the notification to many users at once.  The default
+        implementation calls `send` for every user.
+        """
+        for user in users:
+            self.send(user, notification)
+
 
 class EMailNotificationSystem(NotificationSystem):
     """Sends notifications to user via E-Mail."""
@@ -185,12 +192,19 @@ class EMailNotificationSystem(NotificationSystem):
     name = lazy_gettext(u'E-Mail')
 
     def send(self, user, notification):
+        self.send_many([user], notification)
+
+    def send_many(self, users, notification):
+        # the text is the same for everybody, so it's rendered once, but
+        # every user still gets a mail addressed to them
         title = u'[%s] %s' % (
             self.app.cfg['clan_title'],
             notification.title.to_text()
         )
         text = self.mail_from_notification(notification)
-        send_email(title, text, [user.email])
+        for user in users:
+            if user.email:
+                send_email(title, text, [user.email], queue=True)
 
     def unquote_link(self, link):
         """Unquotes some kinds of links.  For example mailto:foo links are
@@ -280,10 +294,13 @@ class NotificationManager(object):
                 NotificationSubscription.user!=notification.user
             )
 
+        by_system = {}
         for subscription in subscriptions.all():
             system = self.systems.get(subscription.notification_system)
             if system is not None:
-                system.send(subscription.user, notification)
+                by_system.setdefault(system, []).append(subscription.user)
+        for system, users in by_system.iteritems():
+            system.send_many(users, notification)
 
     def types(self, user=None):
         if not user:
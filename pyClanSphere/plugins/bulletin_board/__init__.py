@@ -24,6 +24,7 @@ from pyClanSphere.plugins.bulletin_board.models import *
 from pyClanSphere.plugins.bulletin_board.database import init_database
 from pyClanSphere.plugins.bulletin_board.privileges import PLUGIN_PRIVILEGES, BOARD_MANAGE
 from pyClanSphere.plugins.bulletin_board.services import do_get_post
+from pyClanSphere.plugins.bulletin_board.counters import recount_board
 
 SHARED_FILES = join(dirname(__file__), 'shared')
 TEMPLATE_FILES = join(dirname(__file__), 'templates')
@@ -73,24 +74,13 @@ def convert_to_guestpost(sender, **kwds):
     anon_user = AnonymousUser()
     anon_user.display_name = user.display_name
 
-    touched_topics = set()
-    touched_forums = set()
     posts =  Post.query.filter_by(author_id=user.id)
 
+    # the board counters only count posts, so nothing to refresh here
     for post in posts:
-        topic = post.topic
-        forum = topic.forum
         post.author = anon_user
-        touched_forums.add(forum)
-        touched_topics.add(topic)
 
     db.commit()
-    for topic in touched_topics:
-        topic.refresh()
-    db.commit()
-    for forum in touched_forums:
-        forum.refresh()
-    db.commit()
 
 def setup(app, plugin):
     # Add our privileges
@@ -98,7 +88,10 @@ def setup(app, plugin):
         app.add_privilege(priv)
 
     # init new tables
-    init_database(app)
+    created = init_database(app)
+
+    # Register repository for schema updates
+    app.register_upgrade_repository(plugin, dirname(__file__), created)
 
     # Add our template path
     app.add_template_searchpath(TEMPLATE_FILES)
@@ -110,6 +103,8 @@ def setup(app, plugin):
     app.add_url_rule('/board/', endpoint='board/index', view=views.board_index)
     app.add_url_rule('/board/forum/<int:forum_id>', endpoint='board/topics', defaults={'page': 1}, view=views.topic_list)
     app.add_url_rule('/board/forum/<int:forum_id>/page/<int:page>', endpoint='board/topics')
+    app.add_url_rule('/board/forum/<int:forum_id>/mark_read', endpoint='board/forum_mark_read', view=views.forum_mark_read)
+    app.add_url_rule('/board/mark_read', endpoint='board/mark_read', view=views.board_mark_read)
     app.add_url_rule('/board/topic/<int:topic_id>', endpoint='board/topic_detail', defaults={'page': 1}, view=views.topic_detail)
     app.add_url_rule('/board/topic/<int:topic_id>/page/<int:page>', endpoint='board/topic_detail')
     app.add_url_rule('/board/post/<int:post_id>', endpoint='board/post_find', view=views.topic_by_post)
@@ -132,5 +127,8 @@ def setup(app, plugin):
     # convert posts to guestposts upon user deletion
     signals.before_user_deleted.connect(convert_to_guestpost)
 
+    # rebuild our counters on request of the database management script
+    signals.recount_counters.connect(recount_board)
+
     # Add JSON services
     app.add_servicepoint('bulletin_board/get_post', do_get_post)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.plugins.bulletin_board.counters
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Offline rebuild of the board counters.  During normal operation the
+    counters are updated incrementally by the models, this is only needed
+    if they got out of sync.  It is invoked through the ``recount`` command
+    of the ``manage-database`` script.
+
+    :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+from pyClanSphere.api import db, signals
+
+from pyClanSphere.plugins.bulletin_board.database import board_forums, \
+     board_topics, board_posts
+
+
+def recount_topics(batch_size=500):
+    """Rebuild postcount and lastpost of all topics, `batch_size` topics
+    per transaction.
+    """
+    t = board_topics.c
+    p = board_posts.c
+    last_id = 0
+    done = 0
+    while 1:
+        ids = [row[0] for row in db.execute(db.select([t.topic_id],
+               t.topic_id > last_id).order_by(t.topic_id).limit(batch_size))]
+        if not ids:
+            break
+        stats = db.execute(db.select([p.topic_id, db.func.count(p.post_id),
+                                      db.func.max(p.post_id)],
+                                     p.topic_id.in_(ids)) \
+                             .group_by(p.topic_id)).fetchall()
+        dates = {}
+        if stats:
+            dates = dict(db.execute(db.select([p.post_id, p.date],
+                         p.post_id.in_([row[2] for row in stats]))).fetchall())
+        counted = set()
+        for topic_id, postcount, lastpost_id in stats:
+            counted.add(topic_id)
+            db.execute(board_topics.update(t.topic_id == topic_id, values={
+                'postcount':            postcount,
+                'lastpost_id':          lastpost_id,
+                'modification_date':    dates[lastpost_id]
+            }))
+        empty = [topic_id for topic_id in ids if topic_id not in counted]
+        if empty:
+            db.execute(board_topics.update(t.topic_id.in_(empty), values={
+                'postcount':            0,
+                'lastpost_id':          None
+            }))
+        db.commit()
+        done += len(ids)
+        last_id = ids[-1]
+        yield u'<p>Recounted %d topics</p>\n' % done
+
+
+def recount_forums():
+    """Rebuild topiccount, postcount and last topic/post of all forums
+    from the (already recounted) topics.
+    """
+    t = board_topics.c
+    f = board_forums.c
+    stats = dict((row[0], row[1:]) for row in db.execute(db.select(
+        [t.forum_id, db.func.count(t.topic_id),
+         db.func.coalesce(db.func.sum(t.postcount), 0)]).group_by(t.forum_id)))
+    forum_ids = [row[0] for row in db.execute(db.select([f.forum_id]))]
+    for forum_id in forum_ids:
+        topiccount, postcount = stats.get(forum_id, (0, 0))
+        last = db.execute(db.select([t.topic_id, t.lastpost_id],
+                                    t.forum_id == forum_id) \
+                            .order_by(db.desc(t.modification_date)) \
+                            .limit(1)).fetchone()
+        db.execute(board_forums.update(f.forum_id == forum_id, values={
+            'topiccount':       topiccount,
+            'postcount':        postcount,
+            'lasttopic_id':     last and last[0] or None,
+            'lastpost_id':      last and last[1] or None
+        }))
+    db.commit()
+    # the updates above bypass the mapper, invalidate the cached rows
+    signals.cache_tags_invalidated.send(tags=set(['board']) |
+        set('forum:%d' % forum_id for forum_id in forum_ids))
+    yield u'<p>Recounted %d forums</p>\n' % len(forum_ids)
+
+
+def recount_board(sender, batch_size=500, **kwds):
+    """Listener for the `recount_counters` signal."""
+    yield u'<h3>Bulletin Board</h3>\n'
+    for message in recount_topics(batch_size):
+        yield message
+    for message in recount_forums():
+        yield message
@@ -11,10 +11,10 @@
 """
 from datetime import datetime
 
-from pyClanSphere.database import db, metadata
+from pyClanSphere.database import db, metadata, create_tables
 
 # Mapping these out from db module to increases readability further down
-for var in ['Table', 'Column', 'String', 'Integer', 'Boolean', 'DateTime', 'ForeignKey', 'Text']:
+for var in ['Table', 'Column', 'String', 'Integer', 'Boolean', 'DateTime', 'ForeignKey', 'Text', 'Index']:
     globals()[var] = getattr(db,var)
 
 board_categories = Table('board_categories', metadata,
@@ -55,16 +55,26 @@ board_topics = Table('board_topics', metadata,
     Column('postcount', Integer),
     Column('modification_date', DateTime)
 )
+# the topics of a forum are listed by their last modification
+Index('board_topics_forum_modification', board_topics.c.forum_id,
+      board_topics.c.modification_date)
 
 board_posts = Table('board_posts', metadata,
     Column('post_id', Integer, primary_key=True),
     Column('topic_id', ForeignKey('board_topics.topic_id')),
     Column('text', Text),
+    Column('text_html', Text),
+    Column('text_html_version', Integer),
     Column('author_id', ForeignKey('users.user_id')),
     Column('author_str', String(40)),
     Column('date', DateTime, default=datetime.utcnow()),
     Column('ip', String(40)),
+    Column('position', Integer)
 )
+# position of a post within its topic, 1-based and without gaps
+Index('board_posts_topic_position', board_posts.c.topic_id,
+      board_posts.c.position, unique=True)
+Index('board_posts_topic_date', board_posts.c.topic_id, board_posts.c.date)
 
 board_global_lastread = Table('board_global_lastread', metadata,
     Column('user_id', ForeignKey('users.user_id'), primary_key=True),
@@ -77,10 +87,21 @@ board_local_lastread = Table('board_local_lastread', metadata,
     Column('date', DateTime, default=datetime.utcnow())
 )
 
+board_forum_lastread = Table('board_forum_lastread', metadata,
+    Column('user_id', ForeignKey('users.user_id'), primary_key=True),
+    Column('forum_id', ForeignKey('board_forums.forum_id'), primary_key=True),
+    Column('date', DateTime)
+)
+
 def init_database(app):
-    """ This is for inserting our new table"""
-    engine = app.database_engine
-    metadata.create_all(engine)
+    """Create the tables that don't exist yet.  Returns `True` if they
+    were all created, they are in their latest version then.
+    """
+    return create_tables(app.database_engine, [
+        board_categories, board_forums, board_topics, board_posts,
+        board_local_lastread, board_global_lastread, board_forum_lastread
+    ])
 
 __all__ = ['board_categories', 'board_forums', 'board_topics', 'board_posts',
-           'board_local_lastread', 'board_global_lastread']
+           'board_local_lastread', 'board_global_lastread',
+           'board_forum_lastread']
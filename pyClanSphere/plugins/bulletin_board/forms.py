@@ -11,11 +11,15 @@
 
 from datetime import datetime
 
+from sqlalchemy.exc import IntegrityError
+
 from pyClanSphere.api import *
 from pyClanSphere.utils import forms
 from pyClanSphere.utils.validators import is_not_whitespace_only, ValidationError
 
 from pyClanSphere.plugins.bulletin_board.models import *
+from pyClanSphere.plugins.bulletin_board.readstate import mark_forum_read, \
+     mark_all_read
 
 class CategoryForm(forms.Form):
     """Used to edit or create a category"""
@@ -181,7 +185,8 @@ class DeleteForumForm(forms.Form):
         """Deletes a forum."""
         new_forum = self['relocate_to']
         if self.data['action'] == 'relocate':
-            for topic in self.forum.topics:
+            # moving a topic removes it from the list we iterate over
+            for topic in list(self.forum.topics):
                 topic.forum = new_forum
 
         signals.before_board_forum_deleted.send(forum=self.forum, formdata=self.data)
@@ -191,6 +196,7 @@ class DeleteForumForm(forms.Form):
 
         if self.data['action'] == 'relocate':
             new_forum.refresh()
+            db.commit()
 
 class PostForm(forms.Form):
     """Post creation and edit"""
@@ -198,6 +204,7 @@ class PostForm(forms.Form):
     yourname = forms.TextField(lazy_gettext(u'Your Name'), max_length=40)
     title = forms.TextField(lazy_gettext(u'Title'), max_length=255, required=True)
     _maxtext = 5000
+    _position_attempts = 3
     text = forms.TextField(lazy_gettext(u'Text'), max_length=_maxtext,
                            widget=forms.Textarea,
                            validators=[is_not_whitespace_only()], required=True)
@@ -242,16 +249,24 @@ class PostForm(forms.Form):
             user = self['yourname']
 
         topic = self.topic
-        if topic is None:
+        new_topic = topic is None
+        if new_topic:
             topic = self.create_topic(self.target, user)
         
         # A bug in sqlalchemy 0.6beta makes this part run and commit show a requirement, bug opened
-        post = Post(topic, self['text'], user, datetime.utcnow(), self.request.remote_addr)
-        db.commit()
-        db.session.expire_all()
-        topic.refresh()
-        db.commit()
-        topic.forum.refresh()
+        # A concurrent reply can take the position of the post, it's
+        # numbered again then
+        for attempt in xrange(self._position_attempts):
+            post = Post(topic, self['text'], user, datetime.utcnow(), self.request.remote_addr)
+            try:
+                db.commit()
+                break
+            except IntegrityError:
+                db.rollback()
+                if attempt + 1 == self._position_attempts:
+                    raise
+        topic.post_added(post)
+        topic.forum.post_added(post, new_topic)
         db.commit()
         return post
 
@@ -269,19 +284,36 @@ class DeletePostForm(forms.Form):
 
     def delete_post(self):
         """actually delete the post"""
-        topic=self.post.topic
-        db.delete(self.post)
-        db.commit()
-        db.session.expire_all()
-        if Post.query.filter(Post.topic==topic).count() > 0:
-            topic.refresh()
-            db.commit()
-            topic.forum.refresh()
+        post = self.post
+        topic = post.topic
+        forum = topic.forum
+        if topic.post_removed(post):
+            forum.post_removed(post)
+            db.delete(post)
             db.commit()
         else:
-            forum = topic.forum
-            db.delete(topic)
+            forum.post_removed(post, topic_removed=True)
+            topic.lastpost_id = None
+            db.delete(post)
             db.commit()
-            forum.refresh()
+            db.delete(topic)
             db.commit()
             raise TopicEmpty
+
+
+class MarkReadForm(forms.Form):
+    """Marks a forum or, without one, the whole board read"""
+
+    # the form is shown on the forum and board pages but posted to the
+    # mark_read urls, so the token is checked against the page it came from
+    csrf_use_source = True
+
+    def __init__(self, forum=None, initial=None):
+        self.forum = forum
+        forms.Form.__init__(self, initial)
+
+    def mark_read(self, user):
+        if self.forum is None:
+            mark_all_read(user)
+        else:
+            mark_forum_read(user, self.forum)
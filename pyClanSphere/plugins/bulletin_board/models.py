@@ -18,10 +18,13 @@ from werkzeug.exceptions import NotFound
 
 from pyClanSphere.api import db, get_request
 from pyClanSphere.models import User, AnonymousUser
+from pyClanSphere.utils.markup import RenderedText
 from pyClanSphere.utils.pagination import Pagination
+from pyClanSphere.utils.userloader import get_user, prefetch_authors
 
 from pyClanSphere.plugins.bulletin_board.privileges import *
 from pyClanSphere.plugins.bulletin_board.database import *
+from pyClanSphere.plugins.bulletin_board.readstate import get_read_state
 
 
 class TopicEmpty(Exception):
@@ -32,24 +35,22 @@ class CategoryQuery(db.Query):
     """Addon methods for querying categories"""
 
     def get_list(self, endpoint=None, page=1, per_page=None,
-                 url_args=None, raise_if_empty=True, paginator=Pagination):
+                 url_args=None, raise_if_empty=True, paginator=Pagination,
+                 after=None, before=None, with_total=True):
         """Return a dict with pagination and categories."""
 
         if per_page is None:
             per_page = 20
 
         # send the query
-        offset = per_page * (page - 1)
-        categorylist = self.order_by(db.asc(Category.ordering)) \
-                           .offset(offset).limit(per_page).all()
+        categorylist, pagination = self.get_page(endpoint, page, per_page,
+            url_args, paginator, sort_key=[Category.ordering, Category.id],
+            after=after, before=before, with_total=with_total)
 
         # if raising exceptions is wanted, raise i
         if raise_if_empty and (page != 1 and not categorylist):
             raise NotFound()
 
-        pagination = paginator(endpoint, page, per_page,
-                                self.count(), url_args=url_args)
-
         return {
             'categories':       categorylist,
             'pagination':       pagination,
@@ -65,6 +66,11 @@ class Category(object):
         self.name = name
         self.ordering = ordering
 
+    @property
+    def cache_tags(self):
+        """Fragment cache tags to invalidate if the category changes."""
+        return ['board']
+
     def can_edit(self, user=None):
         return True
 
@@ -121,6 +127,11 @@ class Forum(object):
         self.description = description
         self.ordering = ordering
 
+    @property
+    def cache_tags(self):
+        """Fragment cache tags to invalidate if the forum changes."""
+        return ['board', 'forum:%d' % self.id]
+
     def can_edit(self, user=None):
         return True
 
@@ -135,41 +146,54 @@ class Forum(object):
         return self.allow_anonymous or user.is_somebody
 
     def is_unread(self, user=None):
-        if user is None:
-            user = get_request().user
-        if isinstance(user, AnonymousUser):
-            return False
-
-        global_lastread = GlobalLastRead.query.get(user.id)
-        if not global_lastread or not self.modification_date:
-            return False
-        if global_lastread.date > self.modification_date:
-            return False
-
-        topics=Topic.query \
-               .filter(Topic.modification_date > global_lastread.date) \
-               .filter(Topic.forum_id == self.id).all()
-        for topic in topics:
-            if topic.is_unread(user):
-                return True
-        return False
+        state = get_read_state(user)
+        return state is not None and state.is_forum_unread(self)
 
     def refresh(self):
-        topicfilter = Topic.query.filter(Topic.forum_id==self.id)
-        topics = topicfilter.order_by(db.desc(Topic.modification_date)).all()
-        self.topiccount = topicfilter.count()
-        if self.topiccount:
-            lasttopic = topics[0]
+        """Recalculate the counters and the last topic/post from scratch"""
+
+        topics = board_topics.c
+        self.topiccount, self.postcount = db.execute(db.select(
+            [db.func.count(topics.topic_id),
+             db.func.coalesce(db.func.sum(topics.postcount), 0)],
+            topics.forum_id == self.id)).fetchone()
+        self._update_last()
+        self.modification_date = datetime.utcnow()
+
+    def _update_last(self, exclude_topic=None):
+        """Point lasttopic/lastpost to the most recently modified topic"""
+
+        query = Topic.query.filter(Topic.forum_id==self.id)
+        if exclude_topic is not None:
+            query = query.filter(Topic.id!=exclude_topic.id)
+        lasttopic = query.order_by(db.desc(Topic.modification_date)).first()
+        if lasttopic is not None:
             self.lasttopic_id = lasttopic.id
-            self.lastpost_id = lasttopic.lastpost.id
-            postcount = 0
-            for topic in topics:
-                postcount += topic.postcount
+            self.lastpost_id = lasttopic.lastpost_id
         else:
             self.lasttopic_id = None
             self.lastpost_id = None
-            postcount = 0
-        self.postcount = postcount
+
+    def post_added(self, post, new_topic=False):
+        """Update the counters for a newly created post"""
+
+        self.postcount = db.func.coalesce(board_forums.c.postcount, 0) + 1
+        if new_topic:
+            self.topiccount = db.func.coalesce(board_forums.c.topiccount, 0) + 1
+        self.lasttopic_id = post.topic_id
+        self.lastpost_id = post.id
+        self.modification_date = post.date
+
+    def post_removed(self, post, topic_removed=False):
+        """Update the counters for a post (and its topic if that was the
+        last post of it) that is going to be deleted.
+        """
+        self.postcount = db.func.coalesce(board_forums.c.postcount, 1) - 1
+        if topic_removed:
+            self.topiccount = db.func.coalesce(board_forums.c.topiccount, 1) - 1
+        if self.lastpost_id == post.id or \
+           (topic_removed and self.lasttopic_id == post.topic_id):
+            self._update_last(topic_removed and post.topic or None)
         self.modification_date = datetime.utcnow()
 
 
@@ -177,26 +201,30 @@ class TopicQuery(db.Query):
     """Addon methods for querying topics"""
 
     def get_list(self, endpoint=None, page=1, per_page=None,
-                 url_args=None, raise_if_empty=True, paginator=Pagination):
+                 url_args=None, raise_if_empty=True, paginator=Pagination,
+                 after=None, before=None, with_total=True):
         """Return a dict with pagination and topics."""
 
         if per_page is None:
             per_page = 20
 
         # send the query
-        offset = per_page * (page - 1)
-        stickylist = self.filter(Topic.is_sticky==True) \
-                        .order_by(db.desc(Topic.modification_date)).all()
-        topiclist = self.filter(db.or_(Topic.is_sticky==False,Topic.is_sticky==None)) \
-                        .order_by(db.desc(Topic.modification_date)) \
-                        .offset(offset).limit(per_page).all()
+        query = self.options(db.eagerload('lastpost'))
+        stickylist = query.filter(Topic.is_sticky==True) \
+                          .order_by(db.desc(Topic.modification_date)).all()
+        topiclist, pagination = query \
+            .filter(db.or_(Topic.is_sticky==False,Topic.is_sticky==None)) \
+            .get_page(endpoint, page, per_page, url_args, paginator,
+                      sort_key=[Topic.modification_date, Topic.id],
+                      descending=True, after=after, before=before,
+                      with_total=with_total)
 
         # if raising exceptions is wanted, raise i
         if raise_if_empty and (page != 1 and not topiclist):
             raise NotFound()
 
-        pagination = paginator(endpoint, page, per_page,
-                                self.count(), url_args=url_args)
+        topics = stickylist + topiclist
+        prefetch_authors(topics + [topic.lastpost for topic in topics])
 
         return {
             'stickies':         stickylist,
@@ -219,7 +247,7 @@ class AuthorBase(object):
             author.display_name = self.author_str
             return author
         else:
-            return User.query.get(self.author_id)
+            return get_user(self.author_id)
 
     def _set_author(self, author):
         if author.is_somebody:
@@ -249,6 +277,11 @@ class Topic(AuthorBase):
         self.is_locked = is_locked
         self.is_external = is_external
 
+    @property
+    def cache_tags(self):
+        """Fragment cache tags to invalidate if the topic changes."""
+        return ['board', 'forum:%d' % self.forum_id, 'topic:%d' % self.id]
+
     def can_post(self, user=None):
         if user is None:
             user = request.user
@@ -260,24 +293,8 @@ class Topic(AuthorBase):
         return self.is_global or user.is_somebody or self.forum.is_public
 
     def is_unread(self, user=None):
-        if user is None:
-            user = get_request().user
-        if isinstance(user, AnonymousUser):
-            return False
-
-        global_lastread = GlobalLastRead.query.get(user.id)
-        if not global_lastread:
-            return False
-        if global_lastread.date > self.modification_date:
-            return False
-
-        local_lastread = LocalLastRead.query.get((user.id,self.id))
-        if not local_lastread:
-            return True
-        if local_lastread.date >= self.modification_date:
-            return False
-
-        return True
+        state = get_read_state(user)
+        return state is not None and state.is_topic_unread(self)
 
     def refresh(self):
         """Refresh our lasttopic/lastpost data"""
@@ -289,34 +306,103 @@ class Topic(AuthorBase):
         self.lastpost_id = lastpost.id
         self.modification_date = lastpost.date
 
+    def post_added(self, post):
+        """Update the counters for a newly created post"""
+
+        self.postcount = db.func.coalesce(board_topics.c.postcount, 0) + 1
+        self.lastpost_id = post.id
+        self.modification_date = post.date
+
+    def post_removed(self, post):
+        """Update the counters for a post that is going to be deleted.
+        Returns `False` if the post was the last one of the topic.
+        """
+        if self.lastpost_id == post.id:
+            lastpost = Post.query.filter(Post.topic_id==self.id) \
+                           .filter(Post.id!=post.id) \
+                           .order_by(db.desc(Post.id)).first()
+            if lastpost is None:
+                return False
+            self.lastpost_id = lastpost.id
+            self.modification_date = lastpost.date
+        self.postcount = db.func.coalesce(board_topics.c.postcount, 1) - 1
+        if post.position is not None:
+            # close the gap so positions stay in sync with the post numbers.
+            # The unique index is checked row by row, so the post gives up
+            # its position and the others move through negative positions.
+            posts = board_posts.c
+            db.execute(board_posts.update(posts.post_id == post.id,
+                                          values={'position': None}))
+            db.execute(board_posts.update(db.and_(
+                posts.topic_id == self.id,
+                posts.position > post.position
+            ), values={'position': 1 - posts.position}))
+            db.execute(board_posts.update(db.and_(
+                posts.topic_id == self.id,
+                posts.position < 0
+            ), values={'position': -posts.position}))
+        return True
+
+    def next_post_position(self, connection=None):
+        """Return the position a new post of this topic gets.  The topic
+        row is locked until the end of the transaction, so concurrent
+        replies get their positions one after the other where the
+        database supports row locks.
+        """
+
+        if self.id is None:
+            return 1
+        if connection is None:
+            connection = db
+        topics = board_topics.c
+        posts = board_posts.c
+        connection.execute(db.select([topics.topic_id],
+                                     topics.topic_id == self.id,
+                                     for_update=True))
+        return connection.execute(db.select(
+            [db.func.coalesce(db.func.max(posts.position), 0) + 1],
+            posts.topic_id == self.id)).scalar()
+
     @cached_property
     def pagination(self):
         endpoint = 'board/topic_details'
         per_page = 20
-        return Pagination(endpoint, 0, per_page,
-                          Post.query.filter(Post.topic_id==self.id).count())
+        return Pagination(endpoint, 0, per_page, self.postcount or 0)
 
 class PostQuery(db.Query):
     """Addon methods for querying posts"""
 
     def get_list(self, endpoint=None, page=1, per_page=None,
-                 url_args=None, raise_if_empty=True, paginator=Pagination):
-        """Return a dict with pagination and topics."""
+                 url_args=None, raise_if_empty=True, paginator=Pagination,
+                 after=None, before=None, with_total=True, topic=None):
+        """Return a dict with pagination and posts.
+
+        If `topic` is given only posts of that topic are returned.  The
+        page is then looked up by post position and the postcount of the
+        topic is used as total, so no cursor or counting is needed.
+        """
 
         if per_page is None:
             per_page = 20
 
         # send the query
-        offset = per_page * (page - 1)
-        postlist = self.order_by(db.asc(Post.date)) \
-                       .offset(offset).limit(per_page).all()
+        if topic is not None:
+            postlist = self.filter(Post.topic_id==topic.id) \
+                           .filter(Post.position > per_page * (page - 1)) \
+                           .order_by(db.asc(Post.position)) \
+                           .limit(per_page).all()
+            pagination = paginator(endpoint, page, per_page,
+                                   topic.postcount or 0, url_args=url_args)
+        else:
+            postlist, pagination = self.get_page(endpoint, page, per_page,
+                url_args, paginator, sort_key=[Post.date, Post.id],
+                after=after, before=before, with_total=with_total)
 
         # if raising exceptions is wanted, raise i
         if raise_if_empty and (page != 1 and not postlist):
             raise NotFound()
 
-        pagination = paginator(endpoint, page, per_page,
-                                self.count(), url_args=url_args)
+        prefetch_authors(postlist)
 
         return {
             'posts':            postlist,
@@ -324,7 +410,7 @@ class PostQuery(db.Query):
         }
 
 
-class Post(AuthorBase):
+class Post(AuthorBase, RenderedText):
     """Representation of a post"""
 
     query = db.query_property(PostQuery)
@@ -337,6 +423,11 @@ class Post(AuthorBase):
         self.ip = ip
         self.topic = topic
 
+    @property
+    def cache_tags(self):
+        """Fragment cache tags to invalidate if the post changes."""
+        return ['topic:%d' % self.topic_id, 'post:%d' % self.id]
+
     def can_edit(self, user=None):
         if user is None:
             user = get_request().user
@@ -374,6 +465,30 @@ class LocalLastRead(object):
         if date:
             self.date = date
 
+
+class ForumLastRead(object):
+    """Per-Forum Lastread entry"""
+
+    def __init__(self, user, forum, date=None):
+        assert user is not None
+        assert forum is not None
+        self.user = user
+        self.forum = forum
+        if date:
+            self.date = date
+
+class PostPositionExt(db.MapperExtension):
+    """Numbers new posts within their topic right before they are inserted,
+    posts that already have a position keep it.  The unique index on the
+    positions rejects a post that got the position of a concurrent reply.
+    """
+
+    def before_insert(self, mapper, connection, instance):
+        if instance.position is None:
+            instance.position = instance.topic.next_post_position(connection)
+        return db.EXT_CONTINUE
+
+
 # Map Classes to tables
 db.mapper(Category, board_categories, properties={
     'id':           board_categories.c.category_id
@@ -395,9 +510,10 @@ db.mapper(Topic, board_topics, properties={
 })
 db.mapper(Post, board_posts, properties={
     'id':           board_posts.c.post_id,
+    'text':         db.synonym('_text', map_column=True),
     'topic':        db.relation(Topic, uselist=False, backref=db.backref('posts'),
                                 primaryjoin=board_posts.c.topic_id==board_topics.c.topic_id)
-})
+}, extension=PostPositionExt())
 db.mapper(GlobalLastRead, board_global_lastread, properties={
     'user':         db.relation(User, uselist=False),
 })
@@ -405,5 +521,11 @@ db.mapper(LocalLastRead, board_local_lastread, properties={
     'user':         db.relation(User, uselist=False),
     'topic':        db.relation(Topic, uselist=False)
 })
+db.mapper(ForumLastRead, board_forum_lastread, properties={
+    'user':         db.relation(User, uselist=False),
+    'forum':        db.relation(Forum, uselist=False, backref=db.backref(
+                                'lastread_marks', cascade='all, delete-orphan'))
+})
 
-__all__ = ['Category', 'Forum', 'Topic', 'Post', 'TopicEmpty', 'GlobalLastRead', 'LocalLastRead']
+__all__ = ['Category', 'Forum', 'Topic', 'Post', 'TopicEmpty', 'GlobalLastRead', 'LocalLastRead',
+           'ForumLastRead']
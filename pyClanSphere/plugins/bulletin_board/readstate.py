@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.plugins.bulletin_board.readstate
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Tracking of read and unread topics.
+
+    The read state of a user is made of three watermarks: the global one
+    (everything older is read), one per forum (set by marking a whole forum
+    read) and one per topic (set by viewing the topic).  A topic is unread if
+    it was modified after all of them.  The set of unread topics is fetched
+    with a single query the first time it is needed in a request and kept
+    up to date by the functions in this module afterwards.
+
+    :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+from datetime import datetime
+
+from pyClanSphere.api import db, get_request
+from pyClanSphere.utils.http import RequestLocal
+
+from pyClanSphere.plugins.bulletin_board.database import board_topics, \
+     board_local_lastread, board_forum_lastread, board_global_lastread
+
+
+#: read states already loaded in the current request, keyed by user id
+_loaded = RequestLocal(states=dict)
+
+
+class ReadState(object):
+    """The unread topics of a user.  Use :func:`get_read_state` to get an
+    instance instead of creating one.
+    """
+
+    def __init__(self, user_id, since, unread):
+        self.user_id = user_id
+        self.since = since
+        #: a dict of unread topic ids and the forum ids they belong to
+        self.topics = dict(unread)
+
+    @property
+    def forums(self):
+        """The ids of the forums with unread topics."""
+        return set(self.topics.itervalues())
+
+    def is_topic_unread(self, topic):
+        return topic.id in self.topics
+
+    def is_forum_unread(self, forum):
+        return forum.id in self.topics.itervalues()
+
+    def discard_topic(self, topic_id):
+        self.topics.pop(topic_id, None)
+
+    def discard_forum(self, forum_id):
+        for topic_id, topic_forum_id in self.topics.items():
+            if topic_forum_id == forum_id:
+                del self.topics[topic_id]
+
+    def __repr__(self):
+        return '<%s user=%r unread=%d>' % (
+            self.__class__.__name__,
+            self.user_id,
+            len(self.topics)
+        )
+
+
+def _query_unread(user_id, since):
+    """Return ``(topic_id, forum_id)`` tuples of all topics modified after
+    the global, forum and topic watermarks of the user.
+    """
+    t = board_topics.c
+    l = board_local_lastread.c
+    f = board_forum_lastread.c
+    joined = board_topics.outerjoin(board_local_lastread, db.and_(
+        l.topic_id == t.topic_id, l.user_id == user_id
+    )).outerjoin(board_forum_lastread, db.and_(
+        f.forum_id == t.forum_id, f.user_id == user_id
+    ))
+    query = db.select([t.topic_id, t.forum_id], from_obj=[joined],
+                      whereclause=db.and_(
+        t.modification_date > since,
+        db.or_(l.date == None, l.date < t.modification_date),
+        db.or_(f.date == None, f.date < t.modification_date)
+    ))
+    return db.execute(query).fetchall()
+
+
+def _global_lastread(user_id):
+    return db.execute(db.select([board_global_lastread.c.date],
+        board_global_lastread.c.user_id == user_id)).scalar()
+
+
+def get_read_state(user=None):
+    """Return the :class:`ReadState` of a user or `None` for anonymous users
+    and users that never visited the board.
+    """
+    if user is None:
+        user = get_request().user
+    if not user.is_somebody:
+        return None
+    states = _loaded.states
+    if user.id not in states:
+        since = _global_lastread(user.id)
+        if since is None:
+            states[user.id] = None
+        else:
+            states[user.id] = ReadState(user.id, since,
+                                        _query_unread(user.id, since))
+    return states[user.id]
+
+
+def mark_topic_read(user, topic, date=None):
+    """Mark the posts of a topic as read up until date (or all posts if
+    date is not given).  The first visit of a user sets the global
+    watermark instead.
+    """
+    from pyClanSphere.plugins.bulletin_board.models import GlobalLastRead, \
+         LocalLastRead
+    if not user.is_somebody:
+        return
+    if date is None:
+        date = topic.modification_date
+
+    global_lastread = GlobalLastRead.query.get(user.id)
+    if not global_lastread:
+        GlobalLastRead(user, datetime.utcnow())
+        db.commit()
+        _loaded.states.pop(user.id, None)
+        return
+
+    if global_lastread.date > topic.modification_date:
+        return
+
+    local_lastread = LocalLastRead.query.get((user.id, topic.id))
+    if not local_lastread:
+        LocalLastRead(user, topic, date)
+    elif local_lastread.date >= topic.modification_date:
+        return
+    else:
+        local_lastread.date = date
+    db.commit()
+
+    state = _loaded.states.get(user.id)
+    if state is not None and date >= topic.modification_date:
+        state.discard_topic(topic.id)
+
+
+def mark_forum_read(user, forum, date=None):
+    """Mark all topics of a forum read in one go.  This moves the forum
+    watermark and drops the topic watermarks it makes redundant.
+    """
+    from pyClanSphere.plugins.bulletin_board.models import ForumLastRead
+    if not user.is_somebody:
+        return
+    if date is None:
+        date = datetime.utcnow()
+
+    forum_lastread = ForumLastRead.query.get((user.id, forum.id))
+    if forum_lastread is None:
+        ForumLastRead(user, forum, date)
+    elif forum_lastread.date < date:
+        forum_lastread.date = date
+
+    topics_of_forum = db.select([board_topics.c.topic_id],
+                                board_topics.c.forum_id == forum.id)
+    db.execute(board_local_lastread.delete(db.and_(
+        board_local_lastread.c.user_id == user.id,
+        board_local_lastread.c.date <= date,
+        board_local_lastread.c.topic_id.in_(topics_of_forum)
+    )))
+    db.commit()
+
+    state = _loaded.states.get(user.id)
+    if state is not None:
+        state.discard_forum(forum.id)
+
+
+def mark_all_read(user, date=None):
+    """Mark the whole board read.  This moves the global watermark and
+    removes all forum and topic watermarks of the user.
+    """
+    from pyClanSphere.plugins.bulletin_board.models import GlobalLastRead
+    if not user.is_somebody:
+        return
+    if date is None:
+        date = datetime.utcnow()
+
+    global_lastread = GlobalLastRead.query.get(user.id)
+    if global_lastread is None:
+        GlobalLastRead(user, date)
+    else:
+        global_lastread.date = date
+    db.execute(board_forum_lastread.delete(
+        board_forum_lastread.c.user_id == user.id))
+    db.execute(board_local_lastread.delete(
+        board_local_lastread.c.user_id == user.id))
+    db.commit()
+    _loaded.states.pop(user.id, None)
+
+
+__all__ = ['ReadState', 'get_read_state', 'mark_topic_read',
+           'mark_forum_read', 'mark_all_read']
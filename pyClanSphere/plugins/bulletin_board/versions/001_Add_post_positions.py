@@ -0,0 +1,71 @@
+"""Add post positions"""
+# Keep __doc__ to a single line
+from pyClanSphere.upgrades.versions import *
+
+# use this or define your own if you need
+metadata = db.MetaData()
+
+for var in ['Table', 'Column', 'Integer', 'Index']:
+    globals()[var] = getattr(db,var)
+
+# Define tables here
+# board_posts is reflected in the upgrade functions as they need to know
+# whether the position column is already there (new installations).
+
+# Define the objects here
+
+
+def map_tables(mapper):
+    clear_mappers()
+    # Map tables to the python objects here
+
+
+def reflect_posts(migrate_engine):
+    return Table('board_posts', db.MetaData(bind=migrate_engine),
+                 autoload=True)
+
+
+def position_index(board_posts):
+    return Index('board_posts_topic_position', board_posts.c.topic_id,
+                 board_posts.c.position)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine
+    # bind migrate_engine to your metadata
+    session = scoped_session(lambda: create_session(migrate_engine,
+                                                    autoflush=True,
+                                                    autocommit=False))
+    map_tables(session.mapper)
+    metadata.bind = migrate_engine
+    board_posts = reflect_posts(migrate_engine)
+    if 'position' not in board_posts.c:
+        yield u'<p>Add position column to board posts</p>\n'
+        Column('position', Integer).create(board_posts)
+        position_index(board_posts).create(migrate_engine)
+
+    yield u'<p>Numbering posts of all topics</p>\n'
+    posts = board_posts.c
+    topic_ids = [row[0] for row in migrate_engine.execute(
+                 db.select([posts.topic_id]).distinct())]
+    for topic_id in topic_ids:
+        post_ids = migrate_engine.execute(db.select([posts.post_id],
+                       posts.topic_id == topic_id) \
+                       .order_by(posts.date, posts.post_id))
+        values = [{'pid': row[0], 'pos': position}
+                  for position, row in enumerate(post_ids, 1)]
+        migrate_engine.execute(board_posts.update(
+            posts.post_id == db.bindparam('pid'),
+            values={'position': db.bindparam('pos')}), values)
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    session = scoped_session(lambda: create_session(migrate_engine,
+                                                    autoflush=True,
+                                                    autocommit=False))
+    map_tables(session.mapper)
+    metadata.bind = migrate_engine
+    yield u'<p>Drop position column from board posts</p>\n'
+    board_posts = reflect_posts(migrate_engine)
+    position_index(board_posts).drop(migrate_engine)
+    drop_column(board_posts.c.position, board_posts)
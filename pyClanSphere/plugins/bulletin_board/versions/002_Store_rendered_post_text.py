@@ -0,0 +1,59 @@
+"""Store rendered post text"""
+# Keep __doc__ to a single line
+from pyClanSphere.upgrades.versions import *
+
+# use this or define your own if you need
+metadata = db.MetaData()
+
+for var in ['Table', 'Column', 'Integer', 'Text', 'Index']:
+    globals()[var] = getattr(db,var)
+
+# Define tables here
+# board_posts is reflected in the upgrade functions as they need to know
+# whether the columns are already there (new installations).
+
+# Define the objects here
+
+
+def map_tables(mapper):
+    clear_mappers()
+    # Map tables to the python objects here
+
+
+def reflect_table(migrate_engine):
+    return Table('board_posts', db.MetaData(bind=migrate_engine),
+                 autoload=True)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine
+    # bind migrate_engine to your metadata
+    session = scoped_session(lambda: create_session(migrate_engine,
+                                                    autoflush=True,
+                                                    autocommit=False))
+    map_tables(session.mapper)
+    metadata.bind = migrate_engine
+    board_posts = reflect_table(migrate_engine)
+    if 'text_html' not in board_posts.c:
+        # the html is rendered when the texts are shown the next time
+        yield u'<p>Add rendered text columns to board posts</p>\n'
+        Column('text_html', Text).create(board_posts)
+        Column('text_html_version', Integer).create(board_posts)
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    session = scoped_session(lambda: create_session(migrate_engine,
+                                                    autoflush=True,
+                                                    autocommit=False))
+    map_tables(session.mapper)
+    metadata.bind = migrate_engine
+    yield u'<p>Drop rendered text columns from board posts</p>\n'
+    board_posts = reflect_table(migrate_engine)
+    drop_column(board_posts.c.text_html_version, board_posts)
+    board_posts = reflect_table(migrate_engine)
+    drop_column(board_posts.c.text_html, board_posts)
+    if migrate_engine.name == 'sqlite':
+        # sqlite copies the table to drop columns, which loses its indexes
+        board_posts = reflect_table(migrate_engine)
+        Index('board_posts_topic_position', board_posts.c.topic_id,
+              board_posts.c.position).create(migrate_engine)
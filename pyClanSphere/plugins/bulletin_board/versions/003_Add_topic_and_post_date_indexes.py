@@ -0,0 +1,51 @@
+"""Add topic and post date indexes"""
+# Keep __doc__ to a single line
+from pyClanSphere.upgrades.versions import *
+
+# use this or define your own if you need
+metadata = db.MetaData()
+
+# Define tables here
+# the tables are reflected by the index helpers as new installations
+# already have the indexes.
+
+#: (table, index name, columns)
+INDEXES = [
+    ('board_topics', 'board_topics_forum_modification', ('forum_id', 'modification_date')),
+    ('board_posts', 'board_posts_topic_date', ('topic_id', 'date')),
+]
+
+# Define the objects here
+
+
+def map_tables(mapper):
+    clear_mappers()
+    # Map tables to the python objects here
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine
+    # bind migrate_engine to your metadata
+    session = scoped_session(lambda: create_session(migrate_engine,
+                                                    autoflush=True,
+                                                    autocommit=False))
+    map_tables(session.mapper)
+    metadata.bind = migrate_engine
+    created = False
+    for table, name, columns in INDEXES:
+        if create_index(migrate_engine, table, name, *columns):
+            created = True
+            yield u'<p>Add index %s</p>\n' % name
+    if not created:
+        yield u'<p>The indexes exist already</p>\n'
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    session = scoped_session(lambda: create_session(migrate_engine,
+                                                    autoflush=True,
+                                                    autocommit=False))
+    map_tables(session.mapper)
+    metadata.bind = migrate_engine
+    for table, name, columns in INDEXES:
+        if drop_index(migrate_engine, table, name):
+            yield u'<p>Drop index %s</p>\n' % name
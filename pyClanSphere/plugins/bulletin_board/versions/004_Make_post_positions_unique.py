@@ -0,0 +1,77 @@
+"""Make post positions unique"""
+# Keep __doc__ to a single line
+from pyClanSphere.upgrades.versions import *
+
+# use this or define your own if you need
+metadata = db.MetaData()
+
+# Define tables here
+# board_posts is reflected in the upgrade functions as new installations
+# already have the unique index.
+
+#: the index on (topic_id, position)
+INDEX = 'board_posts_topic_position'
+
+# Define the objects here
+
+
+def map_tables(mapper):
+    clear_mappers()
+    # Map tables to the python objects here
+
+
+def position_index(board_posts):
+    for index in board_posts.indexes:
+        if index.name == INDEX:
+            return index
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine
+    # bind migrate_engine to your metadata
+    session = scoped_session(lambda: create_session(migrate_engine,
+                                                    autoflush=True,
+                                                    autocommit=False))
+    map_tables(session.mapper)
+    metadata.bind = migrate_engine
+    board_posts = reflect_table('board_posts', migrate_engine)
+    index = position_index(board_posts)
+    if index is not None and index.unique:
+        yield u'<p>The post positions are unique already</p>\n'
+        return
+
+    # concurrent replies could get the same position, number the posts
+    # of those topics again in their current order
+    posts = board_posts.c
+    topic_ids = set(row[0] for row in migrate_engine.execute(
+                    db.select([posts.topic_id])
+                      .group_by(posts.topic_id, posts.position)
+                      .having(db.func.count(posts.post_id) > 1)))
+    if topic_ids:
+        yield u'<p>Numbering posts of %d topics again</p>\n' % len(topic_ids)
+    for topic_id in topic_ids:
+        post_ids = migrate_engine.execute(db.select([posts.post_id],
+                       posts.topic_id == topic_id) \
+                       .order_by(posts.position, posts.date, posts.post_id))
+        values = [{'pid': row[0], 'pos': position}
+                  for position, row in enumerate(post_ids, 1)]
+        migrate_engine.execute(board_posts.update(
+            posts.post_id == db.bindparam('pid'),
+            values={'position': db.bindparam('pos')}), values)
+
+    yield u'<p>Make the post positions unique</p>\n'
+    drop_index(migrate_engine, 'board_posts', INDEX)
+    create_index(migrate_engine, 'board_posts', INDEX, 'topic_id',
+                 'position', unique=True)
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    session = scoped_session(lambda: create_session(migrate_engine,
+                                                    autoflush=True,
+                                                    autocommit=False))
+    map_tables(session.mapper)
+    metadata.bind = migrate_engine
+    yield u'<p>Allow duplicate post positions</p>\n'
+    drop_index(migrate_engine, 'board_posts', INDEX)
+    create_index(migrate_engine, 'board_posts', INDEX, 'topic_id',
+                 'position')
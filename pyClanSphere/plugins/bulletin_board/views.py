@@ -12,21 +12,22 @@
 from werkzeug import escape
 from werkzeug.exceptions import NotFound, Forbidden
 
-from pyClanSphere import cache
-from pyClanSphere.api import _, url_for, db, render_response
-from pyClanSphere.models import AnonymousUser
+from pyClanSphere.api import _, url_for, db, render_response, get_request
+from pyClanSphere.application import InternalError
 from pyClanSphere.utils.admin import require_admin_privilege, \
      flash as admin_flash
 from pyClanSphere.utils.datastructures import OrderedDict
 from pyClanSphere.utils.http import redirect_to
 from pyClanSphere.utils.pagination import AdminPagination
+from pyClanSphere.utils.userloader import prefetch_authors
 from pyClanSphere.views.admin import render_admin_response, PER_PAGE
 
 from pyClanSphere.plugins.bulletin_board.forms import CategoryForm, \
      DeleteCategoryForm, ForumForm, DeleteForumForm, PostForm, \
-     DeletePostForm
+     DeletePostForm, MarkReadForm
 from pyClanSphere.plugins.bulletin_board.models import *
 from pyClanSphere.plugins.bulletin_board.privileges import BOARD_MANAGE
+from pyClanSphere.plugins.bulletin_board.readstate import mark_topic_read
 
 #
 # Helper functions
@@ -36,36 +37,13 @@ def check_unread(user, topic, date=None):
 
     if user is None:
         user = get_request().user
-    if isinstance(user, AnonymousUser):
-        return
-
-    global_lastread = GlobalLastRead.query.get(user.id)
-    if not global_lastread:
-        GlobalLastRead(user)
-        db.commit()
-        return
-
-    if global_lastread.date > topic.modification_date:
-        return
-
-    local_lastread = LocalLastRead.query.get((user.id,topic.id))
-    if not local_lastread:
-        LocalLastRead(user,topic,date)
-        db.commit()
-        return
-    if local_lastread.date >= topic.modification_date:
-        return
-
-    local_lastread.date = date
-    db.commit()
-    return
+    mark_topic_read(user, topic, date)
 
 
 #
 # Frontend views
 #
 
-@cache.response(vary=('user',))
 def board_index(request):
     """Render the board index page
 
@@ -74,13 +52,18 @@ def board_index(request):
         `categories`:
             Ordered Dictionary with 'catname': 'forums'
 
+        `mark_read_form`:
+            Form to mark the whole board read
+
     :Template name: ``board_index.html``
     :URL endpoint: ``board/index``
     """
     renderdict = OrderedDict()
     categories = Category.query.order_by(db.asc('ordering')).all()
     for category in categories:
-        forums = category.forums.order_by(db.asc('ordering')).all()
+        forums = category.forums.options(db.eagerload('lastpost'),
+                                         db.eagerload('lasttopic')) \
+                                .order_by(db.asc('ordering')).all()
         if forums:
             user = request.user
             forumlist = [forum for forum in \
@@ -88,10 +71,14 @@ def board_index(request):
             if forumlist:
                 renderdict[category] = forumlist
 
-    return render_response('board_index.html', categories=renderdict)
+    # fetch the authors of all last posts in one go
+    prefetch_authors([forum.lastpost for forumlist in renderdict.values()
+                      for forum in forumlist])
+
+    return render_response('board_index.html', categories=renderdict,
+                           mark_read_form=MarkReadForm().as_widget())
 
 
-@cache.response(vary=('user',))
 def topic_list(request, forum_id, page=1):
     """Render topics for a given forum
 
@@ -113,6 +100,9 @@ def topic_list(request, forum_id, page=1):
             Form for topic creation or None if user is not allowed
             to create topics
 
+        `mark_read_form`:
+            Form to mark all topics of the forum read
+
     :Template name: ``board_topic_index.html``
     :URL endpoint: ``board/topics``
     """
@@ -134,14 +124,16 @@ def topic_list(request, forum_id, page=1):
 
     data = Topic.query.filter(Topic.forum==forum) \
                 .get_list('board/topics', page,
-                          request.per_page, {'forum_id': forum_id})
+                          request.per_page, {'forum_id': forum_id},
+                          after=request.args.get('after'),
+                          before=request.args.get('before'))
     data['forum'] = forum
     data['form'] = form.as_widget() if form else None
+    data['mark_read_form'] = MarkReadForm(forum).as_widget()
 
     return render_response('board_topic_list.html', **data)
 
 
-@cache.response(vary=('user',))
 def topic_detail(request, topic_id, page=1):
     """Render posts for a given topic
 
@@ -180,9 +172,9 @@ def topic_detail(request, topic_id, page=1):
             form.create_post()
             form.reset()
 
-    data = Post.query.filter(Post.topic==topic)\
-               .get_list('board/topic_detail', page,
-                         request.per_page, {'topic_id': topic_id})
+    data = Post.query.get_list('board/topic_detail', page,
+                               request.per_page, {'topic_id': topic_id},
+                               topic=topic)
 
     # Mark read up to last shown post date
     check_unread(request.user, topic, data['posts'][-1].date)
@@ -192,6 +184,35 @@ def topic_detail(request, topic_id, page=1):
                           form=form.as_widget() if form else None)
 
 
+def forum_mark_read(request, forum_id):
+    """Mark all topics of a forum as read and go back to the forum.  Only
+    a posted `MarkReadForm` changes the read state.
+
+    :URL endpoint: ``board/forum_mark_read``
+    """
+    forum = Forum.query.get(forum_id)
+    if forum is None:
+        raise NotFound()
+    if not forum.can_see(request.user):
+       raise Forbidden()
+    form = MarkReadForm(forum)
+    if request.method == 'POST' and form.validate(request.form):
+        form.mark_read(request.user)
+    return redirect_to('board/topics', forum_id=forum.id)
+
+
+def board_mark_read(request):
+    """Mark the whole board as read and go back to the board index.  Only
+    a posted `MarkReadForm` changes the read state.
+
+    :URL endpoint: ``board/mark_read``
+    """
+    form = MarkReadForm()
+    if request.method == 'POST' and form.validate(request.form):
+        form.mark_read(request.user)
+    return redirect_to('board/index')
+
+
 def topic_by_post(request, post_id):
     """This function acts as a proxy to find posts by id
 
@@ -201,7 +222,7 @@ def topic_by_post(request, post_id):
     post = Post.query.get(post_id)
     if post is None:
         raise NotFound()
-    postnr, page, topic_id = locate_post(post)
+    postnr, page, topic_id = locate_post(post, request.per_page)
     return redirect_to('board/topic_detail', topic_id=topic_id, page=page, _anchor="post-%i" % (post_id,))
 
 
@@ -229,7 +250,7 @@ def post_edit(request, post_id):
     post = Post.query.get(post_id)
     if post is None:
         raise NotFound()
-    (postnr, page, topic_id) = locate_post(post)
+    (postnr, page, topic_id) = locate_post(post, request.per_page)
 
     user = request.user
     topic = post.topic
@@ -244,9 +265,9 @@ def post_edit(request, post_id):
             form.save_changes(post)
             return redirect_to('board/post_find', post_id=post.id)
 
-    data = Post.query.filter(Post.topic==topic)\
-               .get_list('board/topic_detail', page,
-                         request.per_page, {'topic_id': topic_id})
+    data = Post.query.get_list('board/topic_detail', page,
+                               request.per_page, {'topic_id': topic_id},
+                               topic=topic)
 
     return render_response('board_topic_detail.html', topic=topic,
                           posts=data['posts'], pagination=data['pagination'],
@@ -254,24 +275,19 @@ def post_edit(request, post_id):
 
 
 def locate_post(searchpost, per_page=None):
-    """Locate a post and return page and topic which it is on"""
+    """Locate a post and return its number, page and topic which it is on"""
 
     assert searchpost is not None
-    topic = searchpost.topic
-    posts = Post.query.filter(Post.topic==topic).order_by(db.asc(Post.date)).all()
-    number = -1
-    for postnr, post in enumerate(posts):
-        if post.id == searchpost.id:
-            number = postnr
-            break
-    if number == -1:
-        raise get_application.InternalError('Post searching returned invalid id, check database consistency')
+    if searchpost.position is None:
+        raise InternalError(_(u'Post %d has no position, run the board '
+                              u'upgrade to fix this') % searchpost.id)
+    if per_page is None or per_page < 1:
+        per_page = 20
 
-    page = 1
-    if per_page:
-        page = ceil(postnr/perpage)
+    postnr = searchpost.position - 1
+    page = postnr // per_page + 1
 
-    return (postnr, page, topic.id)
+    return (postnr, page, searchpost.topic_id)
 
 
 def post_delete(request, post_id):
@@ -280,7 +296,7 @@ def post_delete(request, post_id):
     post = Post.query.get(post_id)
     if post is None:
         raise NotFound()
-    (postnr, page, topic_id) = locate_post(post)
+    (postnr, page, topic_id) = locate_post(post, request.per_page)
 
     user = request.user
     topic = post.topic
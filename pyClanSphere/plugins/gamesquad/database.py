@@ -10,7 +10,7 @@
     :license: BSD, see LICENSE for more details.
 """
 
-from pyClanSphere.database import db, metadata
+from pyClanSphere.database import db, metadata, create_tables
 
 games = db.Table('games', metadata,
     db.Column('game_id', db.Integer, primary_key=True),
@@ -46,8 +46,11 @@ gameaccounts = db.Table('gameaccounts', metadata,
 )
 
 def init_database(app):
-    """ This is for inserting our new table"""
-    engine = app.database_engine
-    metadata.create_all(engine)
+    """Create the tables that don't exist yet.  Returns `True` if they
+    were all created, they are in their latest version then.
+    """
+    return create_tables(app.database_engine, [
+        games, squads, levels, squadmembers, gameaccounts
+    ])
 
 __all__ = ['games', 'squads', 'levels', 'squadmembers', 'gameaccounts']
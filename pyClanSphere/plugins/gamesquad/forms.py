@@ -11,7 +11,6 @@
 """
 
 from pyClanSphere.api import *
-from pyClanSphere.models import User
 from pyClanSphere.utils import forms
 from pyClanSphere.utils.validators import ValidationError, is_not_whitespace_only
 
@@ -211,8 +210,8 @@ class _SquadMemberBoundForm(forms.Form):
 class EditSquadMemberForm(_SquadMemberBoundForm):
     """Decide whos in our squad."""
 
-    clanmember = forms.ModelField(User, 'id', lazy_gettext(u'Clanmember'),
-                                  widget=forms.SelectBox)
+    clanmember = forms.UserField(lazy_gettext(u'Clanmember'), messages=dict(
+                    excluded=lazy_gettext(u'“%(user)s” is already a member.')))
     level = forms.ModelField(Level, 'id', lazy_gettext(u'Level'),
                             widget=forms.SelectBox)
     othertasks = forms.TextField(lazy_gettext(u'Other tasks'), max_length=100,
@@ -230,10 +229,9 @@ class EditSquadMemberForm(_SquadMemberBoundForm):
         self.squad = squad
         # Need access to squad here, as the member might be new and thus there is no
         # member.squad relation yet.
-        self.clanmember.choices = [(user.id, user.display_name) for \
-                                   user in User.query.namesort().all() if user not in self.squad.members]
+        self.clanmember.exclude = set(user.id for user in self.squad.members)
         if self.squadmember:
-            self.clanmember.choices.insert(0,(squadmember.user.id, squadmember.user.display_name))
+            self.clanmember.exclude.discard(squadmember.user.id)
         self.level.choices = [(level.id, level.name) for level in Level.query.order_by(Level.ordering).all()]
 
     def make_squadmember(self):
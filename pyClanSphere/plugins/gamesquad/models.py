@@ -12,6 +12,8 @@
 
 from datetime import datetime, date
 
+from werkzeug.exceptions import NotFound
+
 from pyClanSphere.api import *
 from pyClanSphere.schema import users
 from pyClanSphere.models import User
@@ -26,25 +28,22 @@ class GameQuery(db.Query):
     """Provide better prepared queries"""
 
     def get_list(self, endpoint=None, page=1, per_page=None,
-                 url_args=None, raise_if_empty=True, paginator=Pagination):
+                 url_args=None, raise_if_empty=True, paginator=Pagination,
+                 after=None, before=None, with_total=True):
         """Return a dict with pagination and the current members."""
 
         if per_page is None:
             per_page = 20
 
         # send the query
-        offset = per_page * (page - 1)
-        query_filter = self
-        gamelist = query_filter.order_by(Game.name) \
-                               .offset(offset).limit(per_page).all()
+        gamelist, pagination = self.get_page(endpoint, page, per_page,
+            url_args, paginator, sort_key=[Game.name, Game.id],
+            after=after, before=before, with_total=with_total)
 
         # if raising exceptions is wanted, raise it
         if raise_if_empty and (page != 1 and not gamelist):
             raise NotFound()
 
-        pagination = paginator(endpoint, page, per_page,
-                                query_filter.count(), url_args=url_args)
-
         return {
             'games':            gamelist,
             'pagination':       pagination
@@ -144,25 +143,23 @@ class SquadMemberQuery(db.Query):
     """Provide better prepared queries"""
 
     def get_list(self, squad, endpoint=None, page=1, per_page=None,
-                 url_args=None, raise_if_empty=True, paginator=Pagination):
+                 url_args=None, raise_if_empty=True, paginator=Pagination,
+                 with_total=True):
         """Return a dict with pagination and the current members."""
 
         if per_page is None:
             per_page = 20
 
-        # send the query
-        offset = per_page * (page - 1)
+        # send the query, members are sorted by the ordering of the eagerly
+        # loaded level so there is no sort key to seek on
         query_filter = self.filter_by(squad_id=squad.id).order_by('levels_1_ordering')
-        memberlist = query_filter \
-                         .offset(offset).limit(per_page).all()
+        memberlist, pagination = query_filter.get_page(endpoint, page,
+            per_page, url_args, paginator, with_total=with_total)
 
         # if raising exceptions is wanted, raise it
         if raise_if_empty and (page != 1 and not memberlist):
             raise NotFound()
 
-        pagination = paginator(endpoint, page, per_page,
-                                query_filter.count(), url_args=url_args)
-
         return {
             'squad':            squad,
             'squadmembers':     memberlist,
@@ -194,25 +191,22 @@ class LevelQuery(db.Query):
     """Provide better prepared queries"""
 
     def get_list(self, endpoint=None, page=1, per_page=None,
-                 url_args=None, raise_if_empty=True, paginator=Pagination):
+                 url_args=None, raise_if_empty=True, paginator=Pagination,
+                 after=None, before=None, with_total=True):
         """Return a dict with pagination and the current members."""
 
         if per_page is None:
             per_page = 20
 
         # send the query
-        offset = per_page * (page - 1)
-        query_filter = self
-        levellist = query_filter.order_by(Level.ordering) \
-                                .offset(offset).limit(per_page).all()
+        levellist, pagination = self.get_page(endpoint, page, per_page,
+            url_args, paginator, sort_key=[Level.ordering, Level.id],
+            after=after, before=before, with_total=with_total)
 
         # if raising exceptions is wanted, raise it
         if raise_if_empty and (page != 1 and not levellist):
             raise NotFound()
 
-        pagination = paginator(endpoint, page, per_page,
-                                query_filter.count(), url_args=url_args)
-
         return {
             'levels':           levellist,
             'pagination':       pagination
@@ -14,7 +14,9 @@ from os.path import join, dirname
 
 from pyClanSphere.api import _, url_for, signal, signals
 from pyClanSphere.utils.admin import add_admin_urls
+from pyClanSphere.utils.userloader import prefetch_authors
 
+from pyClanSphere.plugins.news.archive import recount_archive
 from pyClanSphere.plugins.news.database import init_database
 from pyClanSphere.plugins.news.models import News
 from pyClanSphere.plugins.news.privileges import PLUGIN_PRIVILEGES, NEWS_CREATE, NEWS_EDIT, NEWS_DELETE
@@ -38,7 +40,7 @@ def add_frontpage_contents(sender, **kwds):
 
     context = kwds['context']
     if 'newsitems' not in context:
-        context['newsitems'] = News.query.latest().limit(5).all()
+        context['newsitems'] = prefetch_authors(News.query.latest().limit(5).all())
     return context
 
 def add_admin_links(sender, **kwds):
@@ -58,7 +60,10 @@ def setup(app, plugin):
     """Init our needed stuff"""
 
     # Setup tables
-    init_database()
+    created = init_database()
+
+    # Register repository for schema updates
+    app.register_upgrade_repository(plugin, dirname(__file__), created)
 
     # Add our privileges
     for priv in PLUGIN_PRIVILEGES.values():
@@ -94,3 +99,6 @@ def setup(app, plugin):
 
     # Add newsitems to frontpage
     signals.frontpage_context_collect.connect(add_frontpage_contents)
+
+    # Rebuild the archive index with manage-database recount
+    signals.recount_counters.connect(recount_archive)
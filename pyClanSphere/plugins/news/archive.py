@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.plugins.news.archive
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    The archive index: the number of published news per day.
+
+    The ``news_archive`` table is kept up to date by
+    :class:`ArchiveIndexExt` whenever news are published, moved to another
+    date, unpublished or deleted.  The month and year counts are summed up
+    from the days, that's a few hundred rows per year loaded with a single
+    query.  :func:`rebuild_archive_index` counts everything again with a
+    ``GROUP BY``, it's run by the ``recount`` command of the database
+    management script.
+
+    News published for later are counted from the start of their day on.
+
+    :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+from datetime import date, datetime
+
+from sqlalchemy.exc import IntegrityError
+
+from pyClanSphere.api import db
+
+from pyClanSphere.plugins.news.database import newsitems, news_archive
+
+
+DETAILS = ('years', 'months', 'days')
+
+
+def _period_clause(year, month=None, day=None):
+    a = news_archive.c
+    clause = a.year == year
+    if month is not None:
+        clause &= a.month == month
+        if day is not None:
+            clause &= a.day == day
+    return clause
+
+
+def _insert_count(connection, day, count):
+    """Insert the row of the date `day`.  Returns `False` if it exists
+    already because a concurrent transaction inserted it first.
+    """
+    # PostgreSQL aborts the whole transaction on an error outside of a
+    # savepoint.  pysqlite can't do savepoints, but SQLite serializes the
+    # writes anyway and only undoes the failed statement.
+    savepoint = None
+    if connection.dialect.name != 'sqlite':
+        savepoint = connection.begin_nested()
+    try:
+        connection.execute(news_archive.insert(), year=day.year,
+                           month=day.month, day=day.day, newscount=count)
+    except IntegrityError:
+        if savepoint is not None:
+            savepoint.rollback()
+        return False
+    if savepoint is not None:
+        savepoint.commit()
+    return True
+
+
+def change_count(connection, day, delta):
+    """Add `delta` to the count of the date `day`."""
+    a = news_archive.c
+    clause = _period_clause(day.year, day.month, day.day)
+    rv = connection.execute(news_archive.update(clause, values={
+        'newscount':    a.newscount + delta
+    }))
+    if not rv.rowcount:
+        if delta > 0 and not _insert_count(connection, day, delta):
+            # the row is there now, count on it
+            change_count(connection, day, delta)
+    elif delta < 0:
+        connection.execute(news_archive.delete(clause & (a.newscount <= 0)))
+
+
+class ArchiveIndexExt(db.MapperExtension):
+    """Updates the archive index when news are flushed.  The mapped class
+    has to provide an `archive_day(status, pub_date)` static method that
+    returns the date a news item is counted for or `None`.
+    """
+
+    def _move(self, connection, old, new):
+        if old != new:
+            if old is not None:
+                change_count(connection, old, -1)
+            if new is not None:
+                change_count(connection, new, 1)
+        return db.EXT_CONTINUE
+
+    def _current(self, instance):
+        return instance.archive_day(instance.status, instance.pub_date)
+
+    def _stored(self, connection, instance):
+        n = newsitems.c
+        row = connection.execute(db.select([n.status, n.pub_date],
+                                           n.news_id == instance.id)).fetchone()
+        if row is not None:
+            return instance.archive_day(row.status, row.pub_date)
+
+    def after_insert(self, mapper, connection, instance):
+        return self._move(connection, None, self._current(instance))
+
+    def before_update(self, mapper, connection, instance):
+        return self._move(connection, self._stored(connection, instance),
+                          self._current(instance))
+
+    def before_delete(self, mapper, connection, instance):
+        return self._move(connection, self._stored(connection, instance),
+                          None)
+
+
+def get_archive(detail='months', limit=None):
+    """Return the periods (years, months or days as dates) with published
+    news, the newest first, and the number of news per period.  At most
+    `limit` periods are returned, `more` tells if there are more.
+    """
+    if detail not in DETAILS:
+        raise ValueError('detail must be years, months, or days')
+    a = news_archive.c
+    today = datetime.utcnow().date()
+    counts = {}
+    for year, month, day, count in db.execute(db.select([a.year, a.month,
+                                              a.day, a.newscount])):
+        if date(year, month, day) > today:
+            continue
+        if detail == 'years':
+            period = date(year, 1, 1)
+        elif detail == 'months':
+            period = date(year, month, 1)
+        else:
+            period = date(year, month, day)
+        counts[period] = counts.get(period, 0) + count
+    periods = sorted(counts, reverse=True)
+    there_are_more = limit is not None and len(periods) > limit
+    if there_are_more:
+        periods = periods[:limit]
+    return {
+        detail:     periods,
+        'counts':   counts,
+        'more':     there_are_more,
+        'empty':    not periods
+    }
+
+
+def get_period_count(year, month=None, day=None):
+    """Return the number of news published in a year, month or day up to
+    today and whether the period is over (before today), only then the
+    number is final.  News published for later today are already counted.
+    """
+    a = news_archive.c
+    today = datetime.utcnow().date()
+    not_later = (a.year < today.year) | ((a.year == today.year) &
+        ((a.month < today.month) | ((a.month == today.month) &
+                                    (a.day <= today.day))))
+    count = db.execute(db.select([db.func.coalesce(db.func.sum(a.newscount),
+                                                   0)],
+                                 _period_clause(year, month, day) &
+                                 not_later)).scalar()
+    if month is None:
+        over = year < today.year
+    elif day is None:
+        over = (year, month) < (today.year, today.month)
+    else:
+        over = date(year, month, day) < today
+    return int(count), over
+
+
+def rebuild_archive_index(connection):
+    """Count the published news of every day again."""
+    from pyClanSphere.plugins.news.models import STATUS_PUBLISHED
+    n = newsitems.c
+    parts = [db.extract(field, n.pub_date) for field in
+             ('year', 'month', 'day')]
+    rows = connection.execute(db.select(parts + [db.func.count(n.news_id)],
+                                        (n.status == STATUS_PUBLISHED) &
+                                        (n.pub_date != None)) \
+                                .group_by(*parts)).fetchall()
+    connection.execute(news_archive.delete())
+    if rows:
+        connection.execute(news_archive.insert(), [
+            {'year': year, 'month': month, 'day': day, 'newscount': count}
+            for year, month, day, count in rows])
+    return len(rows)
+
+
+def recount_archive(sender, **kwds):
+    """Listener for the `recount_counters` signal."""
+    yield u'<h3>News archive</h3>\n'
+    days = rebuild_archive_index(db.session.connection())
+    db.commit()
+    yield u'<p>Counted the news of %d days</p>\n' % days
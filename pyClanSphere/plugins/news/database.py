@@ -10,7 +10,7 @@
     :license: BSD, see LICENSE for more details.
 """
 
-from pyClanSphere.database import db, metadata
+from pyClanSphere.database import db, metadata, create_tables
 
 newsitems = db.Table('newsitems', metadata,
     db.Column('news_id', db.Integer, primary_key=True),
@@ -18,12 +18,27 @@ newsitems = db.Table('newsitems', metadata,
     db.Column('last_update', db.DateTime),
     db.Column('title', db.String(150)),
     db.Column('text', db.Text),
+    db.Column('text_html', db.Text),
+    db.Column('text_html_version', db.Integer),
     db.Column('author_id', db.Integer, db.ForeignKey('users.user_id')),
     db.Column('status', db.Integer),
 )
+# published news are listed by publication date
+db.Index('newsitems_status_pub_date', newsitems.c.status,
+         newsitems.c.pub_date)
+
+#: the number of published news per day, see the archive module
+news_archive = db.Table('news_archive', metadata,
+    db.Column('year', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('month', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('day', db.Integer, primary_key=True, autoincrement=False),
+    db.Column('newscount', db.Integer, nullable=False)
+)
 
 def init_database():
-    """ This is for inserting our new table"""
+    """Create the tables that don't exist yet.  Returns `True` if they
+    were all created, they are in their latest version then.
+    """
     from pyClanSphere.application import get_application
-    engine = get_application().database_engine
-    metadata.create_all(engine)
+    return create_tables(get_application().database_engine,
+                         [newsitems, news_archive])
@@ -9,13 +9,18 @@
                 see AUTHORS for more details.
     :license: BSD, see LICENSE for more details.
 """
-from datetime import datetime, date
+from datetime import datetime, timedelta
+
+from werkzeug.exceptions import NotFound
 
 from pyClanSphere.api import *
 from pyClanSphere.models import User
+from pyClanSphere.utils.markup import RenderedText
 from pyClanSphere.utils.text import build_tag_uri
 from pyClanSphere.utils.pagination import Pagination
+from pyClanSphere.utils.userloader import prefetch_authors
 
+from pyClanSphere.plugins.news.archive import ArchiveIndexExt, get_archive
 from pyClanSphere.plugins.news.database import newsitems
 from pyClanSphere.plugins.news.privileges import NEWS_EDIT, NEWS_PUBLIC
 
@@ -47,7 +52,9 @@ class NewsQuery(db.Query):
         return query
 
     def get_list(self, endpoint=None, page=1, per_page=None,
-                 url_args=None, raise_if_empty=True, paginator=Pagination):
+                 url_args=None, raise_if_empty=True, paginator=Pagination,
+                 after=None, before=None, total=None, with_total=True,
+                 total_timeout=None):
         """Return a dict with pagination, the current posts, number of pages,
         total posts and all that stuff for further processing.
         """
@@ -56,16 +63,16 @@ class NewsQuery(db.Query):
             per_page = 20
 
         # send the query
-        offset = per_page * (page - 1)
-        newslist = self.order_by(News.pub_date.desc()) \
-                       .offset(offset).limit(per_page).all()
+        newslist, pagination = self.get_page(endpoint, page, per_page,
+            url_args, paginator, sort_key=[News.pub_date, News.id],
+            descending=True, after=after, before=before, total=total,
+            with_total=with_total, total_timeout=total_timeout)
 
         # if raising exceptions is wanted, raise it
         if raise_if_empty and (page != 1 and not newslist):
             raise NotFound()
 
-        pagination = paginator(endpoint, page, per_page,
-                                self.count(), url_args)
+        prefetch_authors(newslist)
 
         return {
             'pagination':       pagination,
@@ -74,65 +81,13 @@ class NewsQuery(db.Query):
 
     def get_archive_summary(self, detail='months', limit=None,
                             ignore_privileges=False):
-        """Query function to get the archive of the blog. Usually used
+        """Query function to get the archive of the news. Usually used
         directly from the templates to add some links to the sidebar.
+        Returns the years, months or days with published news, the newest
+        first, and their number of news in `counts`.  The archive index is
+        used, so the filters of the query don't matter.
         """
-        # XXX: currently we also return months without articles in it.
-        # other blog systems do not, but because we use sqlalchemy we have
-        # to go with the functionality provided.  Currently there is no way
-        # to do date truncating in a database agnostic way.  When this is done
-        # ignore_privileges should no longer be a noop
-        last = self.filter(News.pub_date != None) \
-                   .order_by(News.pub_date.asc()).first()
-        now = datetime.utcnow()
-
-        there_are_more = False
-        result = []
-
-        if last is not None:
-            now = date(now.year, now.month, now.day)
-            oldest = date(last.pub_date.year, last.pub_date.month,
-                          last.pub_date.day)
-            result = [now]
-
-            there_are_more = False
-            if detail == 'years':
-                now, oldest = [x.replace(month=1, day=1) for x in now, oldest]
-                while True:
-                    now = now.replace(year=now.year - 1)
-                    if now < oldest:
-                        break
-                    result.append(now)
-                else:
-                    there_are_more = True
-            elif detail == 'months':
-                now, oldest = [x.replace(day=1) for x in now, oldest]
-                while limit is None or len(result) < limit:
-                    if not now.month - 1:
-                        now = now.replace(year=now.year - 1, month=12)
-                    else:
-                        now = now.replace(month=now.month - 1)
-                    if now < oldest:
-                        break
-                    result.append(now)
-                else:
-                    there_are_more = True
-            elif detail == 'days':
-                while limit is None or len(result) < limit:
-                    now = now - timedelta(days=1)
-                    if now < oldest:
-                        break
-                    result.append(now)
-                else:
-                    there_are_more = True
-            else:
-                raise ValueError('detail must be years, months, or days')
-
-        return {
-            detail:     result,
-            'more':     there_are_more,
-            'empty':    not result
-        }
+        return get_archive(detail, limit)
 
     def latest(self, ignore_privileges=False):
         """Filter for the latest n posts."""
@@ -159,7 +114,7 @@ class NewsQuery(db.Query):
         )
 
 
-class News(object):
+class News(RenderedText):
     """Represents a news post"""
 
     # Attach query model from above
@@ -179,6 +134,11 @@ class News(object):
         if last_update is not None:
             self.last_update = last_update
 
+    @property
+    def cache_tags(self):
+        """Fragment cache tags to invalidate if the news changes."""
+        return ['news', 'news:%d' % self.id]
+
     @property
     def is_draft(self):
         """True if not published"""
@@ -210,6 +170,14 @@ class News(object):
 
         return user.has_privilege(NEWS_PUBLIC)
 
+    @staticmethod
+    def archive_day(status, pub_date):
+        """The day news with that status and publication date are
+        counted for in the archive index or `None`.
+        """
+        if status == STATUS_PUBLISHED and pub_date is not None:
+            return pub_date.date()
+
     def touch_times(self, pub_date=None):
         """Touches the times for this post.  If the pub_date is given the
         `pub_date` is changed to the given date.  If it's not given the
@@ -225,9 +193,10 @@ class News(object):
         self.last_update = now
 
 
-db.mapper(News, newsitems, properties={
+db.mapper(News, newsitems, extension=ArchiveIndexExt(), properties={
     'id':               newsitems.c.news_id,
-    'author':           db.relation(User, uselist=False, lazy=False,
+    'text':             db.synonym('_text', map_column=True),
+    'author':           db.relation(User, uselist=False, lazy=True,
                             backref=db.backref('newsitems', lazy='dynamic')
                         )
 })
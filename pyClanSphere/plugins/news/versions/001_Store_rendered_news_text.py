@@ -0,0 +1,54 @@
+"""Store rendered news text"""
+# Keep __doc__ to a single line
+from pyClanSphere.upgrades.versions import *
+
+# use this or define your own if you need
+metadata = db.MetaData()
+
+for var in ['Table', 'Column', 'Integer', 'Text']:
+    globals()[var] = getattr(db,var)
+
+# Define tables here
+# newsitems is reflected in the upgrade functions as they need to know
+# whether the columns are already there (new installations).
+
+# Define the objects here
+
+
+def map_tables(mapper):
+    clear_mappers()
+    # Map tables to the python objects here
+
+
+def reflect_table(migrate_engine):
+    return Table('newsitems', db.MetaData(bind=migrate_engine),
+                 autoload=True)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine
+    # bind migrate_engine to your metadata
+    session = scoped_session(lambda: create_session(migrate_engine,
+                                                    autoflush=True,
+                                                    autocommit=False))
+    map_tables(session.mapper)
+    metadata.bind = migrate_engine
+    newsitems = reflect_table(migrate_engine)
+    if 'text_html' not in newsitems.c:
+        # the html is rendered when the texts are shown the next time
+        yield u'<p>Add rendered text columns to news</p>\n'
+        Column('text_html', Text).create(newsitems)
+        Column('text_html_version', Integer).create(newsitems)
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    session = scoped_session(lambda: create_session(migrate_engine,
+                                                    autoflush=True,
+                                                    autocommit=False))
+    map_tables(session.mapper)
+    metadata.bind = migrate_engine
+    yield u'<p>Drop rendered text columns from news</p>\n'
+    newsitems = reflect_table(migrate_engine)
+    drop_column(newsitems.c.text_html_version, newsitems)
+    newsitems = reflect_table(migrate_engine)
+    drop_column(newsitems.c.text_html, newsitems)
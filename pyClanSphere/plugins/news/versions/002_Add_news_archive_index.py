@@ -0,0 +1,65 @@
+"""Add news archive index"""
+# Keep __doc__ to a single line
+from pyClanSphere.upgrades.versions import *
+
+# use this or define your own if you need
+metadata = db.MetaData()
+
+for var in ['Table', 'Column', 'Integer']:
+    globals()[var] = getattr(db,var)
+
+# Define tables here
+news_archive = Table('news_archive', metadata,
+    Column('year', Integer, primary_key=True, autoincrement=False),
+    Column('month', Integer, primary_key=True, autoincrement=False),
+    Column('day', Integer, primary_key=True, autoincrement=False),
+    Column('newscount', Integer, nullable=False)
+)
+
+# the status of published news
+STATUS_PUBLISHED = 2
+
+# Define the objects here
+
+
+def map_tables(mapper):
+    clear_mappers()
+    # Map tables to the python objects here
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine
+    # bind migrate_engine to your metadata
+    session = scoped_session(lambda: create_session(migrate_engine,
+                                                    autoflush=True,
+                                                    autocommit=False))
+    map_tables(session.mapper)
+    metadata.bind = migrate_engine
+    # the plugin setup may have created the table already, it's empty then
+    yield u'<p>Add news archive index</p>\n'
+    news_archive.create(checkfirst=True)
+    newsitems = Table('newsitems', db.MetaData(bind=migrate_engine),
+                      autoload=True)
+    n = newsitems.c
+    parts = [db.extract(field, n.pub_date) for field in
+             ('year', 'month', 'day')]
+    rows = migrate_engine.execute(db.select(parts + [db.func.count()],
+                                  (n.status == STATUS_PUBLISHED) &
+                                  (n.pub_date != None)).group_by(*parts))
+    rows = rows.fetchall()
+    migrate_engine.execute(news_archive.delete())
+    if rows:
+        migrate_engine.execute(news_archive.insert(), [
+            {'year': year, 'month': month, 'day': day, 'newscount': count}
+            for year, month, day, count in rows])
+    yield u'<p>Counted the news of %d days</p>\n' % len(rows)
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    session = scoped_session(lambda: create_session(migrate_engine,
+                                                    autoflush=True,
+                                                    autocommit=False))
+    map_tables(session.mapper)
+    metadata.bind = migrate_engine
+    yield u'<p>Drop news archive index</p>\n'
+    news_archive.drop()
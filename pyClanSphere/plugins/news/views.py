@@ -16,7 +16,6 @@ from datetime import date
 from werkzeug import escape
 from werkzeug.exceptions import NotFound, Forbidden
 
-from pyClanSphere import cache
 from pyClanSphere.database import db
 from pyClanSphere.application import url_for, render_response, \
      get_application
@@ -31,12 +30,12 @@ from pyClanSphere.utils.redirects import lookup_redirect
 from pyClanSphere.views.admin import render_admin_response, PER_PAGE
 
 from pyClanSphere.plugins.news import privileges
+from pyClanSphere.plugins.news.archive import get_period_count
 from pyClanSphere.plugins.news.forms import NewsForm, DeleteNewsForm
 from pyClanSphere.plugins.news.models import News
 
 # Public views
 
-@cache.response(vary=('user',))
 def index(req, page=1):
     """Render the most recent posts.
 
@@ -53,11 +52,13 @@ def index(req, page=1):
     """
 
     data = News.query.published() \
-               .get_list(endpoint='news/index', page=page)
+               .get_list(endpoint='news/index', page=page,
+                         after=req.args.get('after'),
+                         before=req.args.get('before'),
+                         total_timeout=60)
 
     return render_response('news_index.html', **data)
 
-@cache.response(vary=('user',))
 def detail(req, news_id):
     """Render the given post.
 
@@ -76,12 +77,15 @@ def detail(req, news_id):
 
     return render_response('news_detail.html', newsitem=entry)
 
-@cache.response(vary=('user',))
 def archive(req, year=None, month=None, day=None, page=1):
-    """Render the monthly archives.
+    """Render the monthly archives.  The numbers of news come from the
+    archive index, periods without news are not found.
 
     Available template variables:
 
+        `months` / `counts`:
+            the months with news and their number of news (overview only)
+
         `posts`:
             a list of post objects we want to display
 
@@ -100,11 +104,22 @@ def archive(req, year=None, month=None, day=None, page=1):
                                **News.query.published() \
                                      .get_archive_summary())
 
+    try:
+        date(year, month or 1, day or 1)
+    except ValueError:
+        raise NotFound()
+    count, over = get_period_count(year, month, day)
+    if not count:
+        raise NotFound()
+
     url_args = dict(year=year, month=month, day=day)
     per_page = 20
     data = News.query.published().date_filter(year, month, day) \
                .get_list(page=page, endpoint='news/archive',
-                         url_args=url_args, per_page=per_page)
+                         url_args=url_args, per_page=per_page,
+                         after=req.args.get('after'),
+                         before=req.args.get('before'),
+                         total=over and count or None)
 
     return render_response('news_archive.html', year=year, month=month, day=day,
                            date=date(year, month or 1, day or 1),
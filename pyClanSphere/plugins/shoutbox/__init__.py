@@ -12,22 +12,36 @@
 
 from os.path import join, dirname
 
-from pyClanSphere.api import get_application, _, url_for
+from pyClanSphere.api import get_application, _, url_for, shared_url, \
+     signals
+from pyClanSphere.utils import htmlhelpers
+from pyClanSphere.utils.forms import IntegerField
 
 from pyClanSphere.plugins.shoutbox import views
+from pyClanSphere.plugins.shoutbox.buffer import ShoutboxBuffer, \
+     entries_changed, warm_buffer
 from pyClanSphere.plugins.shoutbox.database import init_database
 from pyClanSphere.plugins.shoutbox.privileges import PLUGIN_PRIVILEGES
+from pyClanSphere.plugins.shoutbox.services import do_poll
 
+SHARED_FILES = join(dirname(__file__), 'shared')
 TEMPLATE_FILES = join(dirname(__file__), 'templates')
 
+def inject_js(sender, **kwds):
+    """Load the script that updates the shoutbox widget"""
+
+    kwds['result'].append(
+        htmlhelpers.script(shared_url('shoutbox::js/shoutbox.js'))
+    )
+
 def setup(app, plugin):
     """Init our needed stuff"""
 
     # Setup tables
-    init_database()
+    created = init_database()
 
     # Register repository for schema updates
-    app.register_upgrade_repository(plugin, dirname(__file__))
+    app.register_upgrade_repository(plugin, dirname(__file__), created)
 
     # Add our privileges
     for priv in PLUGIN_PRIVILEGES.values():
@@ -36,6 +50,18 @@ def setup(app, plugin):
     # Add our templates to the path
     app.add_template_searchpath(TEMPLATE_FILES)
 
+    # The latest entries are kept in memory, clients poll for new ones
+    app.add_config_var('shoutbox/buffer_size',
+                       IntegerField(default=50, min_value=1))
+    app.add_config_var('shoutbox/poll_timeout',
+                       IntegerField(default=0, min_value=0))
+    app.shoutbox_buffer = ShoutboxBuffer(app.cfg['shoutbox/buffer_size'])
+    signals.application_setup_done.connect(warm_buffer)
+    signals.cache_tags_invalidated.connect(entries_changed)
+    app.add_shared_exports('shoutbox', SHARED_FILES)
+    signals.before_metadata_assembled.connect(inject_js)
+    app.add_servicepoint('shoutbox/poll', do_poll)
+
     # Register shoutbox widget
     app.add_widget(views.ShoutboxWidget)
 
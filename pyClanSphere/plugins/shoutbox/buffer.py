@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.plugins.shoutbox.buffer
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    The latest shoutbox entries in memory.
+
+    The :class:`ShoutboxBuffer` of the application keeps the newest entries
+    (the `shoutbox/buffer_size` setting) as plain objects, so the widget and
+    the ``shoutbox/poll`` service don't load and render them for every
+    request.  The revision of the buffer is the generation of the
+    ``shoutbox`` cache tag, which every commit of a new or deleted entry
+    moves on.  Before the entries are used it's compared with the cache and
+    only if it changed the entries are loaded from the database again.  All
+    server processes that share a cache (memcached or filesystem) see each
+    other's entries that way, without a cache only the changes made in the
+    process itself are noticed.  The service can wait until there are
+    entries newer than the ``since`` id of the client (long polling).
+
+    :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+from collections import deque
+from threading import Condition
+from time import time
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from werkzeug.contrib.cache import NullCache
+
+from pyClanSphere.api import db, url_for, get_application, get_request
+from pyClanSphere.cache import get_generations
+from pyClanSphere.utils.userloader import prefetch_authors
+
+from pyClanSphere.plugins.shoutbox.models import ShoutboxEntry, REVISION_TAG
+from pyClanSphere.plugins.shoutbox.privileges import SHOUTBOX_MANAGE
+
+
+class BufferedEntry(object):
+    """A shoutbox entry as kept in the buffer.  Holds everything the widget
+    shows, including the rendered text, so it does not depend on a database
+    session.
+    """
+
+    def __init__(self, entry):
+        self.id = entry.id
+        self.existing_user = bool(entry.existing_user and entry.user)
+        if self.existing_user:
+            self.author = entry.user.display_name
+            self.user_url = url_for(entry.user)
+        else:
+            self.author = entry.author
+            self.user_url = None
+        self.postdate = entry.postdate
+        self.html = entry.html
+
+    def __repr__(self):
+        return '<%s %d %r>' % (self.__class__.__name__, self.id, self.author)
+
+    def can_manage(self, user=None):
+        """Check if given (or current) user can manage this entry"""
+        if user is None:
+            user = get_request().user
+        return user.has_privilege(SHOUTBOX_MANAGE)
+
+    def to_dict(self):
+        """The entry for the poll service."""
+        return {
+            'id':           self.id,
+            'author':       self.author,
+            'user_url':     self.user_url,
+            'date':         get_application().theme.format_datetime(
+                                self.postdate),
+            'html':         unicode(self.html)
+        }
+
+
+class ShoutboxBuffer(object):
+    """Ring buffer of the latest `size` entries, the newest first."""
+
+    #: how often a waiting poll looks for changes made by other processes
+    check_interval = 5
+
+    def __init__(self, size):
+        self.size = size
+        self.loaded = False
+        self._entries = deque(maxlen=size)
+        self._changed = Condition()
+        #: the revision the entries were loaded at, clients notice
+        #: deletions by it
+        self.revision = None
+        #: counts the changes committed in this process
+        self._local_revision = 0
+
+    def get_revision(self):
+        """Return the current revision of the entries, the generation of
+        the shoutbox cache tag.  Without a cache the changes committed in
+        this process are counted instead.
+        """
+        cache = get_application().cache
+        if isinstance(cache, NullCache):
+            return self._local_revision
+        return get_generations(cache, [REVISION_TAG])[0]
+
+    def changed(self):
+        """Called when new or deleted entries were committed in this
+        process, wakes up the waiting polls.
+        """
+        self._changed.acquire()
+        try:
+            self._local_revision += 1
+            self._changed.notifyAll()
+        finally:
+            self._changed.release()
+
+    def load(self, revision=None):
+        """(Re)fill the buffer from the database."""
+        if revision is None:
+            revision = self.get_revision()
+        entries = ShoutboxEntry.query.order_by(ShoutboxEntry.postdate.desc(),
+                                               ShoutboxEntry.id.desc()) \
+                                     .limit(self.size).all()
+        prefetch_authors(entries, 'user_id')
+        buffered = [BufferedEntry(entry) for entry in entries]
+        self._changed.acquire()
+        try:
+            self._entries.clear()
+            self._entries.extend(buffered)
+            self.loaded = True
+            self.revision = revision
+            self._changed.notifyAll()
+        finally:
+            self._changed.release()
+
+    def check(self):
+        """Reload the buffer if the revision changed since it was loaded.
+        """
+        revision = self.get_revision()
+        if not self.loaded or revision != self.revision:
+            self.load(revision)
+
+    def get_latest(self, count):
+        """Return the newest `count` entries or `None` if the buffer is
+        smaller than that.
+        """
+        if count > self.size:
+            return None
+        self.check()
+        self._changed.acquire()
+        try:
+            return list(self._entries)[:count]
+        finally:
+            self._changed.release()
+
+    def wait(self, since, revision=None, timeout=0):
+        """Return the current revision, the entries newer than the id
+        `since`, the ids of all buffered entries and the oldest of them
+        if older entries are not buffered (``0`` otherwise).  If there are
+        no new entries and `revision` is still the current one wait up to
+        `timeout` seconds for a change.
+        """
+        end = time() + timeout
+        while 1:
+            self.check()
+            self._changed.acquire()
+            try:
+                entries = [entry for entry in self._entries
+                           if entry.id > since]
+                remaining = end - time()
+                if entries or remaining <= 0 or \
+                   (revision is not None and revision != self.revision):
+                    ids = [entry.id for entry in self._entries]
+                    oldest = 0
+                    if len(ids) == self.size:
+                        oldest = min(ids)
+                    return self.revision, entries, ids, oldest
+                self._changed.wait(min(remaining, self.check_interval))
+            finally:
+                self._changed.release()
+            # start over with a new transaction to see the changes
+            db.session.remove()
+
+
+def get_buffer():
+    """Return the shoutbox buffer of the application."""
+    return get_application().shoutbox_buffer
+
+
+def entries_changed(sender, tags, **kwds):
+    """Listener for the `cache_tags_invalidated` signal."""
+    if REVISION_TAG in tags:
+        get_buffer().changed()
+
+
+def warm_buffer(sender, **kwds):
+    """Listener for the `application_setup_done` signal."""
+    try:
+        get_buffer().load()
+    except SQLAlchemyError:
+        # the database is not there or needs an upgrade, the buffer is
+        # loaded on first use
+        pass
+    finally:
+        db.session.remove()
@@ -10,7 +10,7 @@
     :license: BSD, see LICENSE for more details.
 """
 
-from pyClanSphere.database import db, metadata
+from pyClanSphere.database import db, metadata, create_tables
 
 shoutboxentries = db.Table('shoutboxentries', metadata,
     db.Column('entry_id', db.Integer, primary_key=True),
@@ -19,11 +19,16 @@ shoutboxentries = db.Table('shoutboxentries', metadata,
     db.Column('existing_user', db.Boolean),
     db.Column('ip', db.String(64)),
     db.Column('postdate', db.DateTime),
-    db.Column('text', db.Text)
+    db.Column('text', db.Text),
+    db.Column('text_html', db.Text),
+    db.Column('text_html_version', db.Integer)
 )
+db.Index('shoutboxentries_postdate', shoutboxentries.c.postdate)
 
 def init_database():
-    """ This is for inserting our new table"""
+    """Create the tables that don't exist yet.  Returns `True` if they
+    were all created, they are in their latest version then.
+    """
     from pyClanSphere.application import get_application
-    engine = get_application().database_engine
-    metadata.create_all(engine)
+    return create_tables(get_application().database_engine,
+                         [shoutboxentries])
@@ -11,19 +11,28 @@
 
 from datetime import datetime, date
 
+from werkzeug.exceptions import NotFound
+
 from pyClanSphere.api import *
 from pyClanSphere.models import User, AnonymousUser
+from pyClanSphere.utils.markup import RenderedText
 from pyClanSphere.utils.pagination import Pagination
+from pyClanSphere.utils.userloader import prefetch_authors
 
 from pyClanSphere.plugins.shoutbox.database import shoutboxentries
 from pyClanSphere.plugins.shoutbox.privileges import SHOUTBOX_MANAGE
 
+#: the cache tag of all entries, its generation is the revision of the
+#: shoutbox buffer
+REVISION_TAG = 'shoutbox'
+
 
 class ShoutboxEntryQuery(db.Query):
     """Additional query options suitable for our usage"""
 
     def get_list(self, endpoint=None, page=1, per_page=None,
-                 url_args=None, raise_if_empty=True):
+                 url_args=None, raise_if_empty=True, paginator=Pagination,
+                 after=None, before=None, with_total=True):
         """Return a dict with pagination, the current posts, number of pages,
         total posts and all that stuff for further processing.
         """
@@ -32,16 +41,17 @@ class ShoutboxEntryQuery(db.Query):
             per_page = 20
 
         # send the query
-        offset = per_page * (page - 1)
-        shoutboxentries = self.order_by(ShoutboxEntry.postdate.desc()) \
-                              .offset(offset).limit(per_page).all()
+        shoutboxentries, pagination = self.get_page(endpoint, page, per_page,
+            url_args, paginator,
+            sort_key=[ShoutboxEntry.postdate, ShoutboxEntry.id],
+            descending=True, after=after, before=before,
+            with_total=with_total)
 
         # if raising exceptions is wanted, raise it
-        if raise_if_empty and (page != 1 and not newslist):
+        if raise_if_empty and (page != 1 and not shoutboxentries):
             raise NotFound()
 
-        pagination = Pagination(endpoint, page, per_page,
-                                self.count(), url_args)
+        prefetch_authors(shoutboxentries, 'user_id')
 
         return {
             'pagination':       pagination,
@@ -49,7 +59,7 @@ class ShoutboxEntryQuery(db.Query):
         }
 
 
-class ShoutboxEntry(object):
+class ShoutboxEntry(RenderedText):
     """Represents a shoutbox entry"""
 
     query = db.query_property(ShoutboxEntryQuery)
@@ -72,6 +82,13 @@ class ShoutboxEntry(object):
             self.postdate,
         )
 
+    @property
+    def cache_tags(self):
+        """Cache tags to invalidate if the entry changes, the shoutbox
+        buffer is loaded again then.
+        """
+        return [REVISION_TAG]
+
     def can_manage(self, user=None):
         """Check if given (or current) user can manage this entry"""
 
@@ -108,5 +125,6 @@ class ShoutboxEntry(object):
 
 db.mapper(ShoutboxEntry, shoutboxentries, properties={
     'id':           shoutboxentries.c.entry_id,
+    'text':         db.synonym('_text', map_column=True),
     'user':         db.relation(User, uselist=False)
 })
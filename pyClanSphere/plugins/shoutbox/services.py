@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.plugins.shoutbox.services
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    This module implements the JSON API for the shoutbox module.
+
+    :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from pyClanSphere.plugins.shoutbox.buffer import get_buffer
+
+#: how long clients wait before the next poll if long polling is disabled
+POLL_INTERVAL = 15
+
+
+def _get_int(req, key):
+    try:
+        return int(req.values[key])
+    except (KeyError, ValueError):
+        return None
+
+
+def do_poll(req):
+    """Return the entries newer than the `since` id.  If there are none
+    and nothing was deleted since the `revision` the client knows, the
+    answer is delayed until there is a new entry or the
+    `shoutbox/poll_timeout` is over.  Only uses the shoutbox buffer, so
+    polling does not touch the database unless the entries changed.
+
+    `ids` are the ids of the buffered entries, clients drop the entries
+    they show that are missing there but not older than `oldest`.
+    """
+    timeout = req.app.cfg['shoutbox/poll_timeout']
+    revision, entries, ids, oldest = get_buffer().wait(
+        _get_int(req, 'since') or 0, _get_int(req, 'revision'), timeout)
+    return {
+        'revision':     revision,
+        'entries':      [entry.to_dict() for entry in entries],
+        'ids':          ids,
+        'oldest':       oldest,
+        'next_poll':    timeout and 0 or POLL_INTERVAL
+    }
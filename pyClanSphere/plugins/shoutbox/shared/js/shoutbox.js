@@ -0,0 +1,60 @@
+/**
+ * pyClanSphere shoutbox addons
+ * ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+ *
+ * Keeps the shoutbox widget up to date by polling the shoutbox/poll
+ * service.
+ *
+ * :copyright: (c) 2010 by the pyClansphere Team, see AUTHORS for more details.
+ * :license: BSD, see LICENSE for more details.
+ */
+
+var pyCSShoutbox = {
+  start : function(list, count, since, revision, deleteURL) {
+    var poll = function() {
+      $.ajax({
+        url: pyClanSphere.getJSONServiceURL('shoutbox/poll'),
+        data: {since: since, revision: revision},
+        dataType: 'json',
+        cache: false,
+        success: function(rv) {
+          var ids = {};
+          for (var i = 0; i < rv.ids.length; i++)
+            ids[rv.ids[i]] = true;
+          list.children('li').each(function() {
+            var id = parseInt(this.id.substr(6));
+            if (id >= rv.oldest && !ids[id])
+              $(this).remove();
+          });
+          for (var i = rv.entries.length - 1; i >= 0; i--) {
+            var entry = rv.entries[i];
+            list.prepend(pyCSShoutbox.renderEntry(entry, deleteURL));
+            since = Math.max(since, entry.id);
+          }
+          list.children('li').slice(count).remove();
+          revision = rv.revision;
+          window.setTimeout(poll, rv.next_poll * 1000);
+        },
+        error: function() {
+          window.setTimeout(poll, 60000);
+        }
+      });
+    };
+    $(function() { window.setTimeout(poll, 1000); });
+  },
+
+  renderEntry : function(entry, deleteURL) {
+    var item = $('<li>').attr('id', 'shout-' + entry.id);
+    if (entry.user_url)
+      item.append($('<a>').attr('href', entry.user_url).text(entry.author));
+    else
+      item.append(document.createTextNode(entry.author));
+    item.append(':' + entry.html + '<br>')
+      .append($('<span class="postdate">').text('(' + entry.date + ')'))
+      .append('<br>');
+    if (deleteURL)
+      item.append($('<a>').attr('href', deleteURL.replace('/0/', '/' + entry.id + '/'))
+                          .text('delete this'));
+    return item.append('<hr>');
+  }
+}
@@ -16,8 +16,10 @@ from pyClanSphere.api import db, url_for, get_request
 from pyClanSphere.application import render_response
 from pyClanSphere.privileges import assert_privilege
 from pyClanSphere.utils.http import get_redirect_target
+from pyClanSphere.utils.userloader import prefetch_authors
 from pyClanSphere.widgets import Widget
 
+from pyClanSphere.plugins.shoutbox.buffer import BufferedEntry, get_buffer
 from pyClanSphere.plugins.shoutbox.forms import ShoutboxEntryForm, DeleteShoutboxEntryForm
 from pyClanSphere.plugins.shoutbox.models import ShoutboxEntry
 from pyClanSphere.plugins.shoutbox.privileges import SHOUTBOX_MANAGE
@@ -33,8 +35,21 @@ class ShoutboxWidget(Widget):
         self.title = title
         self.show_title = show_title
         self.hide_form = hide_form
-        self.entries = ShoutboxEntry.query.order_by(ShoutboxEntry.postdate.desc()) \
-                                    .limit(entrycount).all()
+        buffer = get_buffer()
+        self.entries = buffer.get_latest(entrycount)
+        self.revision = buffer.revision
+        if self.entries is None:
+            # more than the buffer holds
+            entries = ShoutboxEntry.query.order_by(ShoutboxEntry.postdate.desc()) \
+                                   .limit(entrycount).all()
+            prefetch_authors(entries, 'user_id')
+            self.entries = [BufferedEntry(entry) for entry in entries]
+        self.entrycount = entrycount
+        self.since = max([entry.id for entry in self.entries] or [0])
+        self.deleteurl = None
+        if get_request().user.has_privilege(SHOUTBOX_MANAGE):
+            # the client inserts the ids of new entries
+            self.deleteurl = url_for('shoutbox/delete', entry_id=0)
         self.newposturl = escape(url_for('shoutbox/post', next=get_request().path))
 
 def make_shoutbox_entry(request):
@@ -60,6 +75,7 @@ def make_shoutbox_entry(request):
         if form.validate(request.form):
             entry = form.make_entry()
             db.commit()
+            get_buffer().check()
             # as this affects pretty much all visible pages, we flush cache here
             request.app.cache.clear()
             target = get_redirect_target()
@@ -94,6 +110,7 @@ def delete_shoutbox_entry(request, entry_id):
             form.add_invalid_redirect_target('shoutbox/delete', entry_id=entry.id)
             form.delete_entry()
             db.commit()
+            get_buffer().check()
             # as this affects pretty much all visible pages, we flush cache here
             request.app.cache.clear()
             return form.redirect('core/index')
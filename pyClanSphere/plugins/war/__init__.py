@@ -15,9 +15,11 @@ from os import makedirs
 
 from pyClanSphere.api import url_for, _, signals
 from pyClanSphere.utils.admin import add_admin_urls
+from pyClanSphere.utils.forms import IntegerField
 
 from pyClanSphere.plugins.war import views
 from pyClanSphere.plugins.war.database import init_database
+from pyClanSphere.plugins.war.mapinfo import rescan_war_maps, sniff_map
 from pyClanSphere.plugins.war.privileges import PLUGIN_PRIVILEGES, WAR_MANAGE
 
 TEMPLATE_FILES = join(dirname(__file__), 'templates')
@@ -38,10 +40,10 @@ def add_admin_links(sender, **kwds):
 
 def setup(app, plugin):
     # Setup tables
-    init_database(app)
+    created = init_database(app)
 
     # Register repository for schema updates
-    app.register_upgrade_repository(plugin, dirname(__file__))
+    app.register_upgrade_repository(plugin, dirname(__file__), created)
 
     # Add our privileges
     for priv in PLUGIN_PRIVILEGES.values():
@@ -58,6 +60,8 @@ def setup(app, plugin):
                      view=views.war_detail)
     app.add_url_rule('/wars/fightus', endpoint='wars/fightus',
                      view=views.war_fightus)
+    app.add_url_rule('/wars/maps/<int:map_id>/download',
+                     endpoint='wars/map_download', view=views.war_map_download)
 
     # Admin views
     add_admin_urls(app, 'wars', 'war_id', views.war_list,
@@ -77,3 +81,13 @@ def setup(app, plugin):
     map_path = join(app.instance_folder, 'warmaps')
     if not exists(map_path):
         makedirs(map_path)
+    app.add_file_root('warmaps', map_path)
+
+    # map files are rejected while they are uploaded if they are too large
+    app.add_config_var('war/map_max_size',
+                       IntegerField(default=4096, min_value=1))
+    app.add_upload_type('gbx', sniff_map,
+                        lambda: app.cfg['war/map_max_size'] * 1024)
+
+    # read map metadata again with manage-database rescan
+    signals.rescan_metadata.connect(rescan_war_maps)
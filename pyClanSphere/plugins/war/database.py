@@ -12,12 +12,12 @@
 
 from datetime import date, datetime
 
-from pyClanSphere.database import db, metadata
+from pyClanSphere.database import db, metadata, create_tables
 
 # Mapping these out from db module to increases readability further down
 # As this module is only part-imported by the models and init module, it should be safe to do so
 for var in ['Table', 'Column', 'String', 'Integer', 'Boolean', 'DateTime',
-            'ForeignKey', 'Text']:
+            'ForeignKey', 'Text', 'Index']:
     globals()[var] = getattr(db, var)
 
 wars = Table('wars', metadata,
@@ -41,6 +41,9 @@ wars = Table('wars', metadata,
            default=datetime.utcnow()),
     Column('modificationuser_id', Integer, ForeignKey('users.user_id'))
 )
+# wars are listed by date, upcoming and played ones by status
+Index('wars_date', wars.c.date)
+Index('wars_status_date', wars.c.status, wars.c.date)
 
 warmembers = Table('warmembers', metadata,
     Column('war_id', ForeignKey('wars.war_id'), primary_key=True),
@@ -68,7 +71,26 @@ warmaps = Table('warmaps', metadata,
     Column('name', String(64)),
     Column('squad_id', ForeignKey('squads.squad_id')),
     Column('metadata_timestamp', DateTime),
-    Column('metadata_cache', Text)
+    # metadata read from the map file, see `mapinfo`
+    Column('meta_uid', String(64)),
+    Column('meta_name', String(128)),
+    Column('meta_full_name', String(255)),
+    Column('meta_author', String(64)),
+    Column('meta_environment', String(32)),
+    Column('meta_mood', String(32)),
+    Column('meta_race_type', Integer),
+    Column('meta_multilap', Boolean),
+    Column('meta_author_time', Integer),
+    Column('meta_gold_time', Integer),
+    Column('meta_silver_time', Integer),
+    Column('meta_bronze_time', Integer),
+    Column('meta_coppers', Integer),
+    Column('meta_author_score', Integer),
+    Column('meta_exe_version', String(32)),
+    Column('meta_mod_name', String(128)),
+    Column('meta_mod_file', String(255)),
+    Column('meta_song_file', String(255)),
+    Column('meta_comment', Text)
 )
 
 warmap_results = Table('warmap_results', metadata,
@@ -87,6 +109,10 @@ warresults = Table('warresults', metadata,
 )
 
 def init_database(app):
-    """ This is for inserting our new table"""
-    engine = app.database_engine
-    metadata.create_all(engine)
+    """Create the tables that don't exist yet.  Returns `True` if they
+    were all created, they are in their latest version then.
+    """
+    return create_tables(app.database_engine, [
+        wars, warmembers, war_maps, warmodes, warmaps, warmap_results,
+        warresults
+    ])
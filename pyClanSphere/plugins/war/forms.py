@@ -13,7 +13,6 @@
 import os
 
 from pyClanSphere.api import *
-from pyClanSphere.models import User
 from pyClanSphere.utils import forms
 from pyClanSphere.utils.validators import ValidationError, is_not_whitespace_only, is_valid_url, is_valid_email
 
@@ -107,15 +106,14 @@ class FightUsForm(_WarBoundForm):
 
 class EditWarForm(FightUsForm):
 
-    orgamember = forms.ModelField(User, 'id', lazy_gettext(u'Orgamember'),
-                                  required=True, widget=forms.SelectBox)
+    orgamember = forms.UserField(lazy_gettext(u'Orgamember'), required=True)
     status = forms.ChoiceField(lazy_gettext(u'State'), required=True)
     newmap = forms.ChoiceField(lazy_gettext(u'Add map'),
                               widget=forms.SelectBox)
     removemaps = forms.MultiChoiceField(lazy_gettext(u'Check to remove'),
                                         widget=forms.CheckboxGroup)
-    newmember = forms.ChoiceField(lazy_gettext(u'Add member'),
-                                  widget=forms.SelectBox)
+    newmember = forms.UserField(lazy_gettext(u'Add member'), messages=dict(
+                    excluded=lazy_gettext(u'“%(user)s” is already a member.')))
     newmemberstatus = forms.ChoiceField(lazy_gettext(u'Status for newly added member'),
                                         widget=forms.SelectBox)
     removemembers = forms.MultiChoiceField(lazy_gettext(u'Check to remove'),
@@ -130,20 +128,16 @@ class EditWarForm(FightUsForm):
         FightUsForm.__init__(self, war, initial)
         self.contact.required = False
         self.status.choices = [(k, v) for k, v in warstates.iteritems()]
-        self.orgamember.choices = [(user.id, user.display_name) for user in User.query.namesort().all()]
         self.newmemberstatus.choices = [(k, v) for k, v in memberstates.iteritems()]
         if war is not None:
             self.removemembers.choices = [(member.id, '%s (%s)' % \
                                           (member.display_name, memberstates[war.memberstatus[member]]))
                                           for member in war.members]
-            self.newmember.choices = [(-1, u'')] + [(member.id, member.display_name)
-                                      for member in User.query.namesort().all() if member not in war.members]
+            self.newmember.exclude = set(member.id for member in war.members)
             self.removemaps.choices = [(map.id, map.name) for map in war.maps]
             self.newmap.choices = [(-1, u'')] + [(map.id, map.name)
                                    for map in WarMap.query.all() if map not in war.maps]
         else:
-            self.newmember.choices = [(-1, u'')] + [(member.id, member.display_name)
-                                   for member in User.query.namesort().all()]
             self.newmap.choices = [(-1, u'')] + [(map.id, map.name)
                                    for map in WarMap.query.all()]
             del self.removemembers
@@ -157,11 +151,9 @@ class EditWarForm(FightUsForm):
             newmap = WarMap.query.get(newmap_id)
             if newmap is not None:
                 war.maps.append(newmap)
-        newmember_id =  self.data['newmember']
-        if newmember_id != -1:
-            newmember = User.query.get(newmember_id)
-            if newmember is not None:
-                war.memberstatus[newmember] = self.data['newmemberstatus']
+        newmember = self.data['newmember']
+        if newmember is not None:
+            war.memberstatus[newmember] = self.data['newmemberstatus']
 
     def save_changes(self):
         """Apply the changes."""
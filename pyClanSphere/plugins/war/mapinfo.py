@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.plugins.war.mapinfo
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Metadata of war map files.
+
+    The metadata is read from the header of a map file when it's uploaded
+    and stored in the ``meta_*`` columns of the map, showing it does not
+    touch the file.  :func:`rescan_maps` reads the files of all maps again
+    with a pool of processes, it's run by the ``rescan`` command of the
+    database management script.
+
+    :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+from datetime import datetime
+from itertools import imap
+from multiprocessing import Pool, cpu_count
+
+from pyClanSphere.api import db, get_application
+from pyClanSphere._ext.GBXChallengeReader import read_challenge, \
+     GBXReadException, GBXWrongFileTypeException
+from pyClanSphere.plugins.war.database import warmaps
+
+
+#: the metadata attributes (named like the GBX reader names them) and the
+#: columns they are stored in
+FIELDS = [
+    ('uid',             'meta_uid'),
+    ('name',            'meta_name'),
+    ('full_name',       'meta_full_name'),
+    ('author',          'meta_author'),
+    ('envir',           'meta_environment'),
+    ('mood',            'meta_mood'),
+    ('racetype',        'meta_race_type'),
+    ('multilap',        'meta_multilap'),
+    ('authortime',      'meta_author_time'),
+    ('goldtime',        'meta_gold_time'),
+    ('silvertime',      'meta_silver_time'),
+    ('bronzetime',      'meta_bronze_time'),
+    ('coppers',         'meta_coppers'),
+    ('authorscore',     'meta_author_score'),
+    ('exever',          'meta_exe_version'),
+    ('modname',         'meta_mod_name'),
+    ('modfile',         'meta_mod_file'),
+    ('songfile',        'meta_song_file'),
+    ('comment',         'meta_comment')
+]
+
+COLUMNS = [column for attr, column in FIELDS]
+
+
+class MapMetadata(object):
+    """The metadata of a map file."""
+
+    def __init__(self, warmap):
+        for attr, column in FIELDS:
+            setattr(self, attr, getattr(warmap, column))
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.name)
+
+
+def sniff_map(header):
+    """Check if the first bytes of a file are the header of a GBX file."""
+    return header.startswith('GBX\x06\x00')
+
+
+def read_metadata(filename):
+    """Read the metadata of a map file and return a dict of column values.
+    All values are `None` if the file type is not known.
+    """
+    values = dict.fromkeys(COLUMNS)
+    f = open(filename, 'rb')
+    try:
+        try:
+            data = read_challenge(f)
+        except (GBXReadException, GBXWrongFileTypeException):
+            return values
+    finally:
+        f.close()
+    for attr, column in FIELDS:
+        value = data[attr]
+        length = getattr(warmaps.c[column].type, 'length', None)
+        if isinstance(value, basestring) and length:
+            value = value[:length]
+        values[column] = value
+    return values
+
+
+def scan_file(filename):
+    """Return the modification time of a map file (as used for the
+    ``metadata_timestamp``) and its metadata.  Both are `None` if the file
+    is missing.
+    """
+    try:
+        mtime = datetime.fromtimestamp(os.stat(filename).st_mtime)
+        return mtime, read_metadata(filename)
+    except (IOError, OSError):
+        return None, None
+
+
+def _scan_map(job):
+    # runs in the worker processes, so it may only use what was pickled
+    map_id, filename = job
+    return (map_id,) + scan_file(filename)
+
+
+def rescan_maps(processes=None, batch_size=100):
+    """Read the metadata of all war map files again.  The files are read
+    by a pool of `processes` processes (defaults to the number of CPUs),
+    the results are written in batches.  Yields HTML status messages.
+    """
+    app = get_application()
+    engine = app.database_engine
+    folder = os.path.join(app.instance_folder, 'warmaps')
+    jobs = [(row.map_id, os.path.join(folder, str(row.map_id)))
+            for row in engine.execute(db.select([warmaps.c.map_id]))]
+    yield u'<p>Scanning %d map files</p>\n' % len(jobs)
+    if processes is None:
+        processes = cpu_count()
+    pool = None
+    if processes > 1 and len(jobs) > 1:
+        pool = Pool(processes)
+        results = pool.imap_unordered(_scan_map, jobs, chunksize=8)
+    else:
+        results = imap(_scan_map, jobs)
+
+    query = warmaps.update(warmaps.c.map_id == db.bindparam('_map_id'))
+    batch = []
+    scanned = missing = unknown = 0
+    try:
+        for map_id, mtime, values in results:
+            if mtime is None:
+                missing += 1
+                values = dict.fromkeys(COLUMNS)
+            elif values['meta_uid'] is None:
+                unknown += 1
+            else:
+                scanned += 1
+            values['_map_id'] = map_id
+            values['metadata_timestamp'] = mtime
+            batch.append(values)
+            if len(batch) >= batch_size:
+                engine.execute(query, batch)
+                del batch[:]
+        if batch:
+            engine.execute(query, batch)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    yield u'<p>%d maps updated, %d without file, %d of unknown type</p>\n' % \
+          (scanned, missing, unknown)
+
+
+def rescan_war_maps(sender, processes=None, batch_size=100, **kwds):
+    """Listener for the `rescan_metadata` signal."""
+    yield u'<h3>War maps</h3>\n'
+    for message in rescan_maps(processes, batch_size):
+        yield message
@@ -13,21 +13,21 @@
 import os
 from datetime import datetime
 
-from werkzeug import FileStorage
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.attributes import set_committed_value
+from werkzeug import FileStorage, secure_filename
+from werkzeug.exceptions import NotFound
 
 from pyClanSphere.api import db, _
 from pyClanSphere.models import User
 from pyClanSphere.utils.pagination import Pagination
+from pyClanSphere.utils.uploads import get_upload, save_upload
 from pyClanSphere.schema import users
 
 from pyClanSphere.plugins.gamesquad.models import Game, Squad
 from pyClanSphere.plugins.war.database import wars, war_maps, warmembers, \
      warmodes, warmaps, warresults, warmap_results
-
-try:
-    import cPickle as Pickle
-except:
-    import Pickle
+from pyClanSphere.plugins.war.mapinfo import MapMetadata, COLUMNS, scan_file
 
 warstates = {
     0:_('Fightus Request'),
@@ -54,23 +54,22 @@ class WarMetaQuery(db.Query):
     """Meta-Addon methods for querying on war-related classes"""
 
     def get_list(self, endpoint=None, page=1, per_page=None,
-                 url_args=None, raise_if_empty=True, paginator=Pagination):
+                 url_args=None, raise_if_empty=True, paginator=Pagination,
+                 with_total=True):
         """Return a dict with pagination and wars."""
 
         if per_page is None:
             per_page = 20
 
         # send the query
-        offset = per_page * (page - 1)
-        mylist = self.offset(offset).limit(per_page).all()
+        mylist, pagination = self.get_page(endpoint, page, per_page,
+                                           url_args, paginator,
+                                           with_total=with_total)
 
         # if raising exceptions is wanted, raise it
         if raise_if_empty and (page != 1 and not mylist):
             raise NotFound()
 
-        pagination = paginator(endpoint, page, per_page,
-                                self.count(), url_args=url_args)
-
         return {
             'datalist':         mylist,
             'pagination':       pagination
@@ -91,24 +90,24 @@ class WarQuery(db.Query):
         return self.filter_by(status=4)
 
     def get_list(self, endpoint=None, page=1, per_page=None,
-                 url_args=None, raise_if_empty=True, paginator=Pagination):
+                 url_args=None, raise_if_empty=True, paginator=Pagination,
+                 after=None, before=None, with_total=True,
+                 total_timeout=None):
         """Return a dict with pagination and wars."""
 
         if per_page is None:
             per_page = 20
 
         # send the query
-        offset = per_page * (page - 1)
-        warlist = self.order_by(db.desc(War.date)) \
-                         .offset(offset).limit(per_page).all()
+        warlist, pagination = self.get_page(endpoint, page, per_page,
+            url_args, paginator, sort_key=[War.date, War.id],
+            descending=True, after=after, before=before,
+            with_total=with_total, total_timeout=total_timeout)
 
         # if raising exceptions is wanted, raise it
         if raise_if_empty and (page != 1 and not warlist):
             raise NotFound()
 
-        pagination = paginator(endpoint, page, per_page,
-                                self.count(), url_args=url_args)
-
         return {
             'wars':             warlist,
             'pagination':       pagination,
@@ -154,6 +153,11 @@ class War(object):
     def named_status(self):
         return warstates[self.status]
 
+    @property
+    def cache_tags(self):
+        """Fragment cache tags to invalidate if the war changes."""
+        return ['war', 'war:%d' % self.id]
+
     def __repr__(self):
         return "<%s (%s, %s)>" % (
             self.__class__.__name__,
@@ -204,11 +208,9 @@ class WarMap(object):
 
     query = db.query_property(WarMetaQuery)
 
-    def __init__(self, name=u'', squad=None, metadata_timestamp=None, metadata_cache=None):
+    def __init__(self, name=u'', squad=None):
         self.name = name
         self.squad = squad
-        self.metadata_timestamp = metadata_timestamp
-        self.metadata_cache = metadata_cache
 
     def generate_filename(self):
         from pyClanSphere.api import get_application
@@ -234,38 +236,59 @@ class WarMap(object):
     def metadata(self):
         """Return map metadata"""
 
-        if not self.has_file:
-            return None
-
-        statinfo = os.stat(self.map_filename)
-        filetime = datetime.fromtimestamp(statinfo.st_mtime)
-        if self.metadata_timestamp and filetime <= self.metadata_timestamp:
-            return Pickle.loads(self.metadata_cache)
-        else:
-            have_metadata = False
-
-            # more filetypes can be added later, just using this for now but prepared it
-            from pyClanSphere._ext.GBXChallengeReader import GBXChallengeReader, GBXWrongFileTypeException
-            try:
-                data = GBXChallengeReader(self.map_filename)
-                have_metadata = True
-            except GBXWrongFileTypeException:
-                pass
-
-            if have_metadata:
-                self.metadata_cache = Pickle.dumps(data)
-                self.metadata_timestamp = filetime
-                return data
-
+        if self.metadata_timestamp is None:
+            # not read yet
+            if not self.has_file:
+                return None
+            self._store_metadata()
+        if self.meta_uid is None:
+            # unknown file type
             return None
+        return MapMetadata(self)
+
+    def update_metadata(self):
+        """Read the metadata from the map file again"""
+
+        self.metadata_timestamp, values = scan_file(self.map_filename)
+        for column, value in (values or dict.fromkeys(COLUMNS)).iteritems():
+            setattr(self, column, value)
+
+    def _store_metadata(self):
+        """Read the metadata of a map that was never scanned without
+        making the object dirty and write it to the database, so the file
+        is parsed only once.
+        """
+        timestamp, values = scan_file(self.map_filename)
+        values = values or dict.fromkeys(COLUMNS)
+        values['metadata_timestamp'] = timestamp
+        for column, value in values.iteritems():
+            set_committed_value(self, column, value)
+        if self.id is None:
+            return
+        # written outside of the session so that the result is kept even if
+        # the request does not commit.  rescan reads it again anyway.
+        try:
+            db.get_engine().execute(warmaps.update(warmaps.c.map_id == self.id,
+                                                   values=values))
+        except SQLAlchemyError:
+            pass
 
     def place_file(self, newfile):
-        """Move war map file to instance subfolder and generate appropriate filename"""
+        """Move war map file to instance subfolder and generate appropriate
+        filename.  Returns an error message if the file was rejected.
+        """
 
-        if isinstance(newfile, FileStorage):
-            newfile.save(self.map_filename)
-        else:
+        if not isinstance(newfile, FileStorage):
             raise NotImplemented('Dunno how to handle that kind of file object')
+        upload = get_upload(newfile)
+        if upload is not None:
+            if upload.type != 'gbx':
+                return _(u'The file is not a GBX map file.')
+            if upload.rejected:
+                return _(u'The map file is larger than %d KB.') % \
+                       (upload.max_size // 1024)
+        save_upload(newfile, self.map_filename)
+        self.update_metadata()
 
     def remove_file(self):
         """Remove a war map file"""
@@ -273,6 +296,16 @@ class WarMap(object):
         if os.path.exists(self.map_filename):
             os.remove(self.map_filename)
 
+    @property
+    def download_filename(self):
+        """The name the map file is offered for download with"""
+
+        name = secure_filename(self.name) or 'map-%d' % self.id
+        if self.metadata is not None:
+            # GBX challenge files are the only known type
+            name += '.Challenge.Gbx'
+        return name
+
     @property
     def has_file(self):
         """True/False if we have something"""
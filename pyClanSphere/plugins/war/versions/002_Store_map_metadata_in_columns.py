@@ -0,0 +1,87 @@
+"""Store map metadata in columns"""
+# Keep __doc__ to a single line
+from pyClanSphere.upgrades.versions import *
+
+# use this or define your own if you need
+metadata = db.MetaData()
+
+for var in ['Table', 'Column', 'String', 'Integer', 'Boolean', 'Text']:
+    globals()[var] = getattr(db,var)
+
+# Define tables here
+# warmaps is reflected in the upgrade functions as they need to know
+# whether the columns are already there (new installations).
+meta_columns = [
+    ('meta_uid', String(64)),
+    ('meta_name', String(128)),
+    ('meta_full_name', String(255)),
+    ('meta_author', String(64)),
+    ('meta_environment', String(32)),
+    ('meta_mood', String(32)),
+    ('meta_race_type', Integer),
+    ('meta_multilap', Boolean),
+    ('meta_author_time', Integer),
+    ('meta_gold_time', Integer),
+    ('meta_silver_time', Integer),
+    ('meta_bronze_time', Integer),
+    ('meta_coppers', Integer),
+    ('meta_author_score', Integer),
+    ('meta_exe_version', String(32)),
+    ('meta_mod_name', String(128)),
+    ('meta_mod_file', String(255)),
+    ('meta_song_file', String(255)),
+    ('meta_comment', Text)
+]
+
+# Define the objects here
+
+
+def map_tables(mapper):
+    clear_mappers()
+    # Map tables to the python objects here
+
+
+def reflect_table(migrate_engine):
+    return Table('warmaps', db.MetaData(bind=migrate_engine), autoload=True)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine
+    # bind migrate_engine to your metadata
+    session = scoped_session(lambda: create_session(migrate_engine,
+                                                    autoflush=True,
+                                                    autocommit=False))
+    map_tables(session.mapper)
+    metadata.bind = migrate_engine
+    warmaps = reflect_table(migrate_engine)
+    if 'meta_uid' not in warmaps.c:
+        yield u'<p>Add metadata columns to war maps</p>\n'
+        for name, type in meta_columns:
+            Column(name, type).create(warmaps)
+    warmaps = reflect_table(migrate_engine)
+    if 'metadata_cache' in warmaps.c:
+        yield u'<p>Drop pickled metadata of war maps</p>\n'
+        drop_column(warmaps.c.metadata_cache, warmaps)
+    # the metadata is read from the files the next time it's shown or by
+    # manage-database rescan
+    warmaps = reflect_table(migrate_engine)
+    migrate_engine.execute(warmaps.update(values={
+        'metadata_timestamp': None}))
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    session = scoped_session(lambda: create_session(migrate_engine,
+                                                    autoflush=True,
+                                                    autocommit=False))
+    map_tables(session.mapper)
+    metadata.bind = migrate_engine
+    yield u'<p>Drop metadata columns from war maps</p>\n'
+    for name, type in reversed(meta_columns):
+        warmaps = reflect_table(migrate_engine)
+        drop_column(warmaps.c[name], warmaps)
+    yield u'<p>Add pickled metadata to war maps</p>\n'
+    warmaps = reflect_table(migrate_engine)
+    Column('metadata_cache', Text).create(warmaps)
+    warmaps = reflect_table(migrate_engine)
+    migrate_engine.execute(warmaps.update(values={
+        'metadata_timestamp': None}))
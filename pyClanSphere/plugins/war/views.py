@@ -14,12 +14,12 @@ import os, datetime
 
 from werkzeug.exceptions import NotFound, Forbidden
 
-from pyClanSphere import cache
 from pyClanSphere.api import *
 from pyClanSphere.privileges import CLAN_ADMIN
 from pyClanSphere.utils.admin import require_admin_privilege, flash as admin_flash
 from pyClanSphere.utils.http import redirect_to
 from pyClanSphere.utils.pagination import AdminPagination
+from pyClanSphere.utils.sendfile import send_file
 from pyClanSphere.views.account import render_account_response
 from pyClanSphere.views.admin import render_admin_response, PER_PAGE
 from werkzeug import escape
@@ -29,7 +29,6 @@ from pyClanSphere.plugins.war.models import War, WarMap, WarMode, WarResult, war
 from pyClanSphere.plugins.war.privileges import WAR_MANAGE
 
 # Frontend stuff
-@cache.response(vary=('user',))
 def war_index(request, page):
     """Render war overview.
 
@@ -45,11 +44,13 @@ def war_index(request, page):
     :URL endpoint: ``wars/index``
     """
 
-    data = War.query.get_list('wars/index', page=page)
+    data = War.query.get_list('wars/index', page=page,
+                              after=request.args.get('after'),
+                              before=request.args.get('before'),
+                              total_timeout=60)
 
     return render_response('war_index.html', **data)
 
-@cache.response(vary=('user',))
 def war_detail(request, war_id=None):
     """Render a war in detail.
 
@@ -78,6 +79,18 @@ def war_detail(request, war_id=None):
     return render_response('war_detail.html', war=war, result=war.result,
                            memberstates=memberstates)
 
+def war_map_download(request, map_id):
+    """Send the file of a war map.
+
+    :URL endpoint: ``wars/map_download``
+    """
+
+    warmap = WarMap.query.get(map_id)
+    if warmap is None or not warmap.has_file:
+        raise NotFound()
+    return send_file(request, warmap.map_filename,
+                     as_attachment=warmap.download_filename)
+
 def war_fightus(request):
     """Render form for a fightus request on front page.
 
@@ -210,10 +223,12 @@ def warmap_edit(request, warmap_id=None):
 
             mapfile = request.files.get('mapfile')
             if mapfile:
-                warmap.place_file(mapfile)
-                if form.overwrite_mapname and hasattr(warmap.metadata, 'name'):
-                    warmap.name = unicode(warmap.metadata.name)
-                    db.commit()
+                error = warmap.place_file(mapfile)
+                if error:
+                    admin_flash(error, 'error')
+                elif form.overwrite_mapname and warmap.metadata is not None:
+                    warmap.name = warmap.metadata.name[:64]
+                db.commit()
             admin_flash(msg % (warmap.name), icon)
 
             if 'save_and_continue' in request.form:
@@ -82,7 +82,7 @@ import __builtin__
 import re
 import sys
 import inspect
-from os import path, listdir, walk, makedirs
+from os import path, listdir, walk, makedirs, rename, getpid
 from types import ModuleType
 from shutil import rmtree
 from time import localtime, time
@@ -91,7 +91,7 @@ from urllib import quote
 from werkzeug import cached_property, escape
 
 from pyClanSphere.application import get_application
-from pyClanSphere.utils import log
+from pyClanSphere.utils import log, dump_json, load_json
 from pyClanSphere.utils.mail import split_email, is_valid_email, check
 from pyClanSphere.utils.exceptions import UserException, summarize_exception
 from pyClanSphere.i18n import pyClanSphereTranslations as Translations, lazy_gettext, _
@@ -108,6 +108,10 @@ _managed_applications = {}
 
 PACKAGE_VERSION = 1
 
+#: the file in the instance folder that remembers the available plugins,
+#: see `load_plugin_manifest`
+PLUGIN_MANIFEST = 'plugins.manifest'
+
 
 def get_object_name(obj):
     """Return a human readable name for the object."""
@@ -127,23 +131,105 @@ def get_object_name(obj):
 def find_plugins(app):
     """Return an iterator over all plugins available."""
     enabled_plugins = set()
-    found_plugins = set()
     for plugin in app.cfg['plugins']:
         plugin = plugin.strip()
         if plugin:
             enabled_plugins.add(plugin)
 
-    for folder in app.plugin_searchpath:
+    for entry in load_plugin_manifest(app):
+        name = str(entry['name'])
+        plugin = Plugin(app, name, entry['path'], name in enabled_plugins)
+        plugin.__dict__['metadata'] = MetaData(entry['metadata'],
+                                               entry['translations'])
+        yield plugin
+
+
+def _get_mtime(filename):
+    try:
+        return path.getmtime(filename)
+    except OSError:
+        return None
+
+
+def _scan_plugins(searchpath):
+    """Look for plugins in the folders of the searchpath and parse their
+    metadata.  Returns the entries of the plugin manifest.
+    """
+    found_plugins = set()
+    result = []
+    for folder in searchpath:
         if not path.isdir(folder):
             continue
         for filename in listdir(folder):
             full_name = path.join(folder, filename)
-            if path.isdir(full_name) and \
-               path.isfile(path.join(full_name, 'metadata.txt')) and \
-               filename not in found_plugins:
-                found_plugins.add(filename)
-                yield Plugin(app, str(filename), path.abspath(full_name),
-                             filename in enabled_plugins)
+            metadata_file = path.join(full_name, 'metadata.txt')
+            if filename in found_plugins or not path.isdir(full_name) or \
+               not path.isfile(metadata_file):
+                continue
+            found_plugins.add(filename)
+            f = file(metadata_file)
+            try:
+                metadata = parse_metadata(f)
+            finally:
+                f.close()
+            result.append({
+                'name':         filename,
+                'path':         path.abspath(full_name),
+                'mtime':        _get_mtime(metadata_file),
+                'version':      metadata._values.get('version'),
+                'metadata':     metadata._values,
+                'translations': metadata._i18n_values
+            })
+    return result
+
+
+def load_plugin_manifest(app):
+    """Return the plugins in the searchpath of the application as entries
+    of the plugin manifest (dicts with the name, path and metadata of the
+    plugins).
+
+    The manifest is a file in the instance folder so that new processes
+    don't have to look through the searchpath.  It's scanned again if the
+    modification time of a folder in the searchpath (a plugin was added or
+    removed) or of the metadata of a plugin (a new version) changed.
+    """
+    from pyClanSphere import __version__
+    filename = path.join(app.instance_folder, PLUGIN_MANIFEST)
+    key = {
+        'version':      __version__,
+        'searchpath':   [[folder, _get_mtime(folder)] for folder
+                         in app.plugin_searchpath]
+    }
+    try:
+        f = file(filename)
+        try:
+            manifest = load_json(f.read())
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        manifest = None
+    if manifest is not None and manifest['key'] == key:
+        for entry in manifest['plugins']:
+            if _get_mtime(path.join(entry['path'], 'metadata.txt')) != \
+               entry['mtime']:
+                break
+        else:
+            return manifest['plugins']
+
+    plugins = _scan_plugins(app.plugin_searchpath)
+    # several processes may start at the same time
+    tmp_filename = '%s.%d.tmp' % (filename, getpid())
+    try:
+        f = file(tmp_filename, 'w')
+        try:
+            f.write(dump_json({'key': key, 'plugins': plugins}))
+        finally:
+            f.close()
+        rename(tmp_filename, filename)
+    except (IOError, OSError), e:
+        # the plugins are just scanned on every start then
+        log.warning('Could not write the plugin manifest: %s' % e, 'core')
+    return plugins
 
 
 def install_package(app, package):
@@ -20,6 +20,10 @@ __all__ = ['DEFAULT_PRIVILEGES', 'Privilege']
 
 DEFAULT_PRIVILEGES = {}
 
+#: bumped by `bind_privileges` so that users evaluated earlier in the same
+#: process evaluate their privileges again
+_generation = 0
+
 
 class _Expr(object):
 
@@ -43,6 +47,18 @@ class _Bin(_Expr):
         self.a = a
         self.b = b
 
+    # expressions are built again for every check, compare them by value
+    # so that results can be memoized
+    def __eq__(self, other):
+        return type(self) is type(other) and \
+               self.a == other.a and self.b == other.b
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((type(self), self.a, self.b))
+
     def iter_privileges(self, cache=None):
         if cache is None:
             cache = set()
@@ -112,6 +128,52 @@ def add_admin_privilege(privilege):
     return privilege
 
 
+class PrivilegeCache(object):
+    """The privileges of a user together with the results of the checks
+    done so far.  Users keep one per request, see `User.privileges`.
+    """
+
+    def __init__(self, privileges):
+        self.privileges = privileges
+        self.generation = _generation
+        self.results = {}
+
+    @property
+    def valid(self):
+        return self.generation == _generation
+
+    def check(self, expr):
+        """Evaluate `expr` (with CLAN_ADMIN "or"ed) once."""
+        try:
+            return self.results[expr]
+        except KeyError:
+            rv = self.results[expr] = add_admin_privilege(expr)(self.privileges)
+            return rv
+
+
+def _privileges_changed():
+    global _generation
+    _generation += 1
+    db.invalidate_on_commit(['privileges'])
+
+
+class PrivilegeChangeExt(db.AttributeExtension):
+    """Invalidates the evaluated privileges of all users if privileges or
+    groups are assigned or removed, e.g. by `bind_privileges`.
+    """
+
+    def append(self, state, value, initiator):
+        _privileges_changed()
+        return value
+
+    def remove(self, state, value, initiator):
+        _privileges_changed()
+
+    def set(self, state, value, oldvalue, initiator):
+        _privileges_changed()
+        return value
+
+
 def bind_privileges(container, privileges, user=None):
     """Binds the privileges to the container.  The privileges can be a list
     of privilege names, the container must be a set.  This is called for
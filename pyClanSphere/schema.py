@@ -19,6 +19,9 @@ users = db.Table('users', metadata,
     db.Column('username', db.String(30)),
     db.Column('real_name', db.String(180)),
     db.Column('display_name', db.String(180)),
+    # lower case user and display name, see `UserQuery.name_prefix`
+    db.Column('username_lower', db.String(30)),
+    db.Column('display_name_lower', db.String(180)),
     db.Column('gender_male', db.Boolean),
     db.Column('birthday', db.Date),
     db.Column('height', db.Integer),
@@ -35,6 +38,10 @@ users = db.Table('users', metadata,
               default=datetime.utcnow()),
     db.Column('last_visited', db.DateTime)
 )
+db.Index('users_username', users.c.username)
+# users are looked up by name prefix, see `UserQuery.name_prefix`
+db.Index('users_username_lower', users.c.username_lower)
+db.Index('users_display_name_lower', users.c.display_name_lower)
 
 groups = db.Table('groups', metadata,
     db.Column('group_id', db.Integer, primary_key=True),
@@ -11,6 +11,9 @@
 """
 from werkzeug import abort
 
+from pyClanSphere.models import User
+from pyClanSphere.privileges import CLAN_ADMIN, ENTER_ADMIN_PANEL
+
 
 def do_get_comment(req):
     comment_id = req.values.get('comment_id')
@@ -45,7 +48,38 @@ def do_get_taglist(req):
     }
 
 
+def do_user_search(req):
+    if not req.user.has_privilege(ENTER_ADMIN_PANEL):
+        abort(403)
+    prefix = req.values.get('q', u'').strip()
+    try:
+        limit = min(max(int(req.values.get('limit', 10)), 1), 20)
+    except ValueError:
+        limit = 10
+    if not prefix:
+        return {'users': []}
+    users = User.query.name_prefix(prefix).order_by(User.username) \
+                      .limit(limit).all()
+    return {
+        'users':        [{
+            'id':           user.id,
+            'username':     user.username,
+            'display_name': user.display_name
+        } for user in users]
+    }
+
+
+def do_get_perf_stats(req):
+    if not req.user.has_privilege(CLAN_ADMIN):
+        abort(403)
+    rv = req.app.perf_monitor.to_dict()
+    rv['startup'] = req.app.startup.to_dict()
+    return rv
+
+
 all_services = {
     'get_comment':          do_get_comment,
-    'get_taglist':          do_get_taglist
+    'get_taglist':          do_get_taglist,
+    'user_search':          do_user_search,
+    'perf_stats':           do_get_perf_stats
 }
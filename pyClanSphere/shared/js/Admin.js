@@ -100,6 +100,40 @@
      if (height != null)
        ta.css('height', height + 'px');
    })();
+
+   // user pickers: complete the names with the user_search service and
+   // put the id of the picked user into the hidden input before them
+   $('input.user-picker').each(function() {
+     var
+       input = $(this),
+       hidden = input.prev('input[type=hidden]');
+     input.autocomplete(pyClanSphere.getJSONServiceURL('user_search'), {
+       dataType: 'json',
+       // the server matches user and display names in any case and
+       // returns only the first users, always ask it
+       matchCase: false,
+       matchSubset: false,
+       max: 10,
+       parse: function(data) {
+         return $.map(data.users, function(user) {
+           return {data: user, value: user.display_name,
+                   result: user.display_name};
+         });
+       },
+       formatItem: function(user) {
+         if (user.display_name == user.username)
+           return user.username;
+         return user.display_name + ' (' + user.username + ')';
+       }
+     }).result(function(evt, user) {
+       hidden.val(user.id);
+     });
+     // clearing the name clears the user
+     input.change(function() {
+       if (input.val() == '')
+         hidden.val('');
+     });
+   });
  });
 
 // optional field clear on focus
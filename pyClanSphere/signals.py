@@ -236,3 +236,29 @@ Application and all plugins are initialized
 """)
 signal('register_upgrade_repository', """\
 Core Repository registered, now plugins can register theirs""")
+signal('recount_counters', """\
+Sent by the recount command of the database management script.  Plugins
+that keep denormalized counters return an iterable of HTML status
+messages that rebuilds them.
+
+:keyword batch_size: number of rows to process per transaction
+:rtype: iterable of messages
+""")
+signal('rescan_metadata', """\
+Sent by the rescan command of the database management script.  Plugins
+that store metadata read from uploaded files return an iterable of HTML
+status messages that reads the files again and updates the metadata.
+
+:keyword processes: number of processes reading the files, `None` for one
+                    per CPU
+:keyword batch_size: number of rows to update at once
+:rtype: iterable of messages
+""")
+
+#: Caching
+signal('cache_tags_invalidated', """\
+Sent after a commit changed objects with cache tags, or by code that wants
+to invalidate cached template fragments itself.
+
+:keyword tags: set of tags to invalidate, e.g. ``'news'`` or ``'forum:12'``
+""")
@@ -21,7 +21,7 @@
 import sys
 import os
 from tempfile import mkdtemp
-from os.path import join, dirname
+from os.path import join, dirname, abspath, isdir
 from unittest import TestSuite, TextTestRunner, TestCase
 from unittest2 import defaultTestLoader
 from doctest import DocTestSuite, DocFileSuite
@@ -33,8 +33,10 @@ try:
 except ImportError:
     coverage = None
 
-def create_temporary_instance():
-    """Create a sqlite based test instance in a temporary directory"""
+def create_temporary_instance(plugins=()):
+    """Create a sqlite based test instance in a temporary directory,
+    optionally with some of the bundled plugins activated.
+    """
     dbname = 'sqlite://database.db'
     instance_folder = mkdtemp(prefix='pyclanspheretest')
 
@@ -53,7 +55,9 @@ def create_temporary_instance():
         real_name=u'',
         description=u'',
         extra={},
-        display_name='$username'
+        display_name='$username',
+        username_lower=u'testadmin',
+        display_name_lower=u'testadmin'
     ).inserted_primary_key[0]
 
     # insert a privilege for the user
@@ -65,6 +69,31 @@ def create_temporary_instance():
         privilege_id=privilege_id
     )
 
+    # the tables of the plugins are created in their latest version on
+    # setup, so their upgrade repositories are recorded as up to date
+    from pyClanSphere.schema import schema_versions
+    from pyClanSphere.upgrades.customisation import Repository
+    for plugin in plugins:
+        plugin_path = abspath(join(dirname(dirname(__file__)), 'plugins',
+                                   plugin))
+        if not isdir(join(plugin_path, 'versions')):
+            continue
+        # the repository is named like the plugin, there is no application
+        # yet to look it up with parse_metadata
+        f = open(join(plugin_path, 'metadata.txt'))
+        try:
+            for line in f:
+                if line.startswith('Name:'):
+                    repo_id = line[5:].strip().decode('utf-8')
+                    break
+        finally:
+            f.close()
+        e.execute(schema_versions.insert(),
+            repository_id=repo_id,
+            repository_path=plugin_path,
+            version=int(Repository(plugin_path, repo_id).latest)
+        )
+
     # set up the initial config
     from pyClanSphere.config import Configuration
     config_filename = join(instance_folder, 'pyClanSphere.ini')
@@ -75,7 +104,8 @@ def create_temporary_instance():
         site_url='http://localtest',
         secret_key=gen_secret_key(),
         database_uri=dbname,
-        iid=new_iid()
+        iid=new_iid(),
+        plugins=list(plugins)
     )
     t.commit()
     
@@ -0,0 +1,489 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.tests.benchmark
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    End-to-end benchmarks of the main pages.
+
+    A temporary sqlite instance with the bundled plugins is filled with a
+    synthetic clan (users, groups, squads, forums, topics, posts, news, wars
+    and shouts) and the pages are requested through the WSGI application,
+    the same way a browser would.  For every scenario the requests per
+    second, the latency percentiles and the database queries per request
+    (from the performance numbers of the application) are reported.
+
+    Run it with the ``run-benchmarks`` script.  The results can be written
+    to a JSON file and compared against an earlier run to catch regressions.
+
+    :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import shutil
+from datetime import datetime, timedelta
+from math import ceil
+from random import Random
+from time import time
+
+from pyClanSphere.tests import create_temporary_instance
+
+
+#: the plugins the benchmark instance is set up with
+PLUGINS = ['gamesquad', 'bulletin_board', 'news', 'war', 'shoutbox']
+
+#: the default size of the synthetic dataset.  forums, topics and posts
+#: are per category, forum and topic.
+DEFAULT_SIZES = {
+    'users':        200,
+    'groups':       5,
+    'squads':       4,
+    'categories':   3,
+    'forums':       4,
+    'topics':       25,
+    'posts':        12,
+    'news':         150,
+    'wars':         120,
+    'shouts':       300
+}
+
+_words = (u'lorem ipsum dolor sit amet consetetur sadipscing elitr sed diam '
+          u'nonumy eirmod tempor invidunt ut labore et dolore magna aliquyam '
+          u'erat voluptua at vero eos accusam justo duo dolores ea rebum stet '
+          u'clita kasd gubergren no sea takimata sanctus est').split()
+
+
+class Dataset(object):
+    """A synthetic clan.  The same `seed` always gives the same data."""
+
+    def __init__(self, sizes=None, seed=42):
+        self.sizes = DEFAULT_SIZES.copy()
+        if sizes:
+            self.sizes.update(sizes)
+        self.random = Random(seed)
+        self.now = datetime.utcnow().replace(microsecond=0)
+        self.ids = {}
+
+    def text(self, words, markup=False):
+        """Some random words, with a bit of markup if wanted."""
+        result = [self.random.choice(_words) for x in xrange(words)]
+        if markup:
+            idx = self.random.randrange(words)
+            result[idx] = u'[b]%s[/b]' % result[idx]
+            result.append(u':)')
+        return u' '.join(result).capitalize()
+
+    def date(self, days):
+        """A random date within the last `days` days."""
+        return self.now - timedelta(seconds=self.random.randrange(
+            days * 24 * 60 * 60))
+
+    def fill(self):
+        """Create the data in the database of the current application."""
+        from pyClanSphere.api import db
+        self.create_users()
+        self.create_squads()
+        self.create_board()
+        self.create_news()
+        self.create_wars()
+        self.create_shouts()
+        db.session.remove()
+
+    def create_users(self):
+        from pyClanSphere.api import db
+        from pyClanSphere.models import User, Group
+        groups = [Group(u'Group %d' % idx)
+                  for idx in xrange(self.sizes['groups'])]
+        users = [User.query.get(1)]
+        for idx in xrange(self.sizes['users']):
+            user = User(u'user%d' % idx, None, u'user%d@example.com' % idx,
+                        real_name=self.text(2), city=self.text(1),
+                        notes=self.text(20))
+            if groups:
+                user.groups.append(self.random.choice(groups))
+            users.append(user)
+        db.commit()
+        self.ids['users'] = [user.id for user in users]
+
+    def create_squads(self):
+        from pyClanSphere.api import db
+        from pyClanSphere.models import User
+        from pyClanSphere.plugins.gamesquad.models import Game, Squad, \
+             SquadMember, Level
+        game = Game(u'Trackmania')
+        levels = [Level(name, idx) for idx, name in
+                  enumerate([u'Leader', u'Member', u'Trial'])]
+        squads = []
+        for idx in xrange(self.sizes['squads']):
+            squad = Squad(game, u'Squad %d' % idx, u'S%d' % idx)
+            for user_id in self.random.sample(self.ids['users'],
+                    min(10, len(self.ids['users']))):
+                SquadMember(User.query.get(user_id), squad,
+                            self.random.choice(levels), self.text(2))
+            squads.append(squad)
+        db.commit()
+        self.ids['squads'] = [squad.id for squad in squads]
+
+    def create_board(self):
+        from pyClanSphere.api import db
+        from pyClanSphere.models import User
+        from pyClanSphere.plugins.bulletin_board.models import Category, \
+             Forum, Topic, Post
+        users = User.query.filter(User.id.in_(self.ids['users'])).all()
+        forums = []
+        topic_ids = []
+        for cat_idx in xrange(self.sizes['categories']):
+            category = Category(u'Category %d' % cat_idx, cat_idx)
+            for idx in xrange(self.sizes['forums']):
+                forum = Forum(category, u'Forum %d.%d' % (cat_idx, idx),
+                              self.text(8), idx)
+                forum.is_public = forum.allow_anonymous = True
+                forums.append(forum)
+        db.commit()
+        for forum in forums:
+            for idx in xrange(self.sizes['topics']):
+                date = self.date(365)
+                topic = Topic(forum, self.text(5), self.random.choice(users),
+                              date)
+                for pos in xrange(self.sizes['posts']):
+                    date += timedelta(minutes=self.random.randrange(1, 600))
+                    post = Post(topic, self.text(60, markup=True),
+                                self.random.choice(users), date, u'127.0.0.1')
+                    post.position = pos + 1
+                db.flush()
+                topic.refresh()
+                topic_ids.append(topic.id)
+            db.commit()
+            forum.refresh()
+            db.commit()
+        self.ids['forums'] = [forum.id for forum in forums]
+        self.ids['topics'] = topic_ids
+
+    def create_news(self):
+        from pyClanSphere.api import db
+        from pyClanSphere.models import User
+        from pyClanSphere.plugins.news.models import News, STATUS_PUBLISHED
+        authors = User.query.filter(User.id.in_(self.ids['users'][:5])).all()
+        news = [News(self.text(6), self.random.choice(authors),
+                     self.text(150, markup=True), self.date(3 * 365),
+                     status=STATUS_PUBLISHED)
+                for idx in xrange(self.sizes['news'])]
+        db.commit()
+        self.ids['news'] = [item.id for item in news]
+        self.ids['news_years'] = sorted(set(item.pub_date.year
+                                            for item in news))
+
+    def create_wars(self):
+        from pyClanSphere.api import db
+        from pyClanSphere.models import User
+        from pyClanSphere.plugins.gamesquad.models import Squad
+        from pyClanSphere.plugins.war.models import War, WarMode, WarMap, \
+             WarResult
+        squads = Squad.query.filter(Squad.id.in_(self.ids['squads'])).all()
+        users = User.query.filter(User.id.in_(self.ids['users'])).all()
+        maps = {}
+        modes = {}
+        for squad in squads:
+            maps[squad] = [WarMap(u'Map %s.%d' % (squad.tag, idx), squad)
+                           for idx in xrange(5)]
+            if squad.game not in modes:
+                modes[squad.game] = [WarMode(name, squad.game) for name in
+                                     (u'Team', u'Rounds', u'Cup')]
+        wars = []
+        for idx in xrange(self.sizes['wars']):
+            squad = self.random.choice(squads)
+            date = self.now + timedelta(days=self.random.randrange(-700, 30))
+            war = War(u'Clan %d' % self.random.randrange(50), date,
+                      u'server%d.example.com' % idx,
+                      self.random.choice(modes[squad.game]), squad=squad,
+                      orgamember=self.random.choice(users),
+                      status=date < self.now and 3 or 1,
+                      notes=self.text(10))
+            war.maps = self.random.sample(maps[squad], 2)
+            for member in self.random.sample(users, 5):
+                war.memberstatus[member] = self.random.randrange(1, 4)
+            wars.append(war)
+        db.flush()
+        for war in wars:
+            if war.date < self.now:
+                result = WarResult(war, self.random.randrange(10),
+                                   self.random.randrange(10), self.text(5))
+                result.maps = list(war.maps)
+        db.commit()
+        self.ids['wars'] = [war.id for war in wars]
+
+    def create_shouts(self):
+        from pyClanSphere.api import db
+        from pyClanSphere.models import User
+        from pyClanSphere.plugins.shoutbox.models import ShoutboxEntry
+        users = User.query.filter(User.id.in_(self.ids['users'])).all()
+        for idx in xrange(self.sizes['shouts']):
+            ShoutboxEntry(user=self.random.choice(users), ip=u'127.0.0.1',
+                          postdate=self.date(30),
+                          text=self.text(8, markup=True))
+        db.commit()
+
+
+class Scenario(object):
+    """Requests to one page.  The urls are requested in turn."""
+
+    def __init__(self, name, urls):
+        self.name = name
+        self.urls = urls
+
+
+def get_instance_ids(app, count=20):
+    """The ids of the newest (up to `count`) users, forums, topics, news and
+    wars of an instance and the years with news, to run the scenarios
+    against its own data.  Plugins that are not active give no ids.
+    """
+    from pyClanSphere.api import db
+    from pyClanSphere.models import User
+
+    def active(name):
+        plugin = app.plugins.get(name)
+        return plugin is not None and plugin.active
+
+    def newest(column):
+        return [row[0] for row in db.session.query(column)
+                                    .order_by(column.desc()).limit(count)]
+
+    ids = {'users': newest(User.id)}
+    for key in 'squads', 'forums', 'topics', 'news', 'news_years', 'wars':
+        ids[key] = []
+    if active('bulletin_board'):
+        from pyClanSphere.plugins.bulletin_board.models import Forum, Topic
+        ids['forums'] = newest(Forum.id)
+        ids['topics'] = newest(Topic.id)
+    if active('news'):
+        from pyClanSphere.plugins.news.archive import get_archive
+        from pyClanSphere.plugins.news.models import News
+        ids['news'] = newest(News.id)
+        ids['news_years'] = sorted(period.year for period in
+                                   get_archive('years')['years'])
+    if active('war'):
+        from pyClanSphere.plugins.war.models import War
+        ids['wars'] = newest(War.id)
+    db.session.remove()
+    return ids
+
+
+def get_scenarios(ids):
+    """The scenarios for the pages of a filled instance, `ids` are the
+    ids of its data as in :attr:`Dataset.ids`.
+    """
+    random = Random(len(ids['topics']))
+
+    def pick(key, count=20):
+        return random.sample(ids[key], min(count, len(ids[key])))
+
+    return [
+        Scenario('board index', ['/board/']),
+        Scenario('forum', ['/board/forum/%d' % x for x in pick('forums')]),
+        Scenario('topic detail', ['/board/topic/%d' % x
+                                  for x in pick('topics')]),
+        Scenario('news index', ['/news/', '/news/page/2']),
+        Scenario('news detail', ['/news/%d' % x for x in pick('news')]),
+        Scenario('news archive', ['/news/archive'] +
+                 ['/news/archive/%d/' % year for year in ids['news_years']]),
+        Scenario('war list', ['/wars/', '/wars/page/2']),
+        Scenario('war detail', ['/wars/%d' % x for x in pick('wars')]),
+        Scenario('profile', ['/users/%d' % x for x in pick('users')])
+    ]
+
+
+def percentile(values, percent):
+    """The `percent` percentile of a sorted list of values (nearest rank).
+
+    >>> percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 50)
+    5
+    >>> percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 95)
+    10
+    >>> percentile([], 50) is None
+    True
+    """
+    if not values:
+        return None
+    rank = int(ceil(percent / 100.0 * len(values))) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+
+class ScenarioResult(object):
+    """The numbers of a scenario run."""
+
+    def __init__(self, name, timings, duration, queries, errors):
+        self.name = name
+        self.timings = sorted(timings)
+        self.duration = duration
+        self.queries = queries
+        self.errors = errors
+
+    @property
+    def requests(self):
+        return len(self.timings)
+
+    @property
+    def requests_per_second(self):
+        return self.requests / self.duration
+
+    @property
+    def queries_per_request(self):
+        return self.queries / float(self.requests)
+
+    def percentile(self, percent):
+        return percentile(self.timings, percent)
+
+    def to_dict(self):
+        """The numbers for the JSON output, times in milliseconds."""
+        return {
+            'name':                 self.name,
+            'requests':             self.requests,
+            'requests_per_second':  self.requests_per_second,
+            'p50_ms':               self.percentile(50) * 1000,
+            'p90_ms':               self.percentile(90) * 1000,
+            'p99_ms':               self.percentile(99) * 1000,
+            'max_ms':               self.timings[-1] * 1000,
+            'queries_per_request':  self.queries_per_request,
+            'errors':               self.errors
+        }
+
+
+def run_scenario(app, scenario, requests=200, warmup=10, headers=None):
+    """Request the urls of a scenario `requests` times (after `warmup`
+    requests that are not measured) and return a :class:`ScenarioResult`.
+    """
+    from werkzeug import Client, BaseResponse
+    client = Client(app, BaseResponse)
+    headers = headers or []
+    urls = scenario.urls
+    for idx in xrange(warmup):
+        client.get(urls[idx % len(urls)], headers=headers)
+
+    app.perf_monitor.reset()
+    timings = []
+    errors = 0
+    started = time()
+    for idx in xrange(requests):
+        start = time()
+        response = client.get(urls[idx % len(urls)], headers=headers)
+        timings.append(time() - start)
+        if response.status_code != 200:
+            errors += 1
+    duration = time() - started
+    queries = sum(entry.queries for entry in
+                  app.perf_monitor.endpoints.itervalues())
+    return ScenarioResult(scenario.name, timings, duration, queries, errors)
+
+
+def login_headers(app, user_id=1):
+    """Headers with a session cookie of the given user."""
+    from werkzeug.contrib.securecookie import SecureCookie
+    cookie = SecureCookie({'uid': user_id, 'lt': time()}, app.secret_key)
+    return [('Cookie', '%s=%s' % (app.cfg['session_cookie_name'],
+                                  cookie.serialize()))]
+
+
+def format_results(results, baseline=None):
+    """Format the results as a table.  If `baseline` (a dict of results of
+    an earlier run by name) is given, the change of the median latency is
+    shown too.
+    """
+    lines = ['%-14s %8s %8s %8s %8s %8s %8s' % (
+        'scenario', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'queries',
+        'errors')]
+    for result in results:
+        data = result.to_dict()
+        line = '%-14s %8.1f %8.2f %8.2f %8.2f %8.1f %8d' % (
+            data['name'], data['requests_per_second'], data['p50_ms'],
+            data['p90_ms'], data['p99_ms'], data['queries_per_request'],
+            data['errors'])
+        old = (baseline or {}).get(result.name)
+        if old is not None:
+            line += '  %+.0f%% p50, %+.1f queries' % (
+                (data['p50_ms'] / old['p50_ms'] - 1) * 100,
+                data['queries_per_request'] - old['queries_per_request'])
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main():
+    from optparse import OptionParser
+    from pyClanSphere.utils import dump_json, load_json
+    usage = ('Usage: %prog [options] [scenarios]\n'
+             'Benchmarks the main pages with a temporary instance.  If no '
+             'scenarios are given, all are run.')
+    parser = OptionParser(usage=usage)
+    parser.add_option('-n', '--requests', type='int', default=200,
+                      help='requests per scenario (default 200)')
+    parser.add_option('-w', '--warmup', type='int', default=10,
+                      help='unmeasured requests before each scenario')
+    parser.add_option('-s', '--size', action='append', default=[],
+                      metavar='NAME=COUNT', help='size of the dataset, e.g. '
+                      'users=1000, may be given more than once.  Sizes: ' +
+                      ', '.join(sorted(DEFAULT_SIZES)))
+    parser.add_option('--seed', type='int', default=42,
+                      help='seed of the synthetic dataset')
+    parser.add_option('--login', action='store_true', default=False,
+                      help='request the pages as the administrator')
+    parser.add_option('-o', '--output', metavar='FILE',
+                      help='write the results to a JSON file')
+    parser.add_option('-c', '--compare', metavar='FILE',
+                      help='compare with the results of an earlier run')
+    parser.add_option('--keep', action='store_true', default=False,
+                      help='keep the instance folder')
+    options, args = parser.parse_args(sys.argv[1:])
+
+    sizes = {}
+    for size in options.size:
+        name, count = size.partition('=')[::2]
+        if name not in DEFAULT_SIZES or not count.isdigit():
+            parser.error('invalid size %r' % size)
+        sizes[name] = int(count)
+
+    baseline = None
+    if options.compare:
+        f = open(options.compare)
+        try:
+            baseline = dict((item['name'], item) for item in
+                            load_json(f.read())['results'])
+        finally:
+            f.close()
+
+    sys.stdout.write('Creating temporary instance ... ')
+    sys.stdout.flush()
+    app, instance_folder = create_temporary_instance(PLUGINS)
+    try:
+        sys.stdout.write('ok\nFilling it with a synthetic clan ... ')
+        sys.stdout.flush()
+        dataset = Dataset(sizes, options.seed)
+        start = time()
+        dataset.fill()
+        sys.stdout.write('ok (%.1fs)\n\n' % (time() - start))
+
+        scenarios = get_scenarios(dataset.ids)
+        if args:
+            scenarios = [x for x in scenarios if x.name in args]
+            if not scenarios:
+                parser.error('unknown scenarios')
+        headers = options.login and login_headers(app) or None
+        results = []
+        for scenario in scenarios:
+            results.append(run_scenario(app, scenario, options.requests,
+                                        options.warmup, headers))
+        print format_results(results, baseline)
+
+        if options.output:
+            f = open(options.output, 'w')
+            try:
+                f.write(dump_json({
+                    'sizes':    dataset.sizes,
+                    'login':    options.login,
+                    'results':  [result.to_dict() for result in results]
+                }))
+            finally:
+                f.close()
+    finally:
+        if options.keep:
+            print '\nThe instance is in', instance_folder
+        else:
+            shutil.rmtree(instance_folder, ignore_errors=True)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.tests.testBoardCounters
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Make sure the incrementally maintained board counters agree with
+    the ones `manage-database recount` rebuilds
+
+    :copyright: (c) 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from werkzeug import EnvironBuilder
+
+from pyClanSphere import models
+from pyClanSphere.application import Request
+from pyClanSphere.utils import local
+from pyClanSphere.tests import pyClanSphereTestCase
+
+from pyClanSphere.plugins.bulletin_board.counters import recount_board
+from pyClanSphere.plugins.bulletin_board.forms import PostForm, \
+     DeletePostForm, DeleteForumForm
+from pyClanSphere.plugins.bulletin_board.models import Category, Forum, \
+     Topic, Post, TopicEmpty
+
+
+class testBoardCounters(pyClanSphereTestCase):
+    def setUp(self):
+        pyClanSphereTestCase.setUp(self)
+        local.request = Request(EnvironBuilder('/').get_environ(), self.app)
+        self.user = models.User.query.get(1)
+        self.category = Category(u'TestCategory')
+        self.forum = Forum(self.category, u'TestForum')
+        self.other_forum = Forum(self.category, u'OtherForum')
+        self.db.commit()
+
+    def post(self, target, text):
+        form = PostForm(target, user=self.user,
+                        initial={'title': u'TestTopic', 'text': text})
+        return form.create_post()
+
+    def delete(self, post):
+        try:
+            DeletePostForm(post).delete_post()
+        except TopicEmpty:
+            pass
+
+    def counters(self):
+        self.db.session.expire_all()
+        # new forums start without counters, a recount sets them to 0
+        forums = [(forum.id, forum.topiccount or 0, forum.postcount or 0,
+                   forum.lasttopic_id, forum.lastpost_id)
+                  for forum in Forum.query.order_by(Forum.id)]
+        topics = [(topic.id, topic.postcount, topic.lastpost_id)
+                  for topic in Topic.query.order_by(Topic.id)]
+        return forums, topics
+
+    def assertCountersRecounted(self):
+        counters = self.counters()
+        for message in recount_board(None):
+            pass
+        self.assertEqual(counters, self.counters())
+
+    def testAddPosts(self):
+        """Counters after new topics and replies"""
+
+        first = self.post(self.forum, u'first').topic
+        self.post(self.other_forum, u'second')
+        self.post(first, u'reply')
+        self.post(first, u'another reply')
+        self.assertCountersRecounted()
+        self.assertEqual(self.forum.topiccount, 1)
+        self.assertEqual(self.forum.postcount, 3)
+        self.assertEqual(first.postcount, 3)
+
+    def testDeletePosts(self):
+        """Counters after deleting replies, the last post and topics"""
+
+        first = self.post(self.forum, u'first').topic
+        reply = self.post(first, u'reply')
+        last = self.post(first, u'last reply')
+        second = self.post(self.forum, u'second')
+        self.delete(reply)
+        self.assertCountersRecounted()
+        self.delete(second)
+        self.assertCountersRecounted()
+        self.delete(last)
+        self.assertCountersRecounted()
+        self.assertEqual(self.forum.lastpost_id, first.lastpost_id)
+        self.delete(Topic.query.get(first.id).lastpost)
+        self.assertCountersRecounted()
+        self.assertEqual(self.forum.topiccount, 0)
+        self.assertEqual(self.forum.lastpost_id, None)
+
+    def testPostPositions(self):
+        """Posts are numbered without gaps"""
+
+        topic = self.post(self.forum, u'first').topic
+        posts = [self.post(topic, u'reply %d' % idx) for idx in xrange(4)]
+        self.delete(posts[1])
+        self.delete(posts[0])
+        self.post(topic, u'last reply')
+        self.db.session.expire_all()
+        self.assertEqual([(post.text, post.position) for post in
+                          Post.query.filter_by(topic_id=topic.id)
+                                    .order_by(Post.id)],
+                         [(u'first', 1), (u'reply 2', 2), (u'reply 3', 3),
+                          (u'last reply', 4)])
+
+    def testMoveTopics(self):
+        """Counters after moving the topics to another forum"""
+
+        self.post(self.forum, u'first')
+        self.post(self.post(self.forum, u'second').topic, u'reply')
+        self.post(self.other_forum, u'third')
+        form = DeleteForumForm(self.forum, initial={
+            'action':       'relocate',
+            'relocate_to':  self.other_forum
+        })
+        form.delete_forum()
+        self.assertCountersRecounted()
+        self.assertEqual(self.other_forum.topiccount, 3)
+        self.assertEqual(self.other_forum.postcount, 4)
+
+    def tearDown(self):
+        for model in Post, Topic, Forum, Category:
+            model.query.delete()
+        self.db.commit()
+        del local.request
+        pyClanSphereTestCase.tearDown(self)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.tests.testLog
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Make sure the logger writes its records, also in forked processes
+
+    :copyright: (c) 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+
+import os
+import signal
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from pyClanSphere.tests import pyClanSphereTestCase
+from pyClanSphere.utils.log import Logger
+
+
+class testLogger(pyClanSphereTestCase):
+    def setUp(self):
+        pyClanSphereTestCase.setUp(self)
+        self.folder = mkdtemp()
+        self.filename = os.path.join(self.folder, 'test.log')
+        self.logger = Logger(self.filename, 'info', queue_size=2)
+
+    def messages(self):
+        self.logger.flush()
+        return [line.split(': ', 1)[1].strip()
+                for line in open(self.filename)]
+
+    def testWrite(self):
+        """Records are written by the writer thread"""
+
+        for idx in xrange(5):
+            self.logger.log('info', u'record %d' % idx, 'test')
+        self.assertEqual(self.messages(),
+                         ['record %d' % idx for idx in xrange(5)])
+
+    def testFork(self):
+        """A process forked after logging starts its own writer"""
+
+        self.logger.log('info', u'parent', 'test')
+        self.logger.flush()
+        pid = os.fork()
+        if pid == 0:
+            # never hang the test run, the queue holds only two records
+            signal.alarm(10)
+            try:
+                for idx in xrange(5):
+                    self.logger.log('info', u'child %d' % idx, 'test')
+                self.logger.flush()
+                self.logger.close()
+            finally:
+                os._exit(0)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.logger.log('info', u'parent again', 'test')
+        self.assertEqual(self.messages(), ['parent'] +
+                         ['child %d' % idx for idx in xrange(5)] +
+                         ['parent again'])
+
+    def tearDown(self):
+        self.logger.close()
+        rmtree(self.folder)
+        pyClanSphereTestCase.tearDown(self)
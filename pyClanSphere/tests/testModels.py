@@ -108,6 +108,25 @@ class testUserModel(pyClanSphereTestCase):
         self.assertNotEqual(user.display_name, 'TestBenutzer')
         self.assertEqual(user.display_name, 'TestUser')
 
+    def testNamePrefix(self):
+        """Finding users by the start of their user or display name"""
+
+        def find(prefix):
+            return [user.id for user in
+                    models.User.query.name_prefix(prefix).order_by(models.User.id)]
+
+        user = models.User.query.get(2)
+        self.assertEqual(find(u'test'), [1, 2])
+        self.assertEqual(find(u'tESTu'), [2])
+        self.assertEqual(find(u'TestBen'), [])
+        user.display_name = '$real_name'
+        self.db.commit()
+        self.assertEqual(find(u'testben'), [2])
+        user.username = u'McDonald'
+        self.db.commit()
+        self.assertEqual(find(u'mcd'), [2])
+        self.assertEqual(find(u'TestU'), [])
+
     def tearDown(self):
         self.db.delete(models.User.query.get(2))
         self.db.commit()
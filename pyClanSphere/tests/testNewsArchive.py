@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.tests.testNewsArchive
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Make sure the archive index follows the news and agrees with the one
+    `manage-database recount` rebuilds
+
+    :copyright: (c) 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+
+from datetime import date, datetime
+
+from werkzeug import EnvironBuilder
+
+from pyClanSphere import models
+from pyClanSphere.application import Request
+from pyClanSphere.utils import local
+from pyClanSphere.tests import pyClanSphereTestCase
+
+from pyClanSphere.plugins.news.archive import _insert_count, \
+     rebuild_archive_index
+from pyClanSphere.plugins.news.database import news_archive
+from pyClanSphere.plugins.news.models import News, STATUS_DRAFT, \
+     STATUS_PUBLISHED
+
+
+class testNewsArchive(pyClanSphereTestCase):
+    def setUp(self):
+        pyClanSphereTestCase.setUp(self)
+        local.request = Request(EnvironBuilder('/').get_environ(), self.app)
+        self.user = models.User.query.get(1)
+
+    def news(self, pub_date, status=STATUS_PUBLISHED):
+        news = News(u'TestNews', self.user, u'text', pub_date, status=status)
+        self.db.commit()
+        return news
+
+    def counts(self):
+        a = news_archive.c
+        return dict(((year, month, day), count) for year, month, day, count
+                    in self.db.execute(self.db.select([a.year, a.month,
+                                                       a.day, a.newscount])))
+
+    def assertCounts(self, expected):
+        counts = self.counts()
+        self.assertEqual(counts, expected)
+        rebuild_archive_index(self.db.session.connection())
+        self.assertEqual(self.counts(), counts)
+        self.db.rollback()
+
+    def testPublish(self):
+        """New published news are counted, drafts are not"""
+
+        self.news(datetime(2010, 5, 1, 12))
+        self.news(datetime(2010, 5, 1, 18))
+        self.news(datetime(2010, 5, 2))
+        self.news(datetime(2010, 5, 3), STATUS_DRAFT)
+        self.assertCounts({(2010, 5, 1): 2, (2010, 5, 2): 1})
+
+    def testMove(self):
+        """Changing the publication date or status moves the count"""
+
+        news = self.news(datetime(2010, 5, 1))
+        self.news(datetime(2010, 5, 1))
+        news.pub_date = datetime(2010, 6, 1)
+        self.db.commit()
+        self.assertCounts({(2010, 5, 1): 1, (2010, 6, 1): 1})
+        news.status = STATUS_DRAFT
+        self.db.commit()
+        self.assertCounts({(2010, 5, 1): 1})
+        news.status = STATUS_PUBLISHED
+        self.db.commit()
+        self.assertCounts({(2010, 5, 1): 1, (2010, 6, 1): 1})
+
+    def testDelete(self):
+        """Deleted news are no longer counted, empty days are dropped"""
+
+        news = self.news(datetime(2010, 5, 1))
+        other = self.news(datetime(2010, 5, 1))
+        self.db.delete(news)
+        self.db.commit()
+        self.assertCounts({(2010, 5, 1): 1})
+        self.db.delete(other)
+        self.db.commit()
+        self.assertCounts({})
+
+    def testInsertExisting(self):
+        """A day inserted concurrently is reported, not raised"""
+
+        connection = self.db.session.connection()
+        self.assert_(_insert_count(connection, date(2010, 5, 1), 1))
+        self.failIf(_insert_count(connection, date(2010, 5, 1), 1))
+        self.db.commit()
+        self.assertEqual(self.counts(), {(2010, 5, 1): 1})
+
+    def tearDown(self):
+        News.query.delete()
+        self.db.execute(news_archive.delete())
+        self.db.commit()
+        del local.request
+        pyClanSphereTestCase.tearDown(self)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.tests.testUploads
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Make sure uploads are sniffed, limited and spooled while they come in
+
+    :copyright: (c) 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+
+import os
+from hashlib import md5
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from pyClanSphere.tests import pyClanSphereTestCase
+from pyClanSphere.utils.uploads import UploadStream, UploadType, \
+     SNIFF_SIZE, FILE_MODE
+
+
+HEADER = 'TEST' + '\x00' * (SNIFF_SIZE - 4)
+
+
+class testUploadStream(pyClanSphereTestCase):
+    def setUp(self):
+        pyClanSphereTestCase.setUp(self)
+        self.folder = mkdtemp()
+        self.types = [UploadType('test', lambda h: h.startswith('TEST'), 100)]
+
+    def stream(self, default_max_size=None, **kwargs):
+        return UploadStream(self.types, self.folder, default_max_size,
+                            **kwargs)
+
+    def upload(self, stream, data, step):
+        for idx in xrange(0, len(data), step):
+            stream.write(data[idx:idx + step])
+        stream.seek(0)
+        return stream
+
+    def spooled(self):
+        return os.listdir(self.folder)
+
+    def testSniffSplitHeader(self):
+        """The type is sniffed from a header split across writes"""
+
+        stream = self.upload(self.stream(), HEADER + 'data', 3)
+        self.assertEqual(stream.type, 'test')
+        self.assertEqual(stream.read(), HEADER + 'data')
+        self.assertEqual(stream.digest, md5(HEADER + 'data').hexdigest())
+
+    def testTypeLimit(self):
+        """Files over the limit of their type are dropped"""
+
+        stream = self.upload(self.stream(), HEADER + 'x' * 100, 10)
+        self.assertEqual(stream.type, 'test')
+        self.assert_(stream.rejected)
+        self.assertEqual(stream.size, SNIFF_SIZE + 100)
+        self.assertEqual(stream.read(), '')
+
+    def testDefaultLimit(self):
+        """Files of no registered type are limited by the default"""
+
+        stream = self.upload(self.stream(50), 'x' * 40, 10)
+        self.assertEqual(stream.type, None)
+        self.failIf(stream.rejected)
+        self.assertEqual(stream.read(), 'x' * 40)
+        stream = self.upload(self.stream(50), 'x' * 60, 10)
+        self.assertEqual(stream.type, None)
+        self.assert_(stream.rejected)
+
+    def testShortFile(self):
+        """Files shorter than the sniffed header are checked at the end"""
+
+        stream = self.upload(self.stream(10), 'TEST', 1)
+        self.assertEqual(stream.type, 'test')
+        self.assertEqual(stream.read(), 'TEST')
+        stream = self.upload(self.stream(10), 'x' * 20, 1)
+        self.assert_(stream.rejected)
+
+    def testSpooling(self):
+        """Larger files are spooled to disk and moved into place"""
+
+        data = HEADER + ''.join(chr(idx % 256) for idx in xrange(60))
+        stream = self.upload(self.stream(spool_size=40, chunk_size=16),
+                             data, 7)
+        self.assertEqual(len(self.spooled()), 1)
+        self.assertEqual(stream.read(), data)
+        path = os.path.join(self.folder, 'saved')
+        stream.save(path)
+        self.assertEqual(self.spooled(), ['saved'])
+        self.assertEqual(open(path, 'rb').read(), data)
+        self.assertEqual(os.stat(path).st_mode & 0777, FILE_MODE)
+        stream.close()
+
+    def testSmallFileInMemory(self):
+        """Files up to the spool size stay in memory"""
+
+        stream = self.upload(self.stream(spool_size=64, chunk_size=16),
+                             HEADER + 'x' * 30, 7)
+        self.assertEqual(self.spooled(), [])
+        path = os.path.join(self.folder, 'saved')
+        stream.save(path)
+        self.assertEqual(open(path, 'rb').read(), HEADER + 'x' * 30)
+        self.assertEqual(os.stat(path).st_mode & 0777, FILE_MODE)
+
+    def testRejectSpooled(self):
+        """The spool file of a rejected upload is removed"""
+
+        stream = self.stream(spool_size=40, chunk_size=16)
+        stream.write(HEADER + 'x' * 60)
+        self.assertEqual(len(self.spooled()), 1)
+        stream.write('x' * 20)
+        self.assert_(stream.rejected)
+        self.assertEqual(self.spooled(), [])
+
+    def tearDown(self):
+        rmtree(self.folder)
+        pyClanSphereTestCase.tearDown(self)
@@ -46,6 +46,9 @@ class CommandLineInterface(object):
            'script': 'Create an empty upgrade script.',
           'upgrade': 'Upgrade a database to a later version.',
         'downgrade': 'Downgrade a database to the specified version.',
+          'recount': 'Rebuild denormalized counters from the database.',
+           'rescan': 'Read the metadata of uploaded files again.',
+            'audit': 'Look for queries of the main pages that scan tables.',
     }
 
     def run(self, argv=sys.argv):
@@ -161,6 +164,45 @@ class CommandLineInterface(object):
         self.cmdlogger(manage.cmd_downgrade(repo, version, echo=options.echo))
 
 
+    def recount(self, argv):
+        parser = OptionParser(usage=self.usage % ('recount', ''),
+                              description=self.commands['recount'])
+        parser.add_option('--batch-size', default=500, type='int',
+                          help='rows to process per transaction '
+                               '(default: 500)')
+        options, args = parser.parse_args(argv)
+        manage = ManageDatabase(self.get_pyClanSphere_instance())
+        self.cmdlogger(manage.cmd_recount(options.batch_size))
+
+    def rescan(self, argv):
+        parser = OptionParser(usage=self.usage % ('rescan', ''),
+                              description=self.commands['rescan'])
+        parser.add_option('--processes', '-p', type='int',
+                          help='number of processes reading the files '
+                               '(default: one per CPU)')
+        parser.add_option('--batch-size', default=100, type='int',
+                          help='rows to update at once (default: 100)')
+        options, args = parser.parse_args(argv)
+        manage = ManageDatabase(self.get_pyClanSphere_instance())
+        self.cmdlogger(manage.cmd_rescan(options.processes,
+                                         options.batch_size))
+
+    def audit(self, argv):
+        parser = OptionParser(usage=self.usage % ('audit', '[SCENARIOS]'),
+                              description=self.commands['audit'])
+        parser.add_option('--login', action='store_true', default=False,
+                          help='request the pages as the first administrator')
+        parser.add_option('--min-rows', default=100, type='int',
+                          help='ignore scans of tables with fewer rows '
+                               '(default: 100)')
+        parser.add_option('--pages', default=5, type='int',
+                          help='pages per scenario (default: 5)')
+        options, args = parser.parse_args(argv)
+        manage = ManageDatabase(self.get_pyClanSphere_instance())
+        self.cmdlogger(manage.cmd_audit(args, options.login,
+                                        options.min_rows, options.pages))
+
+
 class ManageDatabase(object):
     """Database maintenance class."""
 
@@ -243,6 +285,89 @@ class ManageDatabase(object):
             yield escape(str(msg).decode('utf-8', 'ignore'))
             yield '</p>\n'
 
+    def cmd_recount(self, batch_size=500):
+        """Rebuild the denormalized counters of all plugins that listen
+        to the `recount_counters` signal.
+        """
+        from pyClanSphere import signals
+        yield '<h2>Recounting</h2>\n'
+        results = signals.recount_counters.send(batch_size=batch_size)
+        if not results:
+            yield '<p>Nothing to recount.</p>\n'
+        for receiver, messages in results:
+            for message in messages or ():
+                yield message
+        yield '<p>Done!</p>\n'
+
+    def cmd_rescan(self, processes=None, batch_size=100):
+        """Read the metadata of the files of all plugins that listen to the
+        `rescan_metadata` signal again.
+        """
+        from pyClanSphere import signals
+        yield '<h2>Rescanning</h2>\n'
+        results = signals.rescan_metadata.send(processes=processes,
+                                               batch_size=batch_size)
+        if not results:
+            yield '<p>Nothing to rescan.</p>\n'
+        for receiver, messages in results:
+            for message in messages or ():
+                yield message
+        yield '<p>Done!</p>\n'
+
+    def cmd_audit(self, scenarios=None, login=False, min_rows=100, pages=5):
+        """Request the pages of the benchmark scenarios and report the
+        queries that scan tables with at least `min_rows` rows.
+        """
+        from pyClanSphere.upgrades.audit import audit_queries
+        from pyClanSphere.upgrades.webapp import WebUpgrades
+        from pyClanSphere.tests.benchmark import get_instance_ids, \
+             get_scenarios, login_headers
+        if isinstance(self.instance, WebUpgrades):
+            yield '<p>error: the database needs an upgrade first</p>\n'
+            return
+        app = self.instance
+        yield '<h2>Auditing the queries (%s)</h2>\n' % \
+              app.database_engine.dialect.name
+        headers = None
+        if login:
+            from pyClanSphere.models import User
+            from pyClanSphere.privileges import CLAN_ADMIN
+            admin = [user for user in User.query.order_by(User.id).all()
+                     if user.has_privilege(CLAN_ADMIN)]
+            if not admin:
+                yield '<p>error: there is no administrator</p>\n'
+                return
+            headers = login_headers(app, admin[0].id)
+        urls = []
+        for scenario in get_scenarios(get_instance_ids(app, pages)):
+            if not scenarios or scenario.name in scenarios:
+                urls.extend(scenario.urls)
+        try:
+            count, findings = audit_queries(app, urls, headers, min_rows)
+        except ValueError, msg:
+            yield '<p>error: %s</p>\n' % escape(str(msg))
+            return
+        yield '<p>%d pages requested, %d distinct queries explained</p>\n' % \
+              (len(urls), count)
+        for statement, statement_urls, scans in findings:
+            yield '<h3>%s</h3>\n' % escape(', '.join(
+                  '%s (%s rows)' % (table, rows is None and '?' or rows)
+                  for table, rows, detail in scans))
+            yield '<pre>%s</pre>\n' % escape(statement.strip())
+            yield '<ul>'
+            for table, rows, detail in scans:
+                yield '<li>%s</li>' % escape(detail)
+            yield '<li>requested by %s</li>' % escape(', '.join(
+                  statement_urls[:3] + (len(statement_urls) > 3 and
+                                        ['...'] or [])))
+            yield '</ul>\n'
+        if findings:
+            yield '<p>%d queries scan tables with %d rows or more</p>\n' % \
+                  (len(findings), min_rows)
+        else:
+            yield '<p>No query scans a table with %d rows or more</p>\n' % \
+                  min_rows
+
     def _migrate(self, repository, version, upgrade, **opts):
         engine = construct_engine(self.url, **opts)
         schema = api.ControlledSchema(engine, repository)
@@ -0,0 +1,213 @@
+"""
+    pyClanSphere.upgrades.audit
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Finds the queries of the main pages that scan whole tables.
+
+    The pages of the benchmark scenarios (see
+    :mod:`pyClanSphere.tests.benchmark`) are requested from the instance
+    with the ids of its own data.  The ``SELECT`` statements of their
+    queries are collected by the performance monitor of the application
+    and run through the ``EXPLAIN`` of the database, SQLite, MySQL and
+    PostgreSQL are supported.  Full scans of tables are reported with the
+    pages that caused them.  Run it with ``manage-database audit``.
+
+    The planners of MySQL and PostgreSQL prefer scanning small tables to
+    using an index, so audit a database of realistic size, for example a
+    benchmark instance kept with ``run-benchmarks --keep``.
+
+    :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+import re
+
+from pyClanSphere.database import db, metadata
+
+
+_sqlite_step_re = re.compile(r'^(SCAN|SEARCH)\s+(?:TABLE\s+)?(\S+)'
+                             r'(?:\s+AS\s+(\S+))?(.*)$')
+_postgres_scan_re = re.compile(r'(Seq Scan|Index Scan|Index Only Scan|'
+                               r'Bitmap Heap Scan)(?: Backward)?'
+                               r'(?: using \S+)? on (\S+)')
+_alias_re = re.compile(r'^(.+)_\d+$')
+
+
+def get_table_name(name):
+    """Return the name of the table behind an alias SQLAlchemy created.
+
+    >>> from pyClanSphere import schema
+    >>> get_table_name('users_1')
+    'users'
+    >>> get_table_name('"users"')
+    'users'
+    """
+    name = name.strip('"`')
+    if name not in metadata.tables:
+        match = _alias_re.match(name)
+        if match is not None and match.group(1) in metadata.tables:
+            return match.group(1)
+    return name
+
+
+def parse_sqlite_plan(rows):
+    """Return the steps of a plan of ``EXPLAIN QUERY PLAN`` as a list of
+    ``(table, full_scan, detail)`` tuples.
+
+    >>> for step in parse_sqlite_plan([(0, 0, 0, 'SCAN users_1'),
+    ...         (0, 0, 0, 'SCAN users USING INDEX users_username'),
+    ...         (0, 0, 0, 'SEARCH TABLE wars USING INDEX wars_date (date>?)'),
+    ...         (0, 0, 0, 'USE TEMP B-TREE FOR ORDER BY')]):
+    ...     print step
+    ('users', True, 'SCAN users_1')
+    ('users', False, 'SCAN users USING INDEX users_username')
+    ('wars', False, 'SEARCH TABLE wars USING INDEX wars_date (date>?)')
+    """
+    steps = []
+    for row in rows:
+        detail = row[-1]
+        match = _sqlite_step_re.match(detail)
+        if match is None:
+            continue
+        kind, table, alias, rest = match.groups()
+        full_scan = kind == 'SCAN' and 'INDEX' not in rest and \
+                    'PRIMARY KEY' not in rest
+        steps.append((get_table_name(str(table)), full_scan, str(detail)))
+    return steps
+
+
+def parse_mysql_plan(rows, columns):
+    """Return the steps of a plan of MySQL's ``EXPLAIN``.  ``ALL`` is the
+    access type of full scans.
+
+    >>> parse_mysql_plan([(1, 'SIMPLE', 'wars', 'ALL', None, None, None,
+    ...                    None, 120, 'Using filesort')],
+    ...                  ['id', 'select_type', 'table', 'type',
+    ...                   'possible_keys', 'key', 'key_len', 'ref', 'rows',
+    ...                   'Extra'])
+    [('wars', True, 'wars: ALL, Using filesort')]
+    """
+    steps = []
+    for row in rows:
+        row = dict(zip(columns, row))
+        if not row.get('table'):
+            continue
+        detail = '%s: %s' % (row['table'], row['type'])
+        if row.get('key'):
+            detail += ' using %s' % row['key']
+        if row.get('Extra'):
+            detail += ', %s' % row['Extra']
+        steps.append((get_table_name(str(row['table'])), row['type'] == 'ALL',
+                      detail))
+    return steps
+
+
+def parse_postgres_plan(rows):
+    """Return the steps of a plan of PostgreSQL's ``EXPLAIN``.
+
+    >>> for step in parse_postgres_plan([
+    ...         ('Limit  (cost=0.00..1.00 rows=10 width=4)',),
+    ...         ('  ->  Seq Scan on newsitems  (cost=0.00..4.50 rows=150)',),
+    ...         ('  ->  Index Scan using users_pkey on users users_1',)]):
+    ...     print step
+    ('newsitems', True, 'Seq Scan on newsitems')
+    ('users', False, 'Index Scan using users_pkey on users')
+    """
+    steps = []
+    for row in rows:
+        match = _postgres_scan_re.search(row[0])
+        if match is not None:
+            steps.append((get_table_name(match.group(2)),
+                          match.group(1) == 'Seq Scan', match.group(0)))
+    return steps
+
+
+def explain(engine, statement, parameters):
+    """Run a statement through the ``EXPLAIN`` of the database and return
+    the steps of the plan that read tables as ``(table, full_scan,
+    detail)`` tuples.
+    """
+    dialect = engine.dialect.name
+    if dialect == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    elif dialect in ('mysql', 'postgresql', 'postgres'):
+        prefix = 'EXPLAIN '
+    else:
+        raise ValueError('EXPLAIN of %s databases is not supported' % dialect)
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(prefix + statement, parameters or ())
+            rows = cursor.fetchall()
+            columns = [column[0] for column in cursor.description]
+        finally:
+            cursor.close()
+    finally:
+        connection.close()
+    if dialect == 'sqlite':
+        return parse_sqlite_plan(rows)
+    elif dialect == 'mysql':
+        return parse_mysql_plan(rows, columns)
+    return parse_postgres_plan(rows)
+
+
+def collect_statements(app, urls, headers=None):
+    """Request the urls and return the distinct ``SELECT`` statements of
+    their queries as a list of ``(statement, parameters, urls)`` tuples in
+    the order they were first sent.
+    """
+    from werkzeug import Client, BaseResponse
+    client = Client(app, BaseResponse)
+    seen = {}
+    result = []
+    for url in urls:
+        statements = app.perf_monitor.statements = []
+        try:
+            client.get(url, headers=headers or [])
+        finally:
+            app.perf_monitor.statements = None
+        for statement, parameters in statements:
+            if not statement.lstrip().upper().startswith('SELECT'):
+                continue
+            entry = seen.get(statement)
+            if entry is None:
+                entry = seen[statement] = (statement, parameters, [])
+                result.append(entry)
+            if url not in entry[2]:
+                entry[2].append(url)
+    return result
+
+
+def count_rows(engine, table):
+    """The number of rows of a table or `None` if it's not known."""
+    if table not in metadata.tables:
+        return None
+    return engine.execute(db.select([db.func.count()],
+                          from_obj=[metadata.tables[table]])).scalar()
+
+
+def audit_queries(app, urls, headers=None, min_rows=100):
+    """Request the urls and explain their queries.  Returns the number of
+    distinct statements and a list of ``(statement, urls, scans)`` tuples
+    for the statements that scan tables with at least `min_rows` rows,
+    `scans` being a list of ``(table, rows, detail)`` tuples.
+    """
+    engine = app.database_engine
+    statements = collect_statements(app, urls, headers)
+    row_counts = {}
+    findings = []
+    for statement, parameters, statement_urls in statements:
+        scans = []
+        for table, full_scan, detail in explain(engine, statement,
+                                                parameters):
+            if not full_scan:
+                continue
+            if table not in row_counts:
+                row_counts[table] = count_rows(engine, table)
+            rows = row_counts[table]
+            if rows is None or rows >= min_rows:
+                scans.append((table, rows, detail))
+        if scans:
+            findings.append((statement, statement_urls, scans))
+    return len(statements), findings
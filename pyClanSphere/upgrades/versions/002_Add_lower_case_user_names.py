@@ -0,0 +1,73 @@
+"""Add lower case user names"""
+# Keep __doc__ to a single line
+from string import Template
+
+from pyClanSphere.upgrades.versions import *
+
+# use this or define your own if you need
+metadata = db.MetaData()
+
+for var in ['Column', 'String', 'Index']:
+    globals()[var] = getattr(db,var)
+
+# Define tables here
+# users is reflected in the upgrade functions as they need to know
+# whether the columns are already there (new installations).
+
+#: (column, length, index name)
+COLUMNS = [
+    ('username_lower', 30, 'users_username_lower'),
+    ('display_name_lower', 180, 'users_display_name_lower'),
+]
+
+# Define the objects here
+
+
+def map_tables(mapper):
+    clear_mappers()
+    # Map tables to the python objects here
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine
+    # bind migrate_engine to your metadata
+    session = scoped_session(lambda: create_session(migrate_engine,
+                                                    autoflush=True,
+                                                    autocommit=False))
+    map_tables(session.mapper)
+    metadata.bind = migrate_engine
+    users = reflect_table('users', migrate_engine)
+    for column, length, index in COLUMNS:
+        if column not in users.c:
+            yield u'<p>Add %s column to users</p>\n' % column
+            Column(column, String(length)).create(users)
+            Index(index, users.c[column]).create(migrate_engine)
+
+    yield u'<p>Storing the lower case names of all users</p>\n'
+    u = users.c
+    values = [{
+        'uid':          user_id,
+        'uname':        (username or u'').lower(),
+        'dname':        Template(display_name or u'').safe_substitute(
+                            username=username, real_name=real_name
+                        ).lower()[:180]
+    } for user_id, username, real_name, display_name in migrate_engine.execute(
+        db.select([u.user_id, u.username, u.real_name, u.display_name]))]
+    if values:
+        migrate_engine.execute(users.update(u.user_id == db.bindparam('uid'),
+            values={'username_lower': db.bindparam('uname'),
+                    'display_name_lower': db.bindparam('dname')}),
+            values)
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    session = scoped_session(lambda: create_session(migrate_engine,
+                                                    autoflush=True,
+                                                    autocommit=False))
+    map_tables(session.mapper)
+    metadata.bind = migrate_engine
+    for column, length, index in COLUMNS:
+        yield u'<p>Drop %s column from users</p>\n' % column
+        drop_index(migrate_engine, 'users', index)
+        users = reflect_table('users', migrate_engine)
+        drop_column(users.c[column], users)
@@ -42,3 +42,30 @@ def drop_table(table, migrate_engine):
     else:
         table.drop(migrate_engine)
 
+
+def reflect_table(name, migrate_engine):
+    return db.Table(name, db.MetaData(bind=migrate_engine), autoload=True)
+
+def create_index(migrate_engine, table_name, name, *columns, **kwargs):
+    """Create an index unless the table has it already, new installations
+    create the tables with the indexes of the current schema.  Keyword
+    arguments are passed to the index (e.g. `unique`).  Returns `True` if
+    the index was created.
+    """
+    table = reflect_table(table_name, migrate_engine)
+    if name in [index.name for index in table.indexes]:
+        return False
+    db.Index(name, *[table.c[column] for column in columns], **kwargs) \
+      .create(migrate_engine)
+    return True
+
+def drop_index(migrate_engine, table_name, name):
+    """Drop an index if the table has it.  Returns `True` if it was
+    dropped.
+    """
+    table = reflect_table(table_name, migrate_engine)
+    for index in table.indexes:
+        if index.name == name:
+            index.drop(migrate_engine)
+            return True
+    return False
@@ -62,6 +62,7 @@ def make_urls(app):
         Rule('/system/maintenance', endpoint='admin/maintenance'),
         Rule('/system/log', defaults={'page': 1}, endpoint='admin/log'),
         Rule('/system/log/page/<int:page>', endpoint='admin/log'),
+        Rule('/system/performance', endpoint='admin/performance'),
         Rule('/system/plugins/', endpoint='admin/plugins'),
         Rule('/system/plugins/<plugin>/remove', endpoint='admin/remove_plugin'),
         Rule('/system/help/', endpoint='admin/help'),
@@ -69,6 +70,7 @@ def make_urls(app):
     ]
     other_urls = [
         Rule('/_translations.js', endpoint='core/serve_translations'),
+        Rule('/_avatars/<filename>', endpoint='core/avatar'),
         Rule('/_services/', endpoint='core/service_rsd'),
         Rule('/_services/json/<path:identifier>', endpoint='core/json_service'),
         Rule('/_services/xml/<path:identifier>', endpoint='core/xml_service'),
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.utils.assets
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Fingerprinted and precompressed copies of the shared files.
+
+    :func:`build_assets` (run by ``scripts/build-assets``) copies the files
+    of all shared exports into the ``assets`` folder of the instance with
+    a hash of their contents in the filename and writes gzipped siblings
+    of the text files.  Relative URLs in stylesheets are rewritten to the
+    fingerprinted names as well.  The bundles registered with
+    :meth:`~pyClanSphere.application.pyClanSphere.add_asset_bundle` are
+    concatenated and minified.
+
+    The manifest of the build maps the specs of the shared files to their
+    copies, :func:`~pyClanSphere.application.shared_url` uses it to link
+    the copies.  As the content of a fingerprinted file never changes
+    :class:`AssetMiddleware` serves them with far-future cache headers.
+
+    :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import re
+import gzip
+import posixpath
+import mimetypes
+from StringIO import StringIO
+from time import time
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from pyClanSphere.utils import dump_json, load_json, log
+from pyClanSphere.utils.sendfile import FileSender, get_safe_filename
+
+
+#: the name of the folder in the instance folder
+ASSET_FOLDER = 'assets'
+
+#: the manifest of the build in the asset folder
+MANIFEST = 'manifest.json'
+
+#: files that are compressed
+TEXT_EXTENSIONS = set(['.js', '.css', '.html', '.htm', '.txt', '.xml',
+                       '.svg', '.json'])
+
+#: one year, the longest time proxies accept
+FAR_FUTURE = 365 * 24 * 60 * 60
+
+_css_url_re = re.compile(r'''url\(\s*(['"]?)([^'"()]+?)\1\s*\)''')
+_css_comment_re = re.compile(r'/\*(?!!).*?\*/', re.S)
+_css_space_re = re.compile(r'\s+')
+_css_punct_re = re.compile(r'\s*([{};:,>])\s*')
+_js_license_re = re.compile(r'^\s*(/\*!.*?\*/)', re.S)
+
+
+def get_asset_folder(app):
+    """Return the path of the asset folder of the application."""
+    return os.path.join(app.instance_folder, ASSET_FOLDER)
+
+
+def get_asset_exports(app):
+    """Return a dict of the shared exports that are built, the names of the
+    exports mapped to their folders.  Exports inside the instance folder
+    (like the userpics) hold uploaded files and are left out.
+    """
+    instance = os.path.join(app.instance_folder, '')
+    rv = {}
+    for prefix, folder in app._shared_exports.iteritems():
+        folder = os.path.abspath(folder)
+        if not folder.startswith(instance):
+            rv[prefix[len('/_shared/'):]] = folder
+    return rv
+
+
+def get_manifest_key(app):
+    """The key of the manifest, a build for a different key is outdated."""
+    from pyClanSphere import __version__
+    return {
+        'version':  __version__,
+        'exports':  sorted(get_asset_exports(app))
+    }
+
+
+def fingerprinted_name(filename, data):
+    """Insert the hash of `data` into `filename`.
+
+    >>> fingerprinted_name('js/app.js', 'alert(42);')
+    'js/app.87831ff16f.js'
+    """
+    base, ext = posixpath.splitext(filename)
+    return '%s.%s%s' % (base, md5(data).hexdigest()[:10], ext)
+
+
+def minify_css(css):
+    """Strip comments (except ``/*! ... */``) and whitespace from a
+    stylesheet.
+
+    >>> minify_css('a  { color : red; }\\n/* x */ b > i {margin: 0 1px}')
+    'a{color:red}b>i{margin:0 1px}'
+    """
+    css = _css_comment_re.sub('', css)
+    css = _css_space_re.sub(' ', css)
+    css = _css_punct_re.sub(r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def minify_js(js):
+    """Minify a script, a leading ``/*! ... */`` comment (usually the
+    license) is kept.
+    """
+    from pyClanSphere._ext.jsmin import jsmin
+    match = _js_license_re.match(js)
+    rv = jsmin(js)
+    if match is not None:
+        rv = match.group(1) + '\n' + rv
+    return rv
+
+
+def rewrite_css_urls(css, export, source, target, files):
+    """Rewrite the relative URLs in a stylesheet to the fingerprinted
+    copies.  `source` is the filename of the stylesheet in the `export`,
+    `target` the filename of the copy in the asset folder and `files` the
+    mapping of specs to copies built so far.  URLs of files that were not
+    built are left alone.
+    """
+    source_dir = posixpath.dirname(source)
+    target_dir = posixpath.dirname(target)
+
+    def handle_match(match):
+        url = match.group(2).strip()
+        if url.startswith(('/', '#')) or ':' in url:
+            return match.group(0)
+        path = url.split('?', 1)[0].split('#', 1)[0]
+        path = posixpath.normpath(posixpath.join(source_dir, path))
+        copy = files.get('%s::%s' % (export, path))
+        if copy is None:
+            return match.group(0)
+        return 'url(%s)' % posixpath.relpath(copy, target_dir or '.')
+    return _css_url_re.sub(handle_match, css)
+
+
+class AssetManifest(object):
+    """The result of a build.  `files` maps the specs of the shared files
+    to the filenames of their copies, `bundles` the names of the bundles
+    to their filenames.
+    """
+
+    def __init__(self, key, files, bundles, built=None):
+        self.key = key
+        self.files = files
+        self.bundles = bundles
+        self.built = built
+
+    @classmethod
+    def load(cls, filename):
+        f = open(filename)
+        try:
+            data = load_json(f.read())
+        finally:
+            f.close()
+        return cls(data['key'], data['files'], data['bundles'],
+                   data.get('built'))
+
+    def save(self, filename):
+        tmp = '%s.%d.tmp' % (filename, os.getpid())
+        f = open(tmp, 'w')
+        try:
+            f.write(dump_json({
+                'key':      self.key,
+                'files':    self.files,
+                'bundles':  self.bundles,
+                'built':    self.built
+            }))
+        finally:
+            f.close()
+        os.rename(tmp, filename)
+
+
+def load_asset_manifest(app):
+    """Return the :class:`AssetManifest` of the last build or `None` if the
+    assets were not built or the build is outdated.
+    """
+    filename = os.path.join(get_asset_folder(app), MANIFEST)
+    if not os.path.isfile(filename):
+        return None
+    try:
+        manifest = AssetManifest.load(filename)
+    except (IOError, ValueError, KeyError), e:
+        log.warning('could not load the asset manifest: %s' % e, 'core')
+        return None
+    if manifest.key != get_manifest_key(app):
+        log.warning('the static assets are outdated and not used, run '
+                    'build-assets again', 'core')
+        return None
+    return manifest
+
+
+def _walk_export(folder):
+    """Yield the filenames (with slashes) of all files in the folder."""
+    for dirpath, dirnames, filenames in os.walk(folder):
+        dirnames[:] = [x for x in dirnames if not x.startswith('.')]
+        rel = os.path.relpath(dirpath, folder)
+        for filename in filenames:
+            if filename.startswith('.') or filename.endswith('~'):
+                continue
+            if rel != '.':
+                filename = os.path.join(rel, filename)
+            yield filename.replace(os.path.sep, '/')
+
+
+def _read(filename):
+    f = open(filename, 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def _write(filename, data):
+    dirname = os.path.dirname(filename)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    f = open(filename, 'wb')
+    try:
+        f.write(data)
+    finally:
+        f.close()
+
+
+def gzip_data(data):
+    """Compress `data` with a fixed timestamp, so that the result only
+    depends on the data.
+    """
+    buf = StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0)
+    try:
+        f.write(data)
+    finally:
+        f.close()
+    return buf.getvalue()
+
+
+class AssetBuilder(object):
+    """Writes the copies of one build, see :func:`build_assets`."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.files = {}
+        self.bundles = {}
+        self.written = 0
+        self.size = 0
+        self.compressed = 0
+
+    def write(self, filename, data):
+        """Write the fingerprinted copy of `data` and return its name."""
+        rv = fingerprinted_name(filename, data)
+        path = os.path.join(self.folder, *rv.split('/'))
+        _write(path, data)
+        self.written += 1
+        self.size += len(data)
+        if posixpath.splitext(filename)[1].lower() in TEXT_EXTENSIONS:
+            compressed = gzip_data(data)
+            if len(compressed) < len(data):
+                _write(path + '.gz', compressed)
+                self.compressed += 1
+        return rv
+
+    def add_file(self, export, folder, filename):
+        data = _read(os.path.join(folder, *filename.split('/')))
+        target = '%s/%s' % (export, filename)
+        if filename.lower().endswith('.css'):
+            data = rewrite_css_urls(data, export, filename, target,
+                                    self.files)
+        self.files['%s::%s' % (export, filename)] = \
+            self.write(target, data)
+
+    def add_bundle(self, name, specs, exports):
+        target = 'bundles/' + name
+        is_css = name.lower().endswith('.css')
+        parts = []
+        for spec in specs:
+            export, filename = spec.split('::', 1)
+            data = _read(os.path.join(exports[export], *filename.split('/')))
+            if is_css:
+                data = minify_css(rewrite_css_urls(data, export, filename,
+                                                   target, self.files))
+            else:
+                data = minify_js(data)
+            parts.append(data)
+        self.bundles[name] = self.write(target, (is_css and '\n' or
+                                                 ';\n').join(parts))
+
+
+def build_assets(app):
+    """Build the copies of all shared files and the bundles of the
+    application and write the manifest.  Older copies are kept as pages
+    in caches may still link them.  Returns the :class:`AssetBuilder`.
+    """
+    folder = get_asset_folder(app)
+    builder = AssetBuilder(folder)
+    exports = get_asset_exports(app)
+
+    # stylesheets last so that their URLs can be rewritten
+    stylesheets = []
+    for export, export_folder in sorted(exports.iteritems()):
+        for filename in _walk_export(export_folder):
+            if filename.lower().endswith('.css'):
+                stylesheets.append((export, export_folder, filename))
+            else:
+                builder.add_file(export, export_folder, filename)
+    for export, export_folder, filename in stylesheets:
+        builder.add_file(export, export_folder, filename)
+
+    for name, specs in sorted(app.asset_bundles.iteritems()):
+        builder.add_bundle(name, specs, exports)
+
+    AssetManifest(get_manifest_key(app), builder.files, builder.bundles,
+                  int(time())).save(os.path.join(folder, MANIFEST))
+    return builder
+
+
+class AssetMiddleware(object):
+    """Serves the asset folder at ``/_assets``.  All files in there are
+    fingerprinted and cached for a year, the gzipped sibling of a file is
+    sent to clients that accept it (nginx picks it itself with
+    ``gzip_static``).
+    """
+
+    def __init__(self, app, folder, prefix='/_assets/', sender=None):
+        self.app = app
+        self.folder = folder
+        self.prefix = prefix
+        self.sender = sender or FileSender()
+
+    def get_filename(self, path):
+        path = path[len(self.prefix):]
+        if path == MANIFEST or path.endswith('.gz'):
+            return None
+        return get_safe_filename(self.folder, path)
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(self.prefix):
+            return self.app(environ, start_response)
+        filename = self.get_filename(path)
+        if filename is None:
+            return self.app(environ, start_response)
+
+        mimetype = mimetypes.guess_type(filename)[0] or \
+                   'application/octet-stream'
+        headers = []
+        if os.path.splitext(filename)[1].lower() in TEXT_EXTENSIONS:
+            headers.append(('Vary', 'Accept-Encoding'))
+            if self.sender.mode != 'accel' and \
+               'gzip' in environ.get('HTTP_ACCEPT_ENCODING', '') and \
+               os.path.isfile(filename + '.gz'):
+                filename += '.gz'
+                headers.append(('Content-Encoding', 'gzip'))
+        return self.sender(environ, start_response, filename, mimetype,
+                           FAR_FUTURE, headers)
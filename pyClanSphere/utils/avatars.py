@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.utils.avatars
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Scaled down variants of the uploaded user pictures.
+
+    Users upload pictures of any size but the theme shows them with
+    `avatar.size` pixels.  The variants of a picture are stored in the
+    ``userpics/variants`` folder of the instance, their names contain a
+    hash of the picture and the size::
+
+        <picture name>.<content hash>.<size>.<png|jpeg>
+
+    A new upload changes the hash and with it the URL, so the variants are
+    served with far-future cache headers from ``/_avatars``.  They are
+    created when a picture is uploaded, a missing variant (after the theme
+    changed the size for example) is created on its first request and
+    ``scripts/build-avatars`` creates the variants of all pictures with a
+    pool of worker processes.
+
+    Scaling needs the Python Imaging Library, without it the original
+    pictures are linked as before.
+
+    :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import re
+from multiprocessing import Pool
+from tempfile import mkstemp
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        import Image
+    except ImportError:
+        Image = None
+
+from pyClanSphere.utils.uploads import FILE_MODE
+
+
+#: the folder with the uploaded pictures in the instance folder
+PICTURE_FOLDER = 'userpics'
+
+#: the folder with the variants in the picture folder
+VARIANT_FOLDER = 'variants'
+
+#: the types of pictures users may upload (as reported by imghdr)
+PICTURE_TYPES = ('png', 'gif', 'jpeg')
+
+#: pictures with more pixels are not scaled (and not loaded into memory)
+MAX_PIXELS = 25 * 1000 * 1000
+
+_digest_length = 10
+_variant_re = re.compile(r'^([0-9a-f]{32})\.([0-9a-f]{%d})\.(\d{1,4})\.'
+                         r'(png|jpeg)$' % _digest_length)
+
+
+def get_picture_folder(app):
+    """Return the folder of the uploaded pictures."""
+    return os.path.join(app.instance_folder, PICTURE_FOLDER)
+
+
+def get_variant_folder(app):
+    """Return the folder of the variants."""
+    return os.path.join(get_picture_folder(app), VARIANT_FOLDER)
+
+
+def get_avatar_sizes(app):
+    """Return the sizes variants are created for."""
+    return [int(app.theme.settings['avatar.size'])]
+
+
+def variant_format(pictype):
+    """The format of the variants of a picture.  GIFs are scaled as PNGs,
+    their palette would not survive the smoothing.
+    """
+    if pictype == 'jpeg':
+        return 'jpeg'
+    return 'png'
+
+
+def variant_name(filename, digest, size):
+    """Return the name of a variant of the picture `filename`.
+
+    >>> variant_name('1e6d1c3f7ab4a3f1dbbfac14e6e0a9d2.gif', '87831ff16f', 80)
+    '1e6d1c3f7ab4a3f1dbbfac14e6e0a9d2.87831ff16f.80.png'
+    """
+    base, pictype = filename.rsplit('.', 1)
+    return '%s.%s.%d.%s' % (base, digest, size, variant_format(pictype))
+
+
+def parse_variant_name(name):
+    """Split a variant name into the name of the picture without type, the
+    hash, the size and the format.  Returns `None` for invalid names.
+
+    >>> parse_variant_name('1e6d1c3f7ab4a3f1dbbfac14e6e0a9d2.87831ff16f.80.png')
+    ('1e6d1c3f7ab4a3f1dbbfac14e6e0a9d2', '87831ff16f', 80, 'png')
+    >>> parse_variant_name('../secret.87831ff16f.80.png') is None
+    True
+    """
+    match = _variant_re.match(name)
+    if match is None:
+        return None
+    base, digest, size, format = match.groups()
+    return base, digest, int(size), format
+
+
+def file_digest(filename):
+    """Return the hash of the contents of a file."""
+    f = open(filename, 'rb')
+    try:
+        return md5(f.read()).hexdigest()[:_digest_length]
+    finally:
+        f.close()
+
+
+class DigestCache(object):
+    """Remembers the hashes of the pictures.  A picture is only read again
+    if its size or modification time changed, so pages only `stat` the
+    pictures they link.
+    """
+
+    def __init__(self):
+        self._digests = {}
+
+    def get(self, filename):
+        """Return the hash of `filename` or `None` if it does not exist."""
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        key = (st.st_mtime, st.st_size)
+        cached = self._digests.get(filename)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        digest = file_digest(filename)
+        self._digests[filename] = (key, digest)
+        return digest
+
+    def set(self, filename, digest):
+        """Remember the hash of a file that was just written."""
+        st = os.stat(filename)
+        self._digests[filename] = ((st.st_mtime, st.st_size),
+                                   digest[:_digest_length])
+
+    def forget(self, filename):
+        self._digests.pop(filename, None)
+
+
+_digests = DigestCache()
+
+
+def remember_digest(filename, digest):
+    """Remember the MD5 hex digest of a picture computed while it was
+    uploaded, so it does not have to be read again.
+    """
+    _digests.set(filename, digest)
+
+
+def make_variant(source, target, size):
+    """Scale the picture `source` down to fit into `size` pixels square and
+    save it as `target`.  Raises `IOError` if the picture can't be read.
+    """
+    image = Image.open(source)
+    width, height = image.size
+    if width * height > MAX_PIXELS:
+        raise IOError('picture too large (%dx%d)' % (width, height))
+    format = target.rsplit('.', 1)[1]
+    if format == 'jpeg':
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        image = image.convert('RGBA')
+    image.thumbnail((size, size), Image.ANTIALIAS)
+
+    folder = os.path.dirname(target)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    # the dot keeps the half written file away from the middleware
+    fd, tmp = mkstemp(dir=folder, prefix='.variant')
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            if format == 'jpeg':
+                image.save(f, 'JPEG', quality=85, optimize=True)
+            else:
+                image.save(f, 'PNG', optimize=True)
+        finally:
+            f.close()
+        # mkstemp creates the file for the owner only, the web server may
+        # send the variants directly
+        os.chmod(tmp, FILE_MODE)
+        os.rename(tmp, target)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _make_variant_job(job):
+    """Worker function of :func:`build_variants`."""
+    source, target, size = job
+    try:
+        make_variant(source, target, size)
+    except (IOError, OSError), e:
+        return source, str(e)
+    return source, None
+
+
+def get_variant(app, filename, size):
+    """Return the name of the variant of the picture `filename` or `None`
+    if the picture does not exist or can't be scaled.
+    """
+    if Image is None or not filename:
+        return None
+    digest = _digests.get(os.path.join(get_picture_folder(app), filename))
+    if digest is None:
+        return None
+    return variant_name(filename, digest, size)
+
+
+def create_variant(app, name):
+    """Create the variant `name` if it does not exist yet and return its
+    filename.  Only sizes of :func:`get_avatar_sizes` are created and only
+    for the current content of the picture, otherwise `None` is returned.
+    """
+    parts = parse_variant_name(name)
+    if Image is None or parts is None:
+        return None
+    base, digest, size, format = parts
+    if size not in get_avatar_sizes(app):
+        return None
+    target = os.path.join(get_variant_folder(app), name)
+    if os.path.isfile(target):
+        return target
+    folder = get_picture_folder(app)
+    for pictype in PICTURE_TYPES:
+        source = os.path.join(folder, '%s.%s' % (base, pictype))
+        if variant_format(pictype) == format and \
+           _digests.get(source) == digest:
+            break
+    else:
+        return None
+    try:
+        make_variant(source, target, size)
+    except (IOError, OSError), e:
+        from pyClanSphere.utils import log
+        log.warning('could not scale %s: %s' % (source, e), 'avatars')
+        return None
+    return target
+
+
+def create_variants(app, filename):
+    """Create the variants of a newly uploaded picture."""
+    for size in get_avatar_sizes(app):
+        name = get_variant(app, filename, size)
+        if name is not None:
+            create_variant(app, name)
+
+
+def remove_variants(app, filename):
+    """Remove all variants of the picture `filename`."""
+    base = filename.rsplit('.', 1)[0] + '.'
+    folder = get_variant_folder(app)
+    _digests.forget(os.path.join(get_picture_folder(app), filename))
+    if not os.path.isdir(folder):
+        return
+    for name in os.listdir(folder):
+        if name.startswith(base):
+            os.remove(os.path.join(folder, name))
+
+
+def build_variants(app, sizes=None, workers=None, clean=False):
+    """Create the missing variants of all pictures in the given sizes (the
+    :func:`get_avatar_sizes` by default) with a pool of `workers` processes
+    (one per CPU by default).  If `clean` is true variants of old pictures
+    and other sizes are removed.
+
+    Returns the number of created and removed variants and a list of
+    ``(filename, error)`` tuples for pictures that could not be scaled.
+    """
+    if Image is None:
+        raise RuntimeError('scaling pictures needs the Python Imaging Library')
+    if sizes is None:
+        sizes = get_avatar_sizes(app)
+    folder = get_picture_folder(app)
+    variant_folder = get_variant_folder(app)
+    if not os.path.isdir(folder):
+        return 0, 0, []
+
+    jobs = []
+    wanted = set()
+    for filename in sorted(os.listdir(folder)):
+        source = os.path.join(folder, filename)
+        if filename.rsplit('.', 1)[-1] not in PICTURE_TYPES or \
+           not os.path.isfile(source):
+            continue
+        for size in sizes:
+            name = get_variant(app, filename, size)
+            wanted.add(name)
+            target = os.path.join(variant_folder, name)
+            if not os.path.isfile(target):
+                jobs.append((source, target, size))
+
+    removed = 0
+    if clean and os.path.isdir(variant_folder):
+        for name in os.listdir(variant_folder):
+            if name not in wanted and not name.startswith('.'):
+                os.remove(os.path.join(variant_folder, name))
+                removed += 1
+
+    errors = []
+    if jobs:
+        pool = Pool(workers)
+        try:
+            for source, error in pool.imap_unordered(_make_variant_job, jobs):
+                if error is not None:
+                    errors.append((source, error))
+        finally:
+            pool.close()
+            pool.join()
+    return len(jobs) - len(errors), removed, errors
@@ -535,6 +535,24 @@ class HiddenInput(Input):
     type = 'hidden'
 
 
+class UserPicker(Widget):
+    """A text input that completes the names of users with the
+    ``user_search`` service, the id of the picked user is submitted in a
+    hidden input.  The names are looked up as the admin types, so the
+    form does not have to list all users.
+    """
+
+    def render(self, **attrs):
+        self._attr_setdefault(attrs)
+        user = self._field.get_user(self._value)
+        hidden = html.input(name=self.name, value=self.value, type='hidden',
+                            disabled=attrs.get('disabled'))
+        attrs.setdefault('class', 'user-picker')
+        return Markup(hidden + html.input(type='text', value=user and
+                                          user.display_name or u'',
+                                          **attrs))
+
+
 class Textarea(Widget):
     """Displays a textarea."""
 
@@ -1454,6 +1472,49 @@ class HiddenModelField(ModelField):
             raise ValidationError(self.messages['invalid'])
 
 
+class UserField(ModelField):
+    """A field that picks a user by id with the :class:`UserPicker`.  Only
+    the submitted id is looked up, the ids in `exclude` (the members of a
+    squad for example) are not accepted.
+    """
+    widget = UserPicker
+    messages = dict(
+        invalid=lazy_gettext('Invalid value.'),
+        not_found=lazy_gettext(u'This user does not exist.'),
+        excluded=lazy_gettext(u'“%(user)s” can\'t be picked here.')
+    )
+
+    def __init__(self, label=None, help_text=None, required=False,
+                 exclude=(), message=None, validators=None, widget=None,
+                 messages=None, default=missing):
+        from pyClanSphere.models import User
+        ModelField.__init__(self, User, None, label, help_text, required,
+                            message, validators, widget, messages, default)
+        self.exclude = exclude
+
+    def convert(self, value):
+        user = ModelField.convert(self, value)
+        if user is not None and user.id in self.exclude:
+            raise ValidationError(self.messages['excluded'] %
+                                  {'user': user.display_name})
+        return user
+
+    def _coerce_value(self, value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValidationError(self.messages['invalid'])
+
+    def get_user(self, value):
+        """Return the user a (submitted) value stands for or `None`."""
+        if value is None or isinstance(value, self.model):
+            return value
+        try:
+            return self.model.query.get(int(value))
+        except (TypeError, ValueError):
+            return None
+
+
 class ChoiceField(Field):
     """A field that lets a user select one out of many choices.
 
@@ -10,6 +10,10 @@
     We are not using the python logging system because it registers the loggers
     in a central spot and it's pretty slow.
 
+    Records are written by a background thread so that requests never wait
+    for the disk unless the queue of unwritten records is full.  The file
+    can be rotated by size or by time and written as JSON lines.
+
     :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
                 see AUTHORS for more details.
     :license: BSD, see LICENSE for more details.
@@ -17,8 +21,16 @@
 import re
 import os
 import sys
-from os import path
+import atexit
+from os import path, rename
 from datetime import datetime
+from Queue import Queue, Empty, Full
+from struct import Struct
+from thread import allocate_lock
+from threading import Thread
+from time import time
+from weakref import ref
+from zlib import crc32
 from inspect import currentframe
 from warnings import warn
 from traceback import print_exception, format_exception
@@ -27,7 +39,7 @@ from werkzeug.exceptions import NotFound
 
 from pyClanSphere.i18n import gettext
 from pyClanSphere.application import get_application
-from pyClanSphere.utils.io import tail
+from pyClanSphere.utils import dump_json, load_json
 from pyClanSphere.utils.dates import format_iso8601, parse_iso8601
 
 
@@ -41,6 +53,12 @@ LEVELS = {
     _('debug'):     0
 }
 
+#: the rotation intervals in seconds
+ROTATE_INTERVALS = {
+    'daily':        60 * 60 * 24,
+    'weekly':       60 * 60 * 24 * 7
+}
+
 
 _log_line_re = re.compile(r'''(?xm)
     ^
@@ -60,11 +78,31 @@ _log_line_re = re.compile(r'''(?xm)
 
 
 class Logger(object):
-    """The central logger class that is attached to the application."""
+    """The central logger class that is attached to the application.
 
-    def __init__(self, logfile, level='warning'):
+    Log calls only put the record into a queue, a background thread writes
+    the records in batches (see :class:`LogWriter`).  If the queue is full
+    the logging thread waits (`full_policy` ``'block'``) or the record is
+    dropped and the number of dropped records is logged later on
+    (``'drop'``).
+
+    The thread is started with the first record and again in a process
+    forked after that, the queue of the parent is not drained there.
+    """
+
+    def __init__(self, logfile, level='warning', format='text',
+                 rotate_size=0, rotate_interval=None, rotate_keep=5,
+                 queue_size=1000, full_policy='block'):
         self.logfile = logfile
-        self._file = None
+        self.writer = LogWriter(logfile, format, rotate_size,
+                                rotate_interval, rotate_keep)
+        self.queue_size = max(queue_size, 1)
+        self.queue = Queue(self.queue_size)
+        self.block = full_policy != 'drop'
+        self.dropped = 0
+        self._lock = allocate_lock()
+        self._thread = None
+        self._pid = None
         self.level = LEVELS.get(level)
 
         # whoops. wrong level.  fall back to error and log that
@@ -75,12 +113,100 @@ class Logger(object):
 
     def view(self, per_page=200):
         """Returns a logfile view for the log."""
+        self.flush()
         return LogfileView(self.logfile, per_page)
 
     def __del__(self):
-        if self._file is not None:
-            self._file.close()
-            self._file = None
+        # tell the writer thread to finish
+        try:
+            self.queue.put_nowait(None)
+        except Full:
+            pass
+
+    def get_location(self, frame):
+        """Returns the location for the frame.  If the location is unknown a
+        placeholder string is returned
+        """
+        if frame is None:
+            return u'?'
+        return ('%s:%d' % (
+            frame.f_globals.get('__name__', frame.f_code.co_name),
+            frame.f_lineno
+        )).encode('utf-8', 'replace')
+
+    def log(self, level, message, module=None, frame=None):
+        """Queues a single log entry for writing."""
+        record = (datetime.utcnow(), level, self.get_location(frame),
+                  module or 'unknown', message)
+        if not self._running():
+            self._start()
+        if self.block:
+            self.queue.put(record)
+        else:
+            try:
+                self.queue.put_nowait(record)
+            except Full:
+                self.dropped += 1
+
+    def flush(self):
+        """Wait until all queued records are written."""
+        if self._running():
+            self.queue.join()
+
+    def close(self):
+        """Write the queued records and stop the writer thread."""
+        if self._running():
+            self.queue.put(None)
+            self._thread.join()
+
+    def _running(self):
+        return self._pid == os.getpid() and self._thread.isAlive()
+
+    def _start(self):
+        if self._pid is not None and self._pid != os.getpid():
+            # forked, the writer thread of the parent is gone and its lock,
+            # queue and file are in the state they had at the fork
+            self._lock = allocate_lock()
+            self.queue = Queue(self.queue_size)
+            self.writer.forget()
+        self._lock.acquire()
+        try:
+            if self._running():
+                return
+            thread = Thread(target=_write_records,
+                            args=(ref(self), self.queue, self.writer, Empty),
+                            name='pyClanSphere log writer')
+            thread.setDaemon(True)
+            thread.start()
+            if self._pid is None:
+                atexit.register(_close_at_exit, ref(self))
+            self._thread = thread
+            self._pid = os.getpid()
+        finally:
+            self._lock.release()
+
+
+class LogWriter(object):
+    """Writes records to the logfile and rotates it.
+
+    If `rotate_size` (in bytes) is given the file is rotated once it grows
+    beyond that size, `rotate_interval` (``'daily'`` or ``'weekly'``)
+    rotates it with the first record of a new day or week (UTC).  The
+    rotated files get the suffixes ``.1`` (the newest) to `rotate_keep`.
+
+    `format` is ``'text'`` for the classic format or ``'json'`` for one
+    JSON object per record and line.
+    """
+
+    def __init__(self, filename, format='text', rotate_size=0,
+                 rotate_interval=None, rotate_keep=5):
+        self.filename = filename
+        self.format = format
+        self.rotate_size = rotate_size
+        self.rotate_interval = ROTATE_INTERVALS.get(rotate_interval)
+        self.rotate_keep = max(rotate_keep, 1)
+        self._file = None
+        self._period = None
 
     @property
     def file(self):
@@ -89,7 +215,7 @@ class Logger(object):
         """
         if self._file is None or self._file.closed:
             try:
-                self._file = file(self.logfile, 'a+')
+                self._file = file(self.filename, 'a+')
             except IOError:
                 # grml.  log file not writable.  return a dummy
                 return file(os.devnull, 'w')
@@ -98,30 +224,125 @@ class Logger(object):
                 char = self._file.read()
                 if char != '\n':
                     self._file.write('\n')
+            if self.rotate_interval:
+                self._period = self._get_period(
+                    path.getmtime(self.filename))
         return self._file
 
-    def get_location(self, frame):
-        """Returns the location for the frame.  If the location is unknown a
-        placeholder string is returned
-        """
-        if frame is None:
-            return u'?'
-        return ('%s:%d' % (
-            frame.f_globals.get('__name__', frame.f_code.co_name),
-            frame.f_lineno
-        )).encode('utf-8', 'replace')
-
-    def log(self, level, message, module=None, frame=None):
-        """Writes a single log entry to the stream."""
+    def _get_period(self, timestamp):
+        return int(timestamp // self.rotate_interval)
+
+    def format_record(self, timestamp, level, location, module, message):
+        """Returns the record as bytestring, one or more lines."""
+        if self.format == 'json':
+            return dump_json({
+                'timestamp':    format_iso8601(timestamp),
+                'level':        level,
+                'location':     location,
+                'module':       module,
+                'message':      message
+            }).encode('utf-8') + '\n'
         prefix = (u'[%s-%s-%s] %s: ' % (
-            format_iso8601(datetime.utcnow()),
+            format_iso8601(timestamp),
             level,
-            self.get_location(frame),
-            module or 'unknown'
+            location,
+            module
         )).encode('utf-8')
-        for line in message.splitlines():
-            self.file.write(prefix + (line + u'\n').encode('utf-8'))
-        self.file.flush()
+        return ''.join(prefix + (line + u'\n').encode('utf-8')
+                       for line in message.splitlines())
+
+    def write(self, records):
+        """Write a batch of records and flush the file once (or once per
+        file if the batch fills the logfile).
+        """
+        f = self.file
+        if self.rotate_interval is not None and \
+           self._period != self._get_period(time()):
+            self.rotate()
+            f = self.file
+        size = f.tell()
+        chunks = []
+        for record in records:
+            data = self.format_record(*record)
+            if self.rotate_size and size > 0 and \
+               size + len(data) > self.rotate_size:
+                f.write(''.join(chunks))
+                self.rotate()
+                f = self.file
+                size = f.tell()
+                del chunks[:]
+            chunks.append(data)
+            size += len(data)
+        f.write(''.join(chunks))
+        f.flush()
+
+    def rotate(self):
+        """Rotate the logfile."""
+        self.close()
+        try:
+            for idx in xrange(self.rotate_keep - 1, 0, -1):
+                filename = '%s.%d' % (self.filename, idx)
+                if path.exists(filename):
+                    rename(filename, '%s.%d' % (self.filename, idx + 1))
+            if path.exists(self.filename):
+                rename(self.filename, self.filename + '.1')
+        except OSError:
+            # can't rotate, keep on writing into the current file
+            pass
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def forget(self):
+        """Drop the file inherited from the parent process without writing
+        anything to it, the next write opens it again.
+        """
+        self._file = None
+
+
+def _write_records(logger_ref, queue, writer, empty, batch_size=500):
+    # the logger is referenced weakly.  If it goes away (the application
+    # was reloaded) it puts `None` into the queue, the remaining records are
+    # written and the thread ends.
+    while 1:
+        records = [queue.get()]
+        try:
+            while len(records) < batch_size:
+                records.append(queue.get_nowait())
+        except empty:
+            pass
+        done = len(records)
+        finished = None in records
+        records = [record for record in records if record is not None]
+        try:
+            logger = logger_ref()
+            if logger is not None and logger.dropped:
+                dropped, logger.dropped = logger.dropped, 0
+                records.append((datetime.utcnow(), 'warning', '?', 'logger',
+                                u'%d log records were dropped because the '
+                                u'queue was full' % dropped))
+            logger = None
+            if records:
+                writer.write(records)
+        except Exception:
+            # nowhere to report that, the records are lost
+            pass
+        for idx in xrange(done):
+            queue.task_done()
+        if finished:
+            break
+    try:
+        writer.close()
+    except Exception:
+        pass
+
+
+def _close_at_exit(logger_ref):
+    logger = logger_ref()
+    if logger is not None:
+        logger.close()
 
 
 class NoSuchPage(NotFound):
@@ -151,57 +372,269 @@ class LogfileItem(object):
 
 
 class LogfilePage(object):
-    """A single page in the logfile."""
+    """A single page in the logfile.  `records` are the raw records, every
+    one becomes an item.
+    """
 
-    def __init__(self, lines, has_next, number):
+    def __init__(self, records, has_next, number):
         self.has_prev = number > 1
         self.number = number
         self.has_next = has_next
-        self.items = []
+        self.items = filter(None, map(self.parse_record, records))
 
-        last_prefix = None
+    @staticmethod
+    def parse_record(record):
+        """Parses the lines of a record into a `LogfileItem`."""
         item = None
-
         _parse_line = _log_line_re.match
-        for line in lines:
+        for line in record.splitlines():
+            # records in the json format
+            if line.startswith('{'):
+                try:
+                    d = load_json(line.decode('utf-8', 'replace'))
+                    item = LogfileItem(d['timestamp'], d['level'],
+                                       d['location'], d['module'])
+                    item.lines = d['message'].splitlines()
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    continue
+                return item
             match = _parse_line(line.decode('utf-8', 'replace'))
             # trash in the logfile :-/
             if match is None:
                 continue
             d = match.groupdict()
-
-            # continuation of the same item
-            if d['prefix'] == last_prefix:
+            d.pop('prefix')
+            if item is None:
+                item = LogfileItem(**d)
+            else:
                 item.lines.append(d['message'])
-            # whoosh. a new item
+        return item
+
+
+class LogIndex(object):
+    """An index of the records in a logfile, stored next to it with the
+    suffix ``.idx``.  For every record the offset of its first line, the
+    level and a checksum of the module name are stored in fixed size
+    entries, so pages can be sought without reading the log and filters
+    only have to look at the index.
+
+    The index is brought up to date whenever it's used by reading the part
+    of the log that was written since.  If the logfile was rotated or
+    truncated it's built again.
+    """
+
+    magic = 'PCSLOGI1'
+    header = Struct('<8sQQ')
+    entry = Struct('<QBI')
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.index_filename = filename + '.idx'
+
+    @staticmethod
+    def module_checksum(module):
+        """Returns the checksum stored for a module name."""
+        if isinstance(module, unicode):
+            module = module.encode('utf-8')
+        return crc32(module) & 0xffffffff
+
+    def _open(self):
+        try:
+            return file(self.index_filename, 'r+b')
+        except IOError:
+            return file(self.index_filename, 'w+b')
+
+    def update(self):
+        """Index the records written since the last update.  Returns the
+        open index file and the size of the log that is indexed or `None`
+        if the log does not exist or the index is not writable.
+        """
+        try:
+            stat = os.stat(self.filename)
+            log = file(self.filename, 'rb')
+        except (OSError, IOError):
+            return None
+        _index_lock.acquire()
+        try:
+            try:
+                index = self._open()
+            except IOError:
+                log.close()
+                return None
+            try:
+                self._update(index, log, stat)
+            except:
+                index.close()
+                raise
+        finally:
+            log.close()
+            _index_lock.release()
+        return index
+
+    def _update(self, index, log, stat):
+        data = index.read(self.header.size)
+        indexed = 0
+        if len(data) == self.header.size:
+            magic, inode, indexed = self.header.unpack(data)
+            if magic != self.magic or inode != stat.st_ino or \
+               indexed > stat.st_size:
+                indexed = 0
+        if indexed == 0:
+            index.seek(0)
+            index.truncate()
+            index.write(self.header.pack(self.magic, stat.st_ino, 0))
+        if indexed == stat.st_size:
+            self.indexed = indexed
+            return
+
+        # the prefix of the last record, to find out if the next lines
+        # continue it
+        last_prefix = None
+        index.seek(0, 2)
+        if index.tell() > self.header.size:
+            index.seek(-self.entry.size, 2)
+            log.seek(self.entry.unpack(index.read(self.entry.size))[0])
+            match = _log_line_re.match(log.readline().decode('utf-8',
+                                                             'replace'))
+            if match is not None:
+                last_prefix = match.group('prefix')
+
+        log.seek(indexed)
+        entries = []
+        offset = indexed
+        _parse_line = _log_line_re.match
+        _pack = self.entry.pack
+        while 1:
+            line = log.readline()
+            # stop at the end of the file and at lines that are still being
+            # written
+            if not line.endswith('\n'):
+                break
+            if line.startswith('{'):
+                try:
+                    d = load_json(line.decode('utf-8', 'replace'))
+                    entries.append(_pack(offset,
+                        LEVELS.get(d['level'], 255) & 0xff,
+                        self.module_checksum(d['module'])))
+                except (ValueError, KeyError, TypeError):
+                    pass
+                last_prefix = None
             else:
-                last_prefix = d.pop('prefix')
-                item = LogfileItem(**d)
-                self.items.append(item)
+                match = _parse_line(line.decode('utf-8', 'replace'))
+                if match is not None and match.group('prefix') != last_prefix:
+                    last_prefix = match.group('prefix')
+                    entries.append(_pack(offset,
+                        LEVELS.get(match.group('level'), 255) & 0xff,
+                        self.module_checksum(match.group('module'))))
+            offset += len(line)
+
+        index.seek(0, 2)
+        index.write(''.join(entries))
+        index.seek(0)
+        index.write(self.header.pack(self.magic, stat.st_ino, offset))
+        index.flush()
+        self.indexed = offset
+
+
+#: serializes updates of log indexes
+_index_lock = allocate_lock()
 
 
 class LogfileView(object):
-    """A read only view to the logfile."""
+    """A read only view to the logfile.  A page has `per_page` records,
+    they are found with the :class:`LogIndex` of the logfile.
+    """
 
     def __init__(self, filename, per_page=100):
         self.filename = filename
         self.per_page = per_page
+        self.index = LogIndex(filename)
 
-    def get_page(self, number):
-        """Return a single page from the log."""
-        if not path.exists(self.filename):
-            lines = []
+    def get_page(self, number, level=None, module=None):
+        """Return a single page from the log.  If `level` is given only
+        records of that level or higher are shown, `module` limits them to
+        a single module.
+        """
+        index = self.index.update()
+        if index is None:
+            records = []
             has_more = False
         else:
-            f = file(self.filename)
+            log = file(self.filename, 'rb')
             try:
-                lines, has_more = tail(f, self.per_page,
-                                       self.per_page * (number - 1))
+                if level is None and module is None:
+                    entries, has_more = self._get_entries(index, number)
+                else:
+                    entries, has_more = self._get_filtered_entries(
+                        index, number, LEVELS.get(level, 0),
+                        module and LogIndex.module_checksum(module))
+                records = self._read_records(log, entries)
             finally:
-                f.close()
-        if not lines and number != 1:
+                log.close()
+                index.close()
+        if not records and number != 1:
             raise NoSuchPage()
-        return LogfilePage(lines, has_more, number)
+        return LogfilePage(records, has_more, number)
+
+    def _count(self, index):
+        index.seek(0, 2)
+        return (index.tell() - LogIndex.header.size) // LogIndex.entry.size
+
+    def _read_entries(self, index, start, end):
+        entry = LogIndex.entry
+        index.seek(LogIndex.header.size + start * entry.size)
+        data = index.read((end - start) * entry.size)
+        return [entry.unpack_from(data, pos) for pos
+                in xrange(0, len(data), entry.size)]
+
+    def _read_records(self, log, entries):
+        """Reads the records of a list of ``(start, stop)`` offsets.
+        Adjacent records are read at once.
+        """
+        records = []
+        pos = None
+        for start, stop in entries:
+            if start != pos:
+                log.seek(start)
+            records.append(log.read(stop - start))
+            pos = stop
+        return records
+
+    def _get_entries(self, index, number):
+        count = self._count(index)
+        end = count - self.per_page * (number - 1)
+        if end <= 0:
+            return [], False
+        start = max(end - self.per_page, 0)
+        offsets = [entry[0] for entry in
+                   self._read_entries(index, start, end + 1)]
+        if end == count:
+            offsets.append(self.index.indexed)
+        return zip(offsets, offsets[1:]), start > 0
+
+    def _get_filtered_entries(self, index, number, level, module,
+                              block_size=4096):
+        # walk backwards through the index until enough records matched
+        skip = self.per_page * (number - 1)
+        wanted = skip + self.per_page + 1
+        matches = []
+        end = self._count(index)
+        next_offset = self.index.indexed
+        while end > 0 and len(matches) < wanted:
+            start = max(end - block_size, 0)
+            for offset, record_level, record_module in \
+                    reversed(self._read_entries(index, start, end)):
+                # 255 marks unknown levels
+                if record_level != 255 and record_level >= level and \
+                   (module is None or record_module == module):
+                    matches.append((offset, next_offset))
+                    if len(matches) >= wanted:
+                        break
+                next_offset = offset
+            end = start
+        page = matches[skip:skip + self.per_page]
+        page.reverse()
+        return page, len(matches) > skip + self.per_page
 
 
 class UnboundLogging(Warning):
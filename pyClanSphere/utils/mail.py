@@ -42,18 +42,66 @@ def split_email(s):
     return p1, None
 
 
-def send_email(subject, text, to_addrs, quiet=True):
+def send_email(subject, text, to_addrs, quiet=True, queue=False):
     """Send a mail using the `EMail` class.  This will log the email instead
     if the application configuration wants to log email.
+
+    If `queue` is `True` and the mail queue is enabled, the mail is put
+    into the queue (see :mod:`pyClanSphere.utils.mailqueue`) and sent by
+    a worker later on.
     """
     e = EMail(subject, text, to_addrs)
     if e.app.cfg['log_email_only']:
         return e.log()
+    if queue and e.app.cfg['email_queue']:
+        return e.app.mail_queue.put(e)
     if quiet:
         return e.send_quiet()
     return e.send()
 
 
+def smtp_connect(cfg):
+    """Open a SMTP session with the settings from the given configuration,
+    including STARTTLS and login if configured.
+    """
+    try:
+        smtp = SMTP(cfg['smtp_host'], cfg['smtp_port'])
+    except SMTPException, e:
+        raise RuntimeError(str(e))
+
+    if cfg['smtp_use_tls']:
+        #smtp.set_debuglevel(1)
+        smtp.ehlo()
+        if not smtp.esmtp_features.has_key('starttls'):
+            # XXX: untranslated because python exceptions do not support
+            # unicode messages.
+            raise RuntimeError('TLS enabled but server does not '
+                               'support TLS')
+        smtp.starttls()
+        smtp.ehlo()
+
+    if cfg['smtp_user']:
+        try:
+            smtp.login(cfg['smtp_user'], cfg['smtp_password'])
+        except SMTPException, e:
+            raise RuntimeError(str(e))
+    return smtp
+
+
+def smtp_close(smtp, cfg):
+    """Close a session opened with :func:`smtp_connect`."""
+    if cfg['smtp_use_tls']:
+        # avoid false failure detection when the server closes
+        # the SMTP connection with TLS enabled
+        import socket
+        try:
+            smtp.quit()
+        except socket.sslerror:
+            pass
+    else:
+        smtp.quit()
+
+
 class EMail(object):
     """Represents one E-Mail message that can be sent."""
 
@@ -119,48 +167,23 @@ class EMail(object):
         finally:
             f.close()
 
-    def send(self):
-        """Send the message."""
+    def send(self, smtp=None):
+        """Send the message.  If a SMTP session is given it's used and
+        left open, otherwise a new session is opened for this message.
+        """
+        if smtp is not None:
+            return self._sendmail(smtp)
+        smtp = smtp_connect(self.app.cfg)
         try:
-            smtp = SMTP(self.app.cfg['smtp_host'], self.app.cfg['smtp_port'])
-        except SMTPException, e:
-            raise RuntimeError(str(e))
+            return self._sendmail(smtp)
+        finally:
+            smtp_close(smtp, self.app.cfg)
 
-        if self.app.cfg['smtp_use_tls']:
-            #smtp.set_debuglevel(1)
-            smtp.ehlo()
-            if not smtp.esmtp_features.has_key('starttls'):
-                # XXX: untranslated because python exceptions do not support
-                # unicode messages.
-                raise RuntimeError('TLS enabled but server does not '
-                                   'support TLS')
-            smtp.starttls()
-            smtp.ehlo()
-
-        if self.app.cfg['smtp_user']:
-            try:
-                smtp.login(self.app.cfg['smtp_user'],
-                           self.app.cfg['smtp_password'])
-            except SMTPException, e:
-                raise RuntimeError(str(e))
-
-        msgtext = self.format()
+    def _sendmail(self, smtp):
         try:
-            try:
-                return smtp.sendmail(self.from_addr, self.to_addrs, msgtext)
-            except SMTPException, e:
-                raise RuntimeError(str(e))
-        finally:
-            if self.app.cfg['smtp_use_tls']:
-                # avoid false failure detection when the server closes
-                # the SMTP connection with TLS enabled
-                import socket
-                try:
-                    smtp.quit()
-                except socket.sslerror:
-                    pass
-            else:
-                smtp.quit()
+            return smtp.sendmail(self.from_addr, self.to_addrs, self.format())
+        except SMTPException, e:
+            raise RuntimeError(str(e))
 
     def send_quiet(self):
         """Send the message, swallowing exceptions."""
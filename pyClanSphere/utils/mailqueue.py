@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.utils.mailqueue
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    A spool directory for outgoing mails.
+
+    Mails that don't have to go out during the request (notifications) are
+    written to the ``mailqueue`` folder of the instance and delivered by
+    workers.  A worker reuses one SMTP session for all mails that are due
+    and retries failed deliveries with an increasing delay.  Mails that
+    still fail after `MAX_ATTEMPTS` are moved to ``mailqueue/failed``.
+
+    Workers are either threads of the application process (see the
+    ``email_queue_workers`` setting) or the ``send-mails`` script, several
+    of them can work on the same queue.  A worker claims a mail by renaming
+    its file, which is atomic.
+
+    :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+from os import path
+from thread import allocate_lock
+from threading import Thread
+from time import time, sleep
+from weakref import ref
+
+from pyClanSphere.utils import dump_json, load_json, log
+from pyClanSphere.utils.crypto import gen_random_identifier
+from pyClanSphere.utils.mail import EMail, smtp_connect, smtp_close
+
+
+#: number of delivery attempts before a mail is given up
+MAX_ATTEMPTS = 8
+
+#: delay before the first retry in seconds, doubled with every attempt
+RETRY_DELAY = 60
+
+#: claimed mails that were not finished after this many seconds belong to
+#: a worker that died and are put back into the queue
+STALE_CLAIM = 60 * 60
+
+
+class MailQueue(object):
+    """The mail queue of an application."""
+
+    def __init__(self, app):
+        self.app = app
+        self.folder = path.join(app.instance_folder, 'mailqueue')
+        self.failed_folder = path.join(self.folder, 'failed')
+        self._lock = allocate_lock()
+        self._workers_started = False
+
+    def put(self, email):
+        """Queue an `EMail` for delivery."""
+        if not path.isdir(self.failed_folder):
+            try:
+                os.makedirs(self.failed_folder)
+            except OSError:
+                # another process created it in the meantime
+                pass
+        now = time()
+        name = '%d-%s' % (now * 1000, gen_random_identifier(8))
+        data = dump_json({
+            'subject':          email.subject,
+            'text':             email.text,
+            'to_addrs':         email.to_addrs,
+            'attempts':         0,
+            'due':              now
+        })
+        filename = path.join(self.folder, name)
+        f = open(filename + '.tmp', 'w')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        os.rename(filename + '.tmp', filename + '.mail')
+        self.start_workers()
+
+    def due_mails(self):
+        """Return the filenames of the mails that are due, oldest first."""
+        if not path.isdir(self.folder):
+            return []
+        now = time()
+        result = []
+        for filename in sorted(os.listdir(self.folder)):
+            fullname = path.join(self.folder, filename)
+            if filename.endswith('.sending'):
+                # put back mails of crashed workers
+                try:
+                    if path.getmtime(fullname) < now - STALE_CLAIM:
+                        os.rename(fullname, fullname[:-8] + '.mail')
+                        result.append(filename[:-8] + '.mail')
+                except OSError:
+                    pass
+            elif filename.endswith('.mail'):
+                result.append(filename)
+        return result
+
+    def _claim(self, filename):
+        fullname = path.join(self.folder, filename)
+        claimed = fullname[:-5] + '.sending'
+        try:
+            os.rename(fullname, claimed)
+        except OSError:
+            # another worker was faster
+            return None, None
+        f = open(claimed)
+        try:
+            data = load_json(f.read())
+        finally:
+            f.close()
+        if data['due'] > time():
+            os.rename(claimed, fullname)
+            return None, None
+        # touch it so that other workers know that we are still alive
+        os.utime(claimed, None)
+        return claimed, data
+
+    def _retry(self, claimed, data, error):
+        data['attempts'] += 1
+        if data['attempts'] >= MAX_ATTEMPTS:
+            log.error(u'Giving up on mail to %s: %s' % (
+                      u', '.join(data['to_addrs']), error), 'mail')
+            target = path.join(self.failed_folder,
+                               path.basename(claimed)[:-8] + '.mail')
+        else:
+            data['due'] = time() + RETRY_DELAY * 2 ** (data['attempts'] - 1)
+            target = claimed[:-8] + '.mail'
+        f = open(claimed, 'w')
+        try:
+            f.write(dump_json(data))
+        finally:
+            f.close()
+        os.rename(claimed, target)
+
+    def process(self, limit=None):
+        """Deliver the due mails (at most `limit`) with a single SMTP
+        session.  Returns the number of mails sent.
+        """
+        cfg = self.app.cfg
+        smtp = None
+        sent = 0
+        try:
+            for filename in self.due_mails():
+                if limit is not None and sent >= limit:
+                    break
+                claimed, data = self._claim(filename)
+                if claimed is None:
+                    continue
+                email = EMail(data['subject'], data['text'],
+                              data['to_addrs'])
+                try:
+                    if smtp is None:
+                        smtp = smtp_connect(cfg)
+                    refused = email.send(smtp)
+                except Exception, e:
+                    self._retry(claimed, data, e)
+                    if smtp is not None:
+                        # the session might be broken, start a new one
+                        try:
+                            smtp_close(smtp, cfg)
+                        except Exception:
+                            pass
+                        smtp = None
+                    continue
+                if refused:
+                    log.warning(u'Mail server refused recipients %s' %
+                                u', '.join(refused), 'mail')
+                os.remove(claimed)
+                sent += 1
+        finally:
+            if smtp is not None:
+                try:
+                    smtp_close(smtp, cfg)
+                except Exception:
+                    pass
+        return sent
+
+    def run(self, interval=10):
+        """Deliver mails forever, looking for new ones every `interval`
+        seconds.
+        """
+        while 1:
+            try:
+                self.process()
+            except Exception:
+                log.exception('Delivering queued mails failed', 'mail')
+            sleep(interval)
+
+    def start_workers(self):
+        """Start the worker threads configured with ``email_queue_workers``
+        unless they are running already.
+        """
+        count = self.app.cfg['email_queue_workers']
+        if self._workers_started or not count:
+            return
+        self._lock.acquire()
+        try:
+            if self._workers_started:
+                return
+            for idx in xrange(count):
+                thread = Thread(target=_work, args=(ref(self), sleep),
+                                name='pyClanSphere mail worker %d' % idx)
+                thread.setDaemon(True)
+                thread.start()
+            self._workers_started = True
+        finally:
+            self._lock.release()
+
+
+def _work(queue_ref, sleep, interval=10):
+    # like the visit writer, only a weak reference is kept so that the
+    # thread ends if the application is unloaded.
+    while 1:
+        queue = queue_ref()
+        if queue is None:
+            return
+        try:
+            queue.process()
+        except Exception:
+            pass
+        queue = None
+        sleep(interval)
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.utils.markup
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Rendering of user supplied texts (BBCode and smileys) to HTML.
+
+    The smiley table is compiled into a single regular expression once and
+    smileys are replaced while the BBCode parser escapes the text between
+    the tags, so a text is parsed exactly once.  Code and noparse blocks
+    keep their smiley codes.
+
+    Models that show rendered texts (board posts, news and shouts) store
+    the HTML next to the source text, see :class:`RenderedText`.  If the
+    output of the renderer changes, bump :data:`RENDERER_VERSION` and the
+    stored HTML is replaced the next time it is shown.
+
+    :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+import re
+from copy import copy
+
+from jinja2 import Markup
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.attributes import set_committed_value
+
+from pyClanSphere._ext.postmarkup import _cosmetic_replace
+from pyClanSphere.database import db
+
+
+#: version of the rendered output, stored HTML of older versions is
+#: rendered again
+RENDERER_VERSION = 1
+
+
+class SmileyTable(object):
+    """The smileys of a smiley `lib` compiled into one regular expression.
+
+    Codes like ``:smile:`` are replaced anywhere, all others like ``:-)``
+    only if they stand between whitespace.
+    """
+
+    def __init__(self, smiley_lib):
+        self.tags = {}
+        enclosed = []
+        standalone = []
+        for key, (image, alt) in smiley_lib.smilies.iteritems():
+            self.tags[key] = smiley_lib.get_tag(image, alt)
+            if len(key) > 2 and key[0] == key[-1] == ':':
+                enclosed.append(key)
+            else:
+                standalone.append(key)
+        alternatives = []
+        if standalone:
+            alternatives.append(r'(?<!\S)(?:%s)(?!\S)' % self._join(standalone))
+        if enclosed:
+            alternatives.append(self._join(enclosed))
+        self.regex = alternatives and re.compile(u'|'.join(alternatives),
+                                                 re.UNICODE) or None
+
+    @staticmethod
+    def _join(keys):
+        # longest first, so that :-)) is not taken for :-)
+        return u'|'.join(re.escape(key) for key in
+                         sorted(keys, key=len, reverse=True))
+
+    def replace(self, text, escape):
+        """Replace the smileys in `text`, the text around them is passed
+        through `escape`.
+        """
+        if self.regex is None:
+            return escape(text)
+        result = []
+        pos = 0
+        for match in self.regex.finditer(text):
+            result.append(escape(text[pos:match.start()]))
+            result.append(self.tags[match.group()])
+            pos = match.end()
+        result.append(escape(text[pos:]))
+        return u''.join(result)
+
+
+class Renderer(object):
+    """Renders texts with BBCode and smileys.  `bbcode_parser` is a
+    postmarkup parser, plugins may have added tags to it already.
+    """
+
+    def __init__(self, smiley_lib, bbcode_parser):
+        self.smileys = SmileyTable(smiley_lib)
+        self.bbcode_parser = bbcode_parser
+
+        # a copy of the parser that replaces smileys while escaping text
+        # nodes.  The cosmetic replacements have to be done here as well as
+        # the parser would apply them to the generated image tags too.
+        escape = bbcode_parser.standard_replace
+        escape_no_break = bbcode_parser.standard_replace_no_break
+        self.pretty_parser = copy(bbcode_parser)
+        self.pretty_parser.standard_replace = lambda text: \
+            self.smileys.replace(text, lambda s: _cosmetic_replace(escape(s)))
+        self.pretty_parser.standard_replace_no_break = lambda text: \
+            self.smileys.replace(text,
+                                 lambda s: _cosmetic_replace(escape_no_break(s)))
+
+    def bbcode(self, text):
+        """Render BBCode only."""
+        if text is None:
+            return Markup(u'')
+        return Markup(self.bbcode_parser(text))
+
+    def smiley(self, text):
+        """Escape `text` and replace smileys only."""
+        if text is None:
+            return Markup(u'')
+        return Markup(self.smileys.replace(text, lambda s: Markup.escape(s)))
+
+    def prettify(self, text):
+        """Render BBCode and smileys in one pass."""
+        if text is None:
+            return Markup(u'')
+        return Markup(self.pretty_parser(text, cosmetic_replace=False))
+
+
+def prettify(text):
+    """Render `text` with the renderer of the application."""
+    from pyClanSphere.application import get_application
+    return get_application().markup.prettify(text)
+
+
+class RenderedText(object):
+    """Mixin for models whose `text` column is shown prettified.  The mapped
+    table needs the columns ``text_html`` and ``text_html_version`` and the
+    ``text`` column has to be mapped as synonym of ``_text``::
+
+        'text':     db.synonym('_text', map_column=True)
+
+    Setting the text renders it, :attr:`html` returns the stored result.
+    """
+
+    def _get_text(self):
+        return self._text
+
+    def _set_text(self, value):
+        self._text = value
+        if value is None:
+            self.text_html = None
+        else:
+            self.text_html = unicode(prettify(value))
+        self.text_html_version = RENDERER_VERSION
+
+    text = property(_get_text, _set_text)
+
+    @property
+    def html(self):
+        """The rendered text."""
+        if self.text_html is not None and \
+           self.text_html_version == RENDERER_VERSION:
+            return Markup(self.text_html)
+        html = prettify(self._text)
+        self._store_html(html)
+        return html
+
+    def _store_html(self, html):
+        """Remember HTML rendered for a stale or missing version without
+        making the object dirty and write it to the database.
+        """
+        set_committed_value(self, 'text_html', unicode(html))
+        set_committed_value(self, 'text_html_version', RENDERER_VERSION)
+        mapper = db.object_mapper(self)
+        key = mapper.primary_key_from_instance(self)
+        if None in key:
+            return
+        table = mapper.local_table
+        clause = db.and_(*[column == value for column, value
+                           in zip(mapper.primary_key, key)])
+        # written outside of the session so that the result is kept even if
+        # the request does not commit.  It's a cache, failing is fine.
+        try:
+            db.get_engine().execute(table.update(clause, values={
+                'text_html':            unicode(html),
+                'text_html_version':    RENDERER_VERSION
+            }))
+        except SQLAlchemyError:
+            pass
@@ -16,20 +16,36 @@ from jinja2 import Markup
 from pyClanSphere.i18n import _
 
 class Pagination(object):
-    """Pagination helper."""
+    """Pagination helper.
+
+    If the query was paginated with a sort key (see
+    :meth:`pyClanSphere.database.Query.get_page`) `prev_cursor` and
+    `next_cursor` are added to the links of the adjacent pages.  The
+    `total` may be `None` if it was not counted, only the previous and
+    next links are generated then and `has_next` tells if there is a
+    next page.
+    """
 
     _skip_theme_defaults = False
 
     def __init__(self, endpoint, page, per_page, total, url_args=None,
-                 post_id=None):
+                 post_id=None, prev_cursor=None, next_cursor=None,
+                 has_next=None):
         self.endpoint = endpoint
         self.page = page
         self.per_page = per_page
         self.total = total
-        self.pages = int(math.ceil(self.total / float(self.per_page)))
+        if total is None:
+            self.pages = None
+            self.has_next = bool(has_next)
+        else:
+            self.pages = int(math.ceil(self.total / float(self.per_page)))
+            self.has_next = page < self.pages
         self.post_id = post_id
         self.url_args = url_args or {}
-        self.necessary = self.pages > 1
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+        self.necessary = page > 1 or self.has_next
 
     def __unicode__(self):
         return self.generate()
@@ -73,18 +89,23 @@ class Pagination(object):
         result = []
         prev = None
         next = None
-        get_link = lambda x: url_for(self.endpoint, page=x,
-                                     per_page=self.per_page,
-                                     post_id=self.post_id, **self.url_args)
-
-        if simple:
+        def get_link(num):
+            url_args = dict(self.url_args)
+            if num == self.page + 1 and self.next_cursor is not None:
+                url_args['after'] = self.next_cursor
+            elif num == self.page - 1 > 1 and self.prev_cursor is not None:
+                url_args['before'] = self.prev_cursor
+            return url_for(self.endpoint, page=num, per_page=self.per_page,
+                           post_id=self.post_id, **url_args)
+
+        if simple or self.pages is None:
             result.append(active % {
                 'url':      get_link(self.page),
                 'page':     self.page
             })
             if self.page > 1:
                 prev = self.page - 1
-            if self.page < self.pages:
+            if self.has_next:
                 next = self.page + 1
         else:
             for num in xrange(1, self.pages + 1):
@@ -109,6 +130,11 @@ class Pagination(object):
                     was_ellipsis = True
                     result.append(ellipsis)
 
+        # without a total there are no page numbers to follow, so the
+        # previous and next links are always shown
+        if self.pages is None:
+            prev_link = next_link = True
+
         if next_link:
             if next is not None:
                 result.append(u' <a href="%s" class="next">%s</a>' %
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.utils.perf
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Performance numbers of requests.
+
+    Every request gets a :class:`RequestStats` object (``request.stats``)
+    that collects the time spent in the phases of the request, the number
+    and duration of database queries and the cache hits, misses and writes.  It's
+    cheap enough to be always on.  At the end of the request the numbers
+    are added to the :class:`PerfMonitor` of the application which sums
+    them up per endpoint for the admin panel and the ``perf_stats``
+    service.  With the `perf_headers` setting they are also sent in a
+    ``Server-Timing`` header.
+
+    The phases are ``setup`` (request object and session), ``user``
+    (loading the user), ``match`` (URL matching), ``view`` (the view
+    function, including the rendering), ``render`` (templates), ``cache``
+    (cache lookups and writes, mostly part of the view) and ``session``
+    (saving the session).
+
+    The setup of the application itself is measured by a
+    :class:`StartupTimer` (``app.startup``).
+
+    :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+import sys
+import time
+from datetime import datetime
+from thread import allocate_lock
+
+from pyClanSphere.utils import local
+
+
+if sys.platform == 'win32':
+    _timer = time.clock
+else:
+    _timer = time.time
+
+
+#: the phases in the order they happen
+PHASES = ['setup', 'user', 'match', 'view', 'render', 'cache', 'session']
+
+
+class RequestStats(object):
+    """The performance numbers of a single request.  If `statements` is a
+    list the SQL statements of the queries and their parameters are
+    appended to it.
+    """
+
+    def __init__(self, statements=None):
+        self.started = _timer()
+        self.endpoint = None
+        self.phases = {}
+        self.total = None
+        self.queries = 0
+        self.query_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_writes = 0
+        self.statements = statements
+
+    def add(self, phase, seconds):
+        """Add time spent in a phase."""
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def add_query(self, seconds, statement=None, parameters=None):
+        """Count a database query."""
+        self.queries += 1
+        self.query_time += seconds
+        if self.statements is not None:
+            self.statements.append((statement, parameters))
+
+    def finish(self):
+        """Stop the clock for the request."""
+        self.total = _timer() - self.started
+
+    @property
+    def server_timing(self):
+        """The numbers as value of a ``Server-Timing`` header."""
+        items = ['%s;dur=%.2f' % (phase, self.phases[phase] * 1000)
+                 for phase in PHASES if phase in self.phases and
+                 phase != 'cache']
+        items.append('db;dur=%.2f;desc="%d queries"' % (
+            self.query_time * 1000, self.queries))
+        items.append('cache;dur=%.2f;desc="%d hits, %d misses, %d writes"' % (
+            self.phases.get('cache', 0.0) * 1000, self.cache_hits,
+            self.cache_misses, self.cache_writes))
+        if self.total is not None:
+            items.append('total;dur=%.2f' % (self.total * 1000))
+        return ', '.join(items)
+
+
+def get_stats():
+    """Return the stats of the current request or `None`."""
+    return getattr(getattr(local, 'request', None), 'stats', None)
+
+
+def timed(phase, func, *args, **kwargs):
+    """Call `func` and add the time it took to `phase` of the current
+    request.
+    """
+    stats = get_stats()
+    if stats is None:
+        return func(*args, **kwargs)
+    start = _timer()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        stats.add(phase, _timer() - start)
+
+
+class CacheStatsProxy(object):
+    """Wraps a werkzeug cache, adds the time spent in it to the ``cache``
+    phase of the current request and counts hits, misses and writes.
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self._cache, name)
+
+    def _read(self, method, keys, values):
+        rv = timed('cache', getattr(self._cache, method), *keys)
+        stats = get_stats()
+        if stats is not None:
+            for value in values(rv):
+                if value is None:
+                    stats.cache_misses += 1
+                else:
+                    stats.cache_hits += 1
+        return rv
+
+    def _write(self, method, *args):
+        stats = get_stats()
+        if stats is not None:
+            stats.cache_writes += 1
+        return timed('cache', getattr(self._cache, method), *args)
+
+    def get(self, key):
+        return self._read('get', (key,), lambda rv: (rv,))
+
+    def get_many(self, *keys):
+        return self._read('get_many', keys, list)
+
+    def get_dict(self, *keys):
+        return self._read('get_dict', keys, dict.values)
+
+    def set(self, key, value, timeout=None):
+        return self._write('set', key, value, timeout)
+
+    def add(self, key, value, timeout=None):
+        return self._write('add', key, value, timeout)
+
+    def set_many(self, mapping, timeout=None):
+        return self._write('set_many', mapping, timeout)
+
+    def inc(self, key, delta=1):
+        return self._write('inc', key, delta)
+
+    def dec(self, key, delta=1):
+        return self._write('dec', key, delta)
+
+    def delete(self, key):
+        return self._write('delete', key)
+
+    def delete_many(self, *keys):
+        return self._write('delete_many', *keys)
+
+
+class EndpointStats(object):
+    """The summed up numbers of the requests to an endpoint."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.requests = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self.query_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_writes = 0
+
+    def add(self, stats):
+        self.requests += 1
+        self.total += stats.total
+        self.max = max(self.max, stats.total)
+        for phase, seconds in stats.phases.iteritems():
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        self.queries += stats.queries
+        self.query_time += stats.query_time
+        self.cache_hits += stats.cache_hits
+        self.cache_misses += stats.cache_misses
+        self.cache_writes += stats.cache_writes
+
+    @property
+    def average(self):
+        return self.total / self.requests
+
+    @property
+    def queries_per_request(self):
+        return self.queries / float(self.requests)
+
+    @property
+    def cache_hit_ratio(self):
+        """Hits of all cache lookups or `None` if there were none."""
+        lookups = self.cache_hits + self.cache_misses
+        if not lookups:
+            return None
+        return self.cache_hits / float(lookups)
+
+    def to_dict(self):
+        """The numbers for the JSON service, times in milliseconds."""
+        return {
+            'endpoint':             self.endpoint,
+            'requests':             self.requests,
+            'total_ms':             self.total * 1000,
+            'average_ms':           self.average * 1000,
+            'max_ms':               self.max * 1000,
+            'phases_ms':            dict((phase, seconds * 1000) for
+                                         phase, seconds in
+                                         self.phases.iteritems()),
+            'queries':              self.queries,
+            'queries_per_request':  self.queries_per_request,
+            'query_ms':             self.query_time * 1000,
+            'cache_hits':           self.cache_hits,
+            'cache_misses':         self.cache_misses,
+            'cache_writes':         self.cache_writes,
+            'cache_hit_ratio':      self.cache_hit_ratio
+        }
+
+
+class PerfMonitor(object):
+    """Sums up the numbers of all requests of the application since it was
+    started or :meth:`reset`.
+    """
+
+    def __init__(self):
+        self._lock = allocate_lock()
+        #: if this is a list, the statements of the queries of all
+        #: requests are collected in it (see :mod:`pyClanSphere.upgrades.audit`)
+        self.statements = None
+        self.reset()
+
+    def reset(self):
+        self._lock.acquire()
+        try:
+            self.since = datetime.utcnow()
+            self.endpoints = {}
+        finally:
+            self._lock.release()
+
+    def record(self, stats):
+        """Add the numbers of a finished request."""
+        endpoint = stats.endpoint or '<unknown>'
+        self._lock.acquire()
+        try:
+            entry = self.endpoints.get(endpoint)
+            if entry is None:
+                entry = self.endpoints[endpoint] = EndpointStats(endpoint)
+            entry.add(stats)
+        finally:
+            self._lock.release()
+
+    def get_endpoints(self, order_by='total'):
+        """The stats of all endpoints, the most expensive first."""
+        return sorted(self.endpoints.values(),
+                      key=lambda x: getattr(x, order_by), reverse=True)
+
+    def to_dict(self):
+        return {
+            'since':        self.since.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'endpoints':    [entry.to_dict() for entry
+                             in self.get_endpoints()]
+        }
+
+
+class StartupTimer(object):
+    """Measures the steps of the application setup.  Every call of
+    :meth:`lap` ends a step.
+    """
+
+    def __init__(self):
+        self.started = self.last = _timer()
+        self.finished = datetime.utcnow()
+        self.steps = []
+
+    def lap(self, step):
+        """End `step` and start the next one."""
+        now = _timer()
+        self.steps.append((step, now - self.last))
+        self.last = now
+        self.finished = datetime.utcnow()
+
+    @property
+    def total(self):
+        return self.last - self.started
+
+    def to_dict(self):
+        """The numbers for the JSON service, times in milliseconds."""
+        return {
+            'finished':     self.finished.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'total_ms':     self.total * 1000,
+            'steps_ms':     [(step, seconds * 1000) for step, seconds
+                             in self.steps]
+        }
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.utils.sendfile
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Sending files from the disk.
+
+    All files pyClanSphere serves itself (the shared exports, the built
+    assets, the avatars and downloads of plugins) go through the
+    :class:`FileSender` of the application.  It answers conditional
+    requests with ``304 Not Modified`` and the `file_serving` setting
+    decides who transfers the file:
+
+    ``python``
+        the file is streamed by the WSGI application, single byte ranges
+        are answered with ``206 Partial Content``.
+
+    ``sendfile``
+        only the headers are returned, the ``X-Sendfile`` header tells the
+        web server (Apache with mod_xsendfile, lighttpd) which file to send.
+
+    ``accel``
+        the ``X-Accel-Redirect`` header points nginx to an internal
+        location below the `file_serving_prefix`.  Files are only sent
+        from registered folders, the file roots
+        (:meth:`~pyClanSphere.application.pyClanSphere.add_file_root`),
+        ``scripts/create-nginx-config`` emits a location for each.
+
+    In the last two modes the web server takes care of ranges and the
+    worker is free as soon as the headers are out.
+
+    :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import re
+import sys
+import mimetypes
+import posixpath
+from datetime import datetime
+from time import time
+from zlib import adler32
+
+from werkzeug import is_resource_modified, wrap_file, http_date, \
+     parse_date, quote_etag, unquote_etag, url_quote
+
+
+#: the values of the `file_serving` setting
+FILE_SERVING_MODES = ('python', 'sendfile', 'accel')
+
+#: the size of the blocks ranges are read in
+CHUNK_SIZE = 64 * 1024
+
+_range_re = re.compile(r'^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$')
+
+
+def parse_range(value, size):
+    """Parse the value of a ``Range`` header for a file of `size` bytes
+    into a ``(start, stop)`` tuple.  Returns `None` if the header is
+    invalid or asks for several ranges, then the whole file is sent.
+    Raises `ValueError` if the range is not satisfiable.
+
+    >>> parse_range('bytes=0-99', 1000)
+    (0, 100)
+    >>> parse_range('bytes=900-', 1000)
+    (900, 1000)
+    >>> parse_range('bytes=-100', 1000)
+    (900, 1000)
+    >>> parse_range('bytes=500-2000', 1000)
+    (500, 1000)
+    >>> parse_range('bytes=0-1,5-6', 1000) is None
+    True
+    >>> parse_range('bytes=1000-', 1000)
+    Traceback (most recent call last):
+      ...
+    ValueError: range not satisfiable
+    """
+    match = _range_re.match(value)
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        length = int(last)
+        if not length:
+            raise ValueError('range not satisfiable')
+        return max(size - length, 0), size
+    start = int(first)
+    if last:
+        if int(last) < start:
+            return None
+        stop = min(int(last) + 1, size)
+    else:
+        stop = size
+    if start >= size:
+        raise ValueError('range not satisfiable')
+    return start, stop
+
+
+def make_etag(filename, mtime, size):
+    """The entity tag of a file."""
+    return 'file-%d-%d-%x' % (mtime, size, adler32(filename) & 0xffffffff)
+
+
+class FileRangeWrapper(object):
+    """Iterates over a part of a file and closes it."""
+
+    def __init__(self, f, start, stop, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.start = start
+        self.stop = stop
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        self.f.seek(self.start)
+        remaining = self.stop - self.start
+        while remaining > 0:
+            chunk = self.f.read(min(self.chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        self.f.close()
+
+
+class FileSender(object):
+    """Sends files the way the `file_serving` setting asks for.  `roots`
+    maps the names of the internal nginx locations to folders.
+    """
+
+    def __init__(self, mode='python', roots=None, internal_prefix='/_internal'):
+        if mode not in FILE_SERVING_MODES:
+            raise ValueError('unknown file serving mode %r' % mode)
+        self.mode = mode
+        self.roots = dict(roots or ())
+        self.internal_prefix = '/' + url_quote(internal_prefix.strip('/'),
+                                               safe='/')
+        # the longest folder first, roots may be nested
+        self._folders = sorted(((os.path.abspath(folder) + os.sep, name)
+                                for name, folder in self.roots.iteritems()),
+                               reverse=True)
+
+    def get_internal_url(self, filename):
+        """Return the URL of the internal nginx location of `filename` or
+        `None` if it's not in one of the roots.
+        """
+        filename = os.path.abspath(filename)
+        for folder, name in self._folders:
+            if filename.startswith(folder):
+                path = filename[len(folder):].replace(os.sep, '/')
+                return '%s/%s/%s' % (self.internal_prefix, name,
+                                     url_quote(path))
+
+    def _range_allowed(self, environ, etag, mtime):
+        """Check the ``If-Range`` header."""
+        value = environ.get('HTTP_IF_RANGE')
+        if not value:
+            return True
+        if value.strip().startswith(('"', 'W/')):
+            return unquote_etag(value.strip())[0] == etag
+        return parse_date(value) == datetime.utcfromtimestamp(mtime)
+
+    def __call__(self, environ, start_response, filename, mimetype=None,
+                 cache_timeout=None, headers=None):
+        """Send the file as response to a WSGI request.  `headers` are
+        additional headers (``Content-Disposition``, ``Content-Encoding``,
+        ...), with a `cache_timeout` in seconds the file may be cached
+        publicly that long.
+        """
+        st = os.stat(filename)
+        mtime = int(st.st_mtime)
+        size = st.st_size
+        etag = make_etag(filename, mtime, size)
+        if mimetype is None:
+            mimetype = mimetypes.guess_type(filename)[0] or \
+                       'application/octet-stream'
+        headers = list(headers or ()) + [
+            ('Content-Type', mimetype),
+            ('ETag', quote_etag(etag)),
+            ('Last-Modified', http_date(mtime)),
+            ('Accept-Ranges', 'bytes')
+        ]
+        if cache_timeout is not None:
+            headers += [
+                ('Cache-Control', 'public, max-age=%d' % cache_timeout),
+                ('Expires', http_date(time() + cache_timeout))
+            ]
+
+        method = environ['REQUEST_METHOD']
+        if method in ('GET', 'HEAD') and \
+           not is_resource_modified(environ, etag, last_modified=
+                                    datetime.utcfromtimestamp(mtime)):
+            start_response('304 Not Modified', headers)
+            return []
+
+        if self.mode == 'sendfile':
+            path = os.path.abspath(filename)
+            if isinstance(path, unicode):
+                path = path.encode(sys.getfilesystemencoding() or 'utf-8')
+            headers.append(('X-Sendfile', path))
+            start_response('200 OK', headers)
+            return []
+        elif self.mode == 'accel':
+            url = self.get_internal_url(filename)
+            if url is not None:
+                headers.append(('X-Accel-Redirect', url))
+                start_response('200 OK', headers)
+                return []
+
+        byte_range = None
+        if method == 'GET' and environ.get('HTTP_RANGE') and \
+           self._range_allowed(environ, etag, mtime):
+            try:
+                byte_range = parse_range(environ['HTTP_RANGE'], size)
+            except ValueError:
+                start_response('416 Requested Range Not Satisfiable',
+                               headers + [('Content-Range', 'bytes */%d' % size),
+                                          ('Content-Length', '0')])
+                return []
+
+        f = open(filename, 'rb')
+        if byte_range is None:
+            start_response('200 OK', headers + [('Content-Length', str(size))])
+            return wrap_file(environ, f)
+        start, stop = byte_range
+        start_response('206 Partial Content', headers + [
+            ('Content-Range', 'bytes %d-%d/%d' % (start, stop - 1, size)),
+            ('Content-Length', str(stop - start))
+        ])
+        return FileRangeWrapper(f, start, stop)
+
+
+def get_safe_filename(folder, path):
+    """Join a URL path with `folder`.  Returns `None` for paths that leave
+    the folder or point to hidden files, and for files that don't exist.
+
+    >>> get_safe_filename('/srv', '../etc/passwd') is None
+    True
+    """
+    parts = path.split('/')
+    for part in parts:
+        if not part or part.startswith('.') or \
+           os.path.sep in part or (os.path.altsep or '/') in part:
+            return None
+    filename = os.path.join(folder, *parts)
+    if os.path.isfile(filename):
+        return filename
+
+
+class SharedFilesMiddleware(object):
+    """Serves the shared exports (``/_shared/<name>``) with the file
+    sender of the application.
+    """
+
+    def __init__(self, app, exports, sender, cache_timeout=60 * 60 * 12):
+        self.app = app
+        self.exports = sorted(((prefix.rstrip('/') + '/', folder)
+                               for prefix, folder in exports.iteritems()),
+                              reverse=True)
+        self.sender = sender
+        self.cache_timeout = cache_timeout
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        for prefix, folder in self.exports:
+            if path.startswith(prefix):
+                filename = get_safe_filename(folder, path[len(prefix):])
+                if filename is not None:
+                    return self.sender(environ, start_response, filename,
+                                       cache_timeout=self.cache_timeout)
+        return self.app(environ, start_response)
+
+
+def send_file(request, filename, mimetype=None, as_attachment=None,
+              cache_timeout=None, headers=None):
+    """Return a response for a view that sends a file with the file sender
+    of the application.  If `as_attachment` is a filename browsers offer to
+    save the file under that name.
+    """
+    from pyClanSphere.application import Response
+    headers = list(headers or ())
+    if as_attachment:
+        headers.append(('Content-Disposition', 'attachment; filename="%s"' %
+                        posixpath.basename(as_attachment).replace('"', '')))
+    rv = []
+    def start_response(status, response_headers):
+        rv[:] = [status, response_headers]
+    body = request.app.file_sender(request.environ, start_response, filename,
+                                   mimetype, cache_timeout, headers)
+    status, response_headers = rv
+    return Response(body, status=status, headers=response_headers,
+                    direct_passthrough=True)
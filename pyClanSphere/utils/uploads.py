@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.utils.uploads
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Streaming storage for uploaded files.
+
+    The form parser writes every uploaded file into an :class:`UploadStream`
+    (see :meth:`pyClanSphere.application.Request._get_file_stream`).  It
+    sniffs the type of the file from its first bytes with the upload types
+    registered by :meth:`~pyClanSphere.application.pyClanSphere.add_upload_type`,
+    enforces the size limit of that type while the body comes in and hashes
+    the contents on the way.  Small files stay in memory, larger ones are
+    spooled to the ``uploads`` folder of the instance in chunks of
+    :data:`CHUNK_SIZE` bytes, :meth:`UploadStream.save` moves them to their
+    destination without copying and gives them the usual :data:`FILE_MODE`.
+
+    Files of no registered type are limited by the `default_max_size` of
+    the stream (the ``upload_max_size`` setting).
+
+    A file that exceeds its limit is not stored any further, the rest of
+    it is only read and dropped; `error` of the stream tells why the upload
+    was rejected.
+
+    :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import imghdr
+from StringIO import StringIO
+from tempfile import mkstemp
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+
+#: the folder in the instance folder larger uploads are spooled to
+UPLOAD_FOLDER = 'uploads'
+
+#: the number of bytes the type is sniffed from
+SNIFF_SIZE = 32
+
+#: the size of the blocks written to the spool file
+CHUNK_SIZE = 64 * 1024
+
+#: uploads up to this size are kept in memory
+SPOOL_SIZE = 256 * 1024
+
+
+def _get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+#: the mode of saved files as `open` creates them, spool files are only
+#: readable by the owner.  The web server may send the files directly.
+FILE_MODE = 0666 & ~_get_umask()
+
+
+class UploadType(object):
+    """A type of uploaded files.  `sniff` is called with the first
+    :data:`SNIFF_SIZE` bytes of a file (or the whole file if it's smaller)
+    and returns `True` if the file is of this type.  `max_size` is the
+    limit in bytes, a callable returning it or `None` for no limit.
+    """
+
+    def __init__(self, name, sniff, max_size=None):
+        self.name = name
+        self.sniff = sniff
+        self.max_size = max_size
+
+    def get_max_size(self):
+        if callable(self.max_size):
+            return self.max_size()
+        return self.max_size
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.name)
+
+
+def image_sniffer(imgtype):
+    """Return a sniffer for pictures of an `imghdr` type.
+
+    >>> image_sniffer('png')('\\x89PNG\\r\\n\\x1a\\n' + '\\x00' * 24)
+    True
+    >>> image_sniffer('gif')('\\x89PNG\\r\\n\\x1a\\n' + '\\x00' * 24)
+    False
+    """
+    def sniff(header):
+        return imghdr.what(None, header) == imgtype
+    return sniff
+
+
+def get_upload_folder(app):
+    """Return the folder uploads are spooled to."""
+    return os.path.join(app.instance_folder, UPLOAD_FOLDER)
+
+
+class UploadStream(object):
+    """A file the form parser writes an upload into, readable afterwards.
+
+    `type` is the name of the sniffed :class:`UploadType` (`None` if the
+    file matched none), `size` the number of bytes received and `digest`
+    the MD5 hex digest of the contents.
+    """
+
+    def __init__(self, types=(), folder=None, default_max_size=None,
+                 spool_size=SPOOL_SIZE, chunk_size=CHUNK_SIZE):
+        self.types = types
+        self.folder = folder
+        self.default_max_size = default_max_size
+        self.spool_size = spool_size
+        self.chunk_size = chunk_size
+        self.type = None
+        self.size = 0
+        self.error = None
+        self.max_size = None
+        self._sniffed = False
+        self._header = ''
+        self._hash = md5()
+        self._pending = []
+        self._pending_size = 0
+        self._file = StringIO()
+        self.filename = None
+
+    @property
+    def rejected(self):
+        return self.error is not None
+
+    @property
+    def digest(self):
+        return self._hash.hexdigest()
+
+    def _sniff(self):
+        self._sniffed = True
+        for upload_type in self.types:
+            if upload_type.sniff(self._header):
+                self.type = upload_type.name
+                self.max_size = upload_type.get_max_size()
+                break
+        else:
+            self.max_size = self.default_max_size
+        self._header = ''
+
+    def reject(self, error):
+        """Reject the upload, everything stored so far is dropped."""
+        self.error = error
+        self._pending = []
+        self._pending_size = 0
+        self.close()
+        self._file = StringIO()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.error is not None:
+            return
+        if not self._sniffed:
+            self._header += data[:SNIFF_SIZE - len(self._header)]
+            if len(self._header) >= SNIFF_SIZE:
+                self._sniff()
+        if self.max_size is not None and self.size > self.max_size:
+            self.reject('file too large (more than %d KB)' %
+                        (self.max_size // 1024))
+            return
+        self._hash.update(data)
+        self._pending.append(data)
+        self._pending_size += len(data)
+        while self._pending_size >= self.chunk_size:
+            self._flush(self.chunk_size)
+
+    def _flush(self, size=None):
+        data = ''.join(self._pending)
+        if size is None:
+            size = len(data)
+        chunk, rest = data[:size], data[size:]
+        self._pending = rest and [rest] or []
+        self._pending_size = len(rest)
+        if self.filename is None and self.folder is not None and \
+           self._file.tell() + len(chunk) > self.spool_size:
+            self._rollover()
+        self._file.write(chunk)
+
+    def _rollover(self):
+        """Move the data from memory into a spool file."""
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        fd, self.filename = mkstemp(dir=self.folder, prefix='upload')
+        f = os.fdopen(fd, 'w+b')
+        f.write(self._file.getvalue())
+        self._file = f
+
+    def seek(self, pos, whence=0):
+        # the parser seeks back to the start at the end of the file
+        if self._pending:
+            self._flush()
+        if not self._sniffed:
+            self._sniff()
+            if self.max_size is not None and self.size > self.max_size:
+                self.reject('file too large (more than %d KB)' %
+                            (self.max_size // 1024))
+        self._file.seek(pos, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def readlines(self, size=-1):
+        return self._file.readlines(size)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def save(self, path):
+        """Store the upload as `path`.  Spooled files are moved there."""
+        if self.filename is not None:
+            self._file.close()
+            os.rename(self.filename, path)
+            os.chmod(path, FILE_MODE)
+            self.filename = None
+            self._file = open(path, 'rb')
+            return
+        f = open(path, 'wb')
+        try:
+            f.write(self._file.getvalue())
+        finally:
+            f.close()
+
+    def close(self):
+        """Close the stream and remove the spool file."""
+        self._file.close()
+        if self.filename is not None:
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+            self.filename = None
+
+    def __del__(self):
+        self.close()
+
+
+def get_upload(storage):
+    """Return the :class:`UploadStream` of a `FileStorage` or `None` if it
+    was not parsed by pyClanSphere.
+    """
+    if isinstance(storage.stream, UploadStream):
+        return storage.stream
+
+
+def save_upload(storage, path):
+    """Save an uploaded `FileStorage` as `path`, spooled uploads are moved
+    instead of copied.
+    """
+    upload = get_upload(storage)
+    if upload is not None:
+        upload.save(path)
+    else:
+        storage.save(path)
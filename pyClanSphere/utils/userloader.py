@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.utils.userloader
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Request scoped batch loading of users.
+
+    Lists of posts, topics, news or shouts show the author of every item.
+    Instead of looking up each author on its own when the template asks for
+    it, the author ids of the whole list are collected up front and fetched
+    in a single ``IN`` query together with their groups and privileges.
+
+    The users end up in the identity map of the database session, so
+    `User.query.get` and many-to-one relations to users are answered without
+    another query for the rest of the request.
+
+    :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+from pyClanSphere.database import db
+from pyClanSphere.models import User
+from pyClanSphere.utils import local
+from pyClanSphere.utils.http import RequestLocal
+
+
+#: users loaded in the current request keyed by id, `None` for ids
+#: without a user (deleted accounts)
+_users = RequestLocal(loaded=dict)
+
+
+def _get_loaded():
+    # outside of requests (shell, scripts) nothing is remembered
+    if getattr(local, 'request_locals', None) is None:
+        return {}
+    return _users.loaded
+
+
+def load_users(user_ids):
+    """Load all users of `user_ids` that were not loaded in this request yet
+    with a single query and return a dict of the requested users keyed by
+    id.  Ids without a user are missing from the result.
+    """
+    loaded = _get_loaded()
+    wanted = set(user_ids)
+    wanted.discard(None)
+    missing = [user_id for user_id in wanted if user_id not in loaded]
+    if missing:
+        query = User.query.filter(User.id.in_(missing)).options(
+            db.eagerload('_own_privileges'),
+            db.eagerload_all('groups._privileges')
+        )
+        for user in query:
+            loaded[user.id] = user
+        for user_id in missing:
+            loaded.setdefault(user_id, None)
+    return dict((user_id, loaded[user_id]) for user_id in wanted
+                if loaded[user_id] is not None)
+
+
+def get_user(user_id):
+    """Return the user with the given id, or `None`, from the users loaded
+    in this request.  Falls back to loading it on its own.
+    """
+    return load_users([user_id]).get(user_id)
+
+
+def prefetch_authors(items, attribute='author_id'):
+    """Load the authors of all `items` at once.  `attribute` is the name of
+    the attribute holding the user id.  Returns the items to allow chaining.
+    """
+    load_users([getattr(item, attribute) for item in items
+                if item is not None])
+    return items
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+    pyClanSphere.utils.visits
+    ~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Buffered updates of the `last_visited` column of users.
+
+    Requests only note the visit in memory, a background thread writes all
+    visits of the last interval to the database in one batch.  Every user
+    is noted at most once per interval, so the timestamps are precise to
+    about a minute, which is all the "online" marker needs.
+
+    :copyright: (c) 2009 - 2010 by the pyClanSphere Team,
+                see AUTHORS for more details.
+    :license: BSD, see LICENSE for more details.
+"""
+import atexit
+from datetime import datetime, timedelta
+from thread import allocate_lock
+from threading import Thread
+from time import sleep
+from weakref import ref
+
+from pyClanSphere.database import db
+from pyClanSphere.schema import users
+
+
+class VisitRecorder(object):
+    """Collects visits and writes them to the database every `interval`
+    seconds.  The writer thread is started with the first visit, so that
+    it's created in the process that serves the requests.
+    """
+
+    def __init__(self, engine, interval=60):
+        self.engine = engine
+        self.interval = interval
+        self.pending = {}
+        self.noted = {}
+        self._lock = allocate_lock()
+        self._started = False
+
+    def record(self, user_id, now=None):
+        """Note that the user with the given id visited the page."""
+        if now is None:
+            now = datetime.utcnow()
+        # flush swaps the pending visits, a visit noted without the lock
+        # could end up in the dict it is writing already
+        self._lock.acquire()
+        try:
+            last = self.noted.get(user_id)
+            if last is not None and \
+               now - last < timedelta(seconds=self.interval):
+                return
+            self.noted[user_id] = self.pending[user_id] = now
+        finally:
+            self._lock.release()
+        if not self._started:
+            self._start()
+
+    def flush(self):
+        """Write all pending visits to the database."""
+        self._lock.acquire()
+        try:
+            pending, self.pending = self.pending, {}
+        finally:
+            self._lock.release()
+        if not pending:
+            return
+        try:
+            self.engine.execute(users.update(
+                users.c.user_id == db.bindparam('uid'),
+                values={'last_visited': db.bindparam('visited')}),
+                [{'uid': user_id, 'visited': visited}
+                 for user_id, visited in pending.iteritems()])
+        except:
+            # keep the visits for the next try
+            self._lock.acquire()
+            try:
+                for user_id, visited in pending.iteritems():
+                    self.pending.setdefault(user_id, visited)
+            finally:
+                self._lock.release()
+            raise
+
+        # forget users that were not seen for a whole interval, they are
+        # noted again with their next visit
+        threshold = datetime.utcnow() - timedelta(seconds=self.interval)
+        self._lock.acquire()
+        try:
+            for user_id, last in self.noted.items():
+                if last < threshold:
+                    del self.noted[user_id]
+        finally:
+            self._lock.release()
+
+    def _start(self):
+        self._lock.acquire()
+        try:
+            if self._started:
+                return
+            thread = Thread(target=_write_visits,
+                            args=(ref(self), self.interval, sleep),
+                            name='pyClanSphere visit writer')
+            thread.setDaemon(True)
+            thread.start()
+            atexit.register(_flush_at_exit, ref(self))
+            self._started = True
+        finally:
+            self._lock.release()
+
+
+def _write_visits(recorder_ref, interval, sleep):
+    # the recorder is only referenced weakly and `sleep` is passed in, so
+    # the thread ends if the application is unloaded (which clears the
+    # module globals).
+    while 1:
+        sleep(interval)
+        recorder = recorder_ref()
+        if recorder is None:
+            return
+        try:
+            recorder.flush()
+        except Exception:
+            # the database might be gone for a moment, try again later
+            pass
+        recorder = None
+
+
+def _flush_at_exit(recorder_ref):
+    recorder = recorder_ref()
+    if recorder is not None:
+        try:
+            recorder.flush()
+        except Exception:
+            pass
@@ -20,6 +20,7 @@ all_views = {
     'core/index':               core.index,
     'core/imprint':             core.imprint,
     'core/profile':             core.profile,
+    'core/avatar':              core.avatar,
     'core/serve_translations':  i18n.serve_javascript,
     'core/service_rsd':         core.service_rsd,
     'core/json_service':        core.json_service,
@@ -67,6 +68,7 @@ all_views = {
     'admin/maintenance':        admin.maintenance,
     'admin/information':        admin.information,
     'admin/log':                admin.log,
+    'admin/performance':        admin.performance,
     'admin/help':               admin.help,
 }
 
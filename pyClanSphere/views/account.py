@@ -219,7 +219,9 @@ def profile(request):
             picture = UserPicture(request.user)
             if picfile:
                 form.save_changes()
-                picture.place_file(picfile)
+                error = picture.place_file(picfile)
+                if error:
+                    flash(error, 'error')
             else:
                 pictype = request.user.userpictype
                 if not form['userpictype']:
@@ -27,6 +27,7 @@ from pyClanSphere.application import get_request, url_for, \
 from pyClanSphere.database import db, secure_database_uri
 from pyClanSphere.models import User, Group, IMAccount, UserPicture
 from pyClanSphere.utils import dump_json, load_json
+from pyClanSphere.utils.log import LEVELS
 from pyClanSphere.utils.validators import is_valid_email, is_valid_url, check
 from pyClanSphere.utils.admin import flash, require_admin_privilege
 from pyClanSphere.utils.text import gen_slug
@@ -40,7 +41,7 @@ from pyClanSphere.forms import LoginForm, ChangePasswordForm, PluginForm, \
      LogOptionsForm, BasicOptionsForm, URLOptionsForm, EditUserForm, DeleteUserForm, \
      CacheOptionsForm, EditGroupForm, DeleteGroupForm, ThemeOptionsForm, DeleteImportForm, ExportForm, \
      MaintenanceModeForm, RemovePluginForm, DeleteIMAccountForm, RecaptchaOptionsForm, \
-     make_config_form, make_notification_form
+     ResetPerformanceStatsForm, make_config_form, make_notification_form
 
 #: how many posts / comments should be displayed per page?
 PER_PAGE = 20
@@ -98,7 +99,8 @@ def render_admin_response(template_name, _active_menu_item=None, **values):
             ('maintenance', url_for('admin/maintenance'),
              _(u'Maintenance')),
             ('plugins', url_for('admin/plugins'), _(u'Plugins')),
-            ('log', url_for('admin/log'), _('Log'))
+            ('log', url_for('admin/log'), _('Log')),
+            ('performance', url_for('admin/performance'), _('Performance'))
         ]
 
     navigation_bar.append(('system', system_items[0][1], _(u'System'),
@@ -242,15 +244,21 @@ def edit_user(request, user_id=None):
             if user is None:
                 user = form.make_user()
                 if picfile and form['userpictype'] == 'Upload':
-                    picture.place_file(picfile)
+                    # the name of the picture is derived from the user id
+                    db.flush()
+                    error = UserPicture(user).place_file(picfile)
+                    if error:
+                        flash(error, 'error')
                 msg = _(u'User %s created successfully.')
                 icon = 'add'
             else:
-                picture = UserPicture(request.user)
+                picture = UserPicture(user)
                 if picfile:
                     form.save_changes()
                     if form['userpictype'] == 'Upload':
-                        picture.place_file(picfile)
+                        error = picture.place_file(picfile)
+                        if error:
+                            flash(error, 'error')
                 else:
                     pictype = user.userpictype
                     if not form['userpictype']:
@@ -693,14 +701,40 @@ def information(request):
 
 @require_admin_privilege(CLAN_ADMIN)
 def log(request, page):
-    page = request.app.log.view().get_page(page)
+    filters = {}
+    if request.args.get('level') in LEVELS:
+        filters['level'] = request.args['level']
+    if request.args.get('module'):
+        filters['module'] = request.args['module']
+    page = request.app.log.view().get_page(page, **filters)
     form = LogOptionsForm()
     if request.method == 'POST' and form.validate(request.form):
         form.apply()
         flash(_('Log changes saved.'), 'configure')
-        return redirect_to('admin/log', page=page.number)
+        return redirect_to('admin/log', page=page.number, **filters)
     return render_admin_response('admin/log.html', 'system.log',
-                                 page=page, form=form.as_widget())
+                                 page=page, filters=filters,
+                                 levels=sorted(LEVELS, key=LEVELS.get),
+                                 form=form.as_widget())
+
+
+@require_admin_privilege(CLAN_ADMIN)
+def performance(request):
+    """Show the performance numbers of the requests per endpoint and of
+    the application setup.
+    """
+    form = ResetPerformanceStatsForm()
+    if request.method == 'POST' and form.validate(request.form):
+        request.app.perf_monitor.reset()
+        flash(_(u'The performance numbers were reset.'), 'configure')
+        return redirect_to('admin/performance')
+    monitor = request.app.perf_monitor
+    return render_admin_response('admin/performance.html',
+                                 'system.performance',
+                                 since=monitor.since,
+                                 endpoints=monitor.get_endpoints(),
+                                 startup=request.app.startup,
+                                 form=form.as_widget())
 
 
 @require_admin_privilege()
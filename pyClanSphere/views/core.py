@@ -19,6 +19,8 @@ from pyClanSphere.i18n import _, ngettext
 from pyClanSphere.application import Response
 from pyClanSphere.models import User
 from pyClanSphere.utils import dump_json
+from pyClanSphere.utils.http import redirect_to
+from pyClanSphere.utils.avatars import create_variant
 from pyClanSphere.utils.xml import generate_rsd, dump_xml, AtomFeed
 
 @cache.response()
@@ -47,6 +49,17 @@ def profile(request, user_id):
     return render_response('profile.html', user=user, profileaddons=addons)
 
 
+def avatar(request, filename):
+    """Create a missing variant of a user picture and redirect to it, from
+    then on the asset middleware serves it.
+
+    :URL endpoint: ``core/avatar``
+    """
+    if create_variant(request.app, filename) is None:
+        raise NotFound()
+    return redirect_to('core/avatar', filename=filename)
+
+
 def json_service(req, identifier):
     """Handle a JSON service req."""
     handler = req.app._services.get(identifier)
@@ -171,7 +171,9 @@ class WebSetup(object):
                 real_name=u'',
                 description=u'',
                 extra={},
-                display_name='$username'
+                display_name='$username',
+                username_lower=value('admin_username').lower(),
+                display_name_lower=value('admin_username').lower()
             ).inserted_primary_key[0]
 
             # insert a privilege for the user